@@ -0,0 +1,271 @@
+"""
+analytics.py
+
+Bitrate, GOP and frame reordering statistics for a track, computed from the sample index built in track.py.
+Everything is derived from cumulative sums of the sample sizes and durations, with the per-sample work done by
+itertools.accumulate(), map() and bisect rather than by Python loops. If numpy is installed it is used for the
+sliding window, which is the one part that scales with the sample count, so that a track of several million samples
+takes a fraction of a second.
+
+"""
+import bisect
+import itertools
+import math
+import operator
+from array import array
+from collections import Counter
+from mp4.iso import SDTP_IS_LEADING, SDTP_SAMPLE_DEPENDS_ON, SDTP_SAMPLE_IS_DEPENDED_ON
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def bitrate_statistics(track, interval=1.0, window=1.0):
+    """
+    Returns a dict with the average bitrate, the bitrate of each successive interval (in seconds) and the peak
+    bitrate over a sliding window (in seconds) that starts at each sample. Bitrates are in bits per second.
+    """
+    dts = track.dts
+    sizes = track.sizes
+    timescale = track.timescale
+    stats = {'track_id': track.track_id, 'sample_count': len(sizes)}
+    if not sizes:
+        return stats
+    cum_sizes = _cumulative_sum(sizes)
+    end_time = dts[-1] + track.durations[-1]
+    duration = (end_time - dts[0]) / timescale
+    stats['duration'] = duration
+    stats['total_bytes'] = cum_sizes[-1]
+    stats['average_bitrate'] = cum_sizes[-1] * 8 / duration if duration else None
+
+    # samples are assigned to an interval by their decode time; an interval is at least one tick long
+    step = max(1, int(interval * timescale))
+    boundaries = range(dts[0], end_time + step, step)
+    bytes_before = array('Q', map(cum_sizes.__getitem__, map(bisect.bisect_left, itertools.repeat(dts), boundaries)))
+    interval_bytes = map(operator.sub, bytes_before[1:], bytes_before[:-1])
+    # the last interval ends with the track, so may be shorter than the rest
+    interval_lengths = [(min(end, end_time) - start) / timescale for start, end in zip(boundaries, boundaries[1:])]
+    stats['interval'] = interval
+    stats['interval_bitrates'] = list(map(operator.truediv, map(operator.mul, interval_bytes, itertools.repeat(8)),
+                                          interval_lengths))
+
+    # sliding window: bytes of all samples decoded in [dts[i], dts[i] + window) for every sample i
+    peak, peak_bytes = _peak_window(dts, cum_sizes, max(1, int(window * timescale)))
+    stats['window'] = window
+    stats['peak_bitrate'] = peak_bytes * 8 / window
+    stats['peak_time'] = (dts[peak] - dts[0]) / timescale
+    return stats
+
+
+def _cumulative_sum(values):
+    """ Returns an array('Q') of the len(values) + 1 running totals of values, starting with 0 """
+    if numpy is not None:
+        totals = array('Q', [0])
+        totals.frombytes(numpy.cumsum(numpy.frombuffer(values, dtype=numpy.uint64)).tobytes())
+        return totals
+    return array('Q', itertools.accumulate(values, initial=0))
+
+
+def _peak_window(dts, cum_sizes, width):
+    """
+    For each sample i, counts the bytes of the samples decoded in [dts[i], dts[i] + width).
+    Returns the index of the sample that starts the busiest window, and the byte count of that window.
+    """
+    if numpy is not None:
+        np_dts = numpy.frombuffer(dts, dtype=numpy.uint64)
+        np_cum_sizes = numpy.frombuffer(cum_sizes, dtype=numpy.uint64)
+        window_ends = numpy.searchsorted(np_dts, np_dts + numpy.uint64(width))
+        window_bytes = np_cum_sizes[window_ends] - np_cum_sizes[:-1]
+        peak = int(window_bytes.argmax())
+        return peak, int(window_bytes[peak])
+    # bisect is quicker on a list, where the values are already Python ints
+    dts = dts.tolist()
+    cum_sizes = cum_sizes.tolist()
+    window_ends = map(bisect.bisect_left, itertools.repeat(dts), map(operator.add, dts, itertools.repeat(width)))
+    window_bytes = list(map(operator.sub, map(cum_sizes.__getitem__, window_ends), cum_sizes[:-1]))
+    peak_bytes = max(window_bytes)
+    return window_bytes.index(peak_bytes), peak_bytes
+
+
+def gop_statistics(track):
+    """
+    Returns a dict describing the GOP structure implied by the sync samples: the distribution of GOP lengths (in
+    samples) and the mean and jitter of the interval between key frames (in seconds).
+    """
+    sync_samples = track.get_sync_samples()
+    stats = {'track_id': track.track_id, 'key_frame_count': len(sync_samples)}
+    if not sync_samples:
+        return stats
+    boundaries = sync_samples + [track.sample_count]
+    gop_lengths = list(map(operator.sub, boundaries[1:], boundaries[:-1]))
+    stats['gop_length_distribution'] = dict(sorted(Counter(gop_lengths).items()))
+    stats['min_gop_length'] = min(gop_lengths)
+    stats['max_gop_length'] = max(gop_lengths)
+    stats['mean_gop_length'] = sum(gop_lengths) / len(gop_lengths)
+    if len(sync_samples) > 1:
+        key_times = list(map(track.dts.__getitem__, sync_samples))
+        intervals = [t / track.timescale for t in map(operator.sub, key_times[1:], key_times[:-1])]
+        mean_interval = math.fsum(intervals) / len(intervals)
+        deviations = [i - mean_interval for i in intervals]
+        stats['mean_key_frame_interval'] = mean_interval
+        stats['key_frame_interval_jitter'] = math.sqrt(math.fsum(map(operator.mul, deviations, deviations)) /
+                                                       len(deviations))
+        stats['max_key_frame_interval_deviation'] = max(map(abs, deviations))
+    return stats
+
+
+def reorder_statistics(track, gops=False):
+    """
+    Returns a dict describing how far the presentation order of a track departs from its decode order, and, if the
+    track has dependency flags ('sdtp', or the sample flags of 'trun'), how its samples depend on each other.
+    The reorder depth of a sample is the number of samples before it in decode order that are presented after it,
+    i.e. how many decoded frames are held back while it is shown: 1 for the B-frames of IPBB..., 2 or more with
+    hierarchical B-frames.
+    A sample is disposable if no other sample depends on it. The dependency chain of a GOP is the number of samples
+    that have to be decoded to reach its last sample: the non-disposable samples before it, and itself.
+    With gops, the figures for every GOP (the samples from one sync sample up to the next) are listed too.
+    """
+    sample_count = track.sample_count
+    stats = {'track_id': track.track_id, 'sample_count': sample_count}
+    if not sample_count:
+        return stats
+    composition_offsets = track.composition_offsets
+    reorder_depths = _get_reorder_depths(track.dts, composition_offsets)
+    stats['max_reorder_depth'] = max(reorder_depths)
+    stats['reordered_sample_count'] = sample_count - reorder_depths.count(0)
+    stats['max_composition_offset'] = max(composition_offsets) / track.timescale
+
+    dependencies = track.dependencies
+    # unknown dependencies are all zero bits
+    stats['has_dependency_flags'] = dependencies.count(0) != sample_count
+    if stats['has_dependency_flags']:
+        # each a bytearray of 1 where the flag is set and 0 where it is not
+        disposable = dependencies.translate(SDTP_SAMPLE_IS_DEPENDED_ON).translate(_IS_TWO)
+        stats['disposable_count'] = disposable.count(1)
+        stats['independent_count'] = dependencies.translate(SDTP_SAMPLE_DEPENDS_ON).translate(_IS_TWO).count(1)
+        stats['leading_count'] = dependencies.translate(SDTP_IS_LEADING).translate(_IS_ONE_OR_THREE).count(1)
+    else:
+        disposable = None
+
+    gop_starts = track.get_sync_samples() or [0]
+    if gop_starts[0] != 0:
+        # samples before the first sync sample are counted as a GOP of their own
+        gop_starts.insert(0, 0)
+    gop_ends = gop_starts[1:] + [sample_count]
+    gop_depths = _get_maxima(reorder_depths, gop_starts)
+    if disposable is not None:
+        cum_disposable = list(itertools.accumulate(disposable, initial=0))
+        gop_disposable = list(map(operator.sub, map(cum_disposable.__getitem__, gop_ends),
+                                  map(cum_disposable.__getitem__, gop_starts)))
+        last_samples = [end - 1 for end in gop_ends]
+        disposable_before_last = map(operator.sub, map(cum_disposable.__getitem__, last_samples),
+                                     map(cum_disposable.__getitem__, gop_starts))
+        chains = list(map(operator.sub, map(operator.sub, gop_ends, gop_starts), disposable_before_last))
+        stats['max_dependency_chain'] = max(chains)
+    if gops:
+        gop_list = []
+        for i, (start, end) in enumerate(zip(gop_starts, gop_ends)):
+            gop = {'first_sample': start, 'sample_count': end - start, 'reorder_depth': gop_depths[i]}
+            if disposable is not None:
+                gop['disposable_count'] = gop_disposable[i]
+                gop['reference_count'] = end - start - gop_disposable[i]
+                gop['dependency_chain'] = chains[i]
+            gop_list.append(gop)
+        stats['gops'] = gop_list
+    return stats
+
+
+# the largest reorder window (twice the distance of a sample from its place in presentation order) searched
+# sample by sample; beyond it the reorder depths are counted with a merge sort
+MAX_REORDER_WINDOW = 64
+
+# translate tables turning the two-bit fields of a dependency byte into 1 where the field has the value of interest
+_IS_TWO = bytes([0, 0, 1, 0]) + bytes(252)
+_IS_ONE_OR_THREE = bytes([0, 1, 0, 1]) + bytes(252)
+
+
+def _get_reorder_depths(dts, composition_offsets):
+    """
+    Returns an array('q') of the reorder depth of every sample: the number of samples before it in decode order that
+    are presented after it. A stable sort keeps samples with the same presentation time in decode order, so they do
+    not count as presented after one another.
+    """
+    if numpy is not None:
+        pts = numpy.frombuffer(dts, dtype=numpy.int64) + numpy.frombuffer(composition_offsets, dtype=numpy.int64)
+        ranks = numpy.empty(len(pts), dtype=numpy.int64)
+        ranks[numpy.argsort(pts, kind='stable')] = numpy.arange(len(pts))
+        depths = numpy.arange(len(pts)) - _count_smaller_before(ranks)
+        return array('q', depths.tobytes())
+    pts = list(map(operator.add, dts, composition_offsets))
+    by_presentation = sorted(range(len(pts)), key=pts.__getitem__)
+    ranks = [0] * len(pts)
+    for rank, sample in enumerate(by_presentation):
+        ranks[sample] = rank
+    # a Fenwick tree counting the ranks seen so far, of samples earlier in decode order
+    tree = [0] * (len(pts) + 1)
+    depths = array('q')
+    for i, rank in enumerate(ranks):
+        smaller = 0
+        node = rank
+        while node > 0:
+            smaller += tree[node]
+            node &= node - 1
+        depths.append(i - smaller)
+        node = rank + 1
+        while node <= len(pts):
+            tree[node] += 1
+            node += node & -node
+    return depths
+
+
+def _count_smaller_before(ranks):
+    """
+    For a numpy array holding a permutation of 0 ... n - 1, returns a numpy array of the number of values before each
+    value that are smaller than it. Works as a bottom-up merge sort: at each level, the values in the right half of
+    every block are looked up in the sorted left half of the block with one searchsorted() over all the blocks.
+    """
+    n = len(ranks)
+    positions = numpy.arange(n)
+    displacement = int(numpy.abs(ranks - positions).max()) if n else 0
+    if displacement <= MAX_REORDER_WINDOW // 2:
+        # no value is more than displacement places from its own rank, so only a value fewer than twice that many
+        # places before another can be larger than it; compare each value with those before it in the window
+        larger = numpy.zeros(n, dtype=numpy.int64)
+        for distance in range(1, min(2 * displacement, n - 1) + 1):
+            larger[distance:] += ranks[:-distance] > ranks[distance:]
+        return positions - larger
+    counts = numpy.zeros(n, dtype=numpy.int64)
+    # the values of each block of width, sorted; sorting two sorted runs with a stable sort is a linear merge
+    merged = ranks.copy()
+    width = 1
+    while width < n:
+        blocks = positions // (2 * width)
+        in_right = positions % (2 * width) >= width
+        # keys that sort block by block, and within a block by value
+        left_keys = blocks[~in_right] * n + merged[~in_right]
+        right_keys = blocks * n + ranks
+        found = numpy.searchsorted(left_keys, right_keys[in_right]) - blocks[in_right] * width
+        counts[in_right] += found
+        merged = numpy.sort(blocks * n + merged, kind='stable') - blocks * n
+        width *= 2
+    return counts
+
+
+def _get_maxima(values, starts):
+    """ Returns the maximum of values within each run starting at one of starts and ending at the next """
+    if numpy is not None:
+        return numpy.maximum.reduceat(numpy.frombuffer(values, dtype=numpy.int64), starts).tolist()
+    ends = starts[1:] + [len(values)]
+    return [max(values[start:end]) for start, end in zip(starts, ends)]
+
+
+def analyze_track(track, interval=1.0, window=1.0):
+    """ Bitrate statistics for any track, plus GOP statistics for video tracks """
+    stats = {'handler_type': track.handler_type}
+    stats.update(bitrate_statistics(track, interval, window))
+    if track.handler_type == 'vide':
+        stats['gop'] = gop_statistics(track)
+        del stats['gop']['track_id']
+    return stats
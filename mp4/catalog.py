@@ -0,0 +1,267 @@
+"""
+catalog.py
+
+A catalog of the boxes of every MP4 file in a media library, kept in an SQLite database so that the library can be
+searched with SQL. Files are parsed with Mp4File in a pool of worker processes, and the database is written by this
+process alone, in transactions of CATALOG_BATCH_SIZE files. Updating the catalog only parses the files that are new,
+or whose size or modification time has changed since they were last catalogued.
+
+The database holds three tables:
+
+- files: file_id, path (absolute), size, mtime_ns, and error, the reason the file could not be parsed, or the
+  damaged regions of it that were passed over, if any
+- boxes: file_id, box_id (the number of the box in the file, depth first), parent_id (None for a top-level box),
+  depth, type, offset, size and header_size of each box
+- box_info: file_id, box_id, key and value of the box_info of each box, flattened so that a dict inside it adds
+  its keys after a '.' (e.g. 'entry_list.0.media_time' of an 'elst'), a list adds the index of each entry in the
+  same way and '<name>.length', and a list of more than MAX_FLATTENED_ENTRIES entries (e.g. a sample table) only
+  '<name>.length'. Values are stored as SQLite integers, reals, text or blobs, so they compare as numbers where
+  they are numbers.
+
+For example, the files with an H.264 High profile (100) stream of a level above 4.1:
+
+    SELECT DISTINCT path FROM files JOIN boxes USING (file_id)
+        JOIN box_info profile USING (file_id, box_id) JOIN box_info level USING (file_id, box_id)
+    WHERE type = 'avcC' AND profile.key = 'avc_profile_indication' AND profile.value = 100
+        AND level.key = 'avc_level_indication' AND level.value > 41
+
+and those with an edit list that does not start at media time 0:
+
+    SELECT DISTINCT path FROM files JOIN boxes USING (file_id) JOIN box_info USING (file_id, box_id)
+    WHERE type = 'elst' AND key = 'entry_list.0.media_time' AND value != 0
+
+"""
+import collections.abc
+import concurrent.futures
+import os
+import sqlite3
+import traceback
+from array import array
+from mp4.iso import Mp4File
+
+# the extensions of the files catalogued when a directory is given
+MP4_EXTENSIONS = ('.mp4', '.m4a', '.m4p', '.m4b', '.m4r', '.m4v')
+
+# files written to the database per transaction
+CATALOG_BATCH_SIZE = 64
+
+# a list in a box_info with more entries than this is only catalogued by its length
+MAX_FLATTENED_ENTRIES = 16
+
+# kept in PRAGMA user_version, for telling a database of an older layout
+CATALOG_SCHEMA_VERSION = 1
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    file_id INTEGER NOT NULL,
+    box_id INTEGER NOT NULL,
+    parent_id INTEGER,
+    depth INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    header_size INTEGER NOT NULL,
+    PRIMARY KEY (file_id, box_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS box_info (
+    file_id INTEGER NOT NULL,
+    box_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value
+);
+CREATE INDEX IF NOT EXISTS boxes_type ON boxes (type, file_id);
+CREATE INDEX IF NOT EXISTS box_info_key_value ON box_info (key, value);
+CREATE INDEX IF NOT EXISTS box_info_box ON box_info (file_id, box_id);
+"""
+
+# the range of an SQLite integer; a larger int is stored as text
+_MIN_SQL_INTEGER = -(1 << 63)
+_MAX_SQL_INTEGER = (1 << 63) - 1
+
+
+def open_catalog(database):
+    """ Returns an sqlite3 connection to the catalog in the file database, creating the tables if need be """
+    connection = sqlite3.connect(database)
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    if version not in (0, CATALOG_SCHEMA_VERSION):
+        connection.close()
+        raise ValueError('{} is a catalog of version {}, not {}'.format(database, version, CATALOG_SCHEMA_VERSION))
+    # readers (e.g. queries while the catalog is updated) are not blocked by the writer
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    connection.executescript(CATALOG_SCHEMA)
+    connection.execute('PRAGMA user_version = {}'.format(CATALOG_SCHEMA_VERSION))
+    return connection
+
+
+def find_files(paths, extensions=MP4_EXTENSIONS):
+    """
+    Returns the absolute path of each of paths that is a file, and of each file with one of extensions (compared
+    without regard to case) in the directories among paths and the directories below them, in sorted order
+    """
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, directory_names, filenames in os.walk(path):
+                found.update(os.path.abspath(os.path.join(directory, filename)) for filename in filenames
+                             if filename.lower().endswith(extensions))
+        else:
+            found.add(os.path.abspath(path))
+    return sorted(found)
+
+
+def update_catalog(database, paths, max_workers=None, prune=False, extensions=MP4_EXTENSIONS):
+    """
+    Catalogues the files found by find_files(paths, extensions) that are not in the catalog as they are now, parsing
+    them in a pool of max_workers processes. If prune is True, the files in the catalog that no longer exist are
+    removed from it. Returns a dict with the number of files indexed, unchanged, failed (indexed, but with an error)
+    and removed.
+    """
+    connection = open_catalog(database)
+    try:
+        catalogued = {path: (size, mtime_ns) for path, size, mtime_ns in
+                      connection.execute('SELECT path, size, mtime_ns FROM files')}
+        result = {'indexed': 0, 'unchanged': 0, 'failed': 0, 'removed': 0}
+        changed = []
+        for path in find_files(paths, extensions):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if catalogued.get(path) == (stat.st_size, stat.st_mtime_ns):
+                result['unchanged'] += 1
+            else:
+                changed.append(path)
+        for written, entry in enumerate(_index_files(changed, max_workers), 1):
+            write_entry(connection, entry)
+            if entry[1] is not None:
+                result['indexed'] += 1
+                result['failed'] += entry[3] is not None
+            if written % CATALOG_BATCH_SIZE == 0:
+                connection.commit()
+        connection.commit()
+        if prune:
+            result['removed'] = remove_files(connection, [path for path in catalogued if not os.path.exists(path)])
+        return result
+    finally:
+        connection.close()
+
+
+def remove_files(connection, paths):
+    """ Removes the files at paths from the catalog of connection. Returns the number of files removed. """
+    removed = 0
+    with connection:
+        for path in paths:
+            row = connection.execute('SELECT file_id FROM files WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                _delete_file(connection, row[0])
+                removed += 1
+    return removed
+
+
+def query(database, sql, parameters=()):
+    """ Returns the rows that the SQL statement sql gives on the catalog in the file database, as a list of tuples """
+    connection = open_catalog(database)
+    try:
+        return connection.execute(sql, parameters).fetchall()
+    finally:
+        connection.close()
+
+
+def _index_files(paths, max_workers):
+    """ Generator yielding the result of index_file() for each of paths, in order """
+    if max_workers == 1 or len(paths) <= 1:
+        yield from map(index_file, paths)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        chunksize = max(1, len(paths) // (4 * (max_workers or os.cpu_count() or 1)))
+        yield from executor.map(index_file, paths, chunksize=min(chunksize, CATALOG_BATCH_SIZE))
+
+
+def index_file(path):
+    """
+    Parses the file at path. Returns (path, stat, boxes, error), with the stat taken before parsing (so that a file
+    that changes while it is parsed is parsed again next time), the rows of the boxes and box_info tables without
+    the file_id, and the traceback if the file could not be parsed or the damaged regions passed over in parsing
+    it (see Mp4File), or stat None if it has gone.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path, None, [], traceback.format_exc()
+    try:
+        mp4file = Mp4File(path, recover=True)
+        damage = '; '.join('{size} bytes at {offset}: {error}'.format(**region) for region in mp4file.damaged_regions)
+        return path, stat, list(_get_box_rows(mp4file)), damage or None
+    except Exception:
+        return path, stat, [], traceback.format_exc()
+
+
+def _get_box_rows(mp4file):
+    """ Generator yielding (box row, box_info rows) of each box of mp4file, depth first """
+    box_ids = iter(range(1 << 62))
+
+    def walk(parent, parent_id, depth):
+        for box in parent.child_boxes:
+            box_id = next(box_ids)
+            yield ((box_id, parent_id, depth, box.type, box.start_of_box, box.size, box.header.header_size),
+                   [(box_id, key, value) for key, value in flatten_box_info(box.box_info)])
+            yield from walk(box, box_id, depth + 1)
+
+    return walk(mp4file, None, 0)
+
+
+def flatten_box_info(box_info, prefix=''):
+    """ Generator yielding (key, value) for the box_info of a box, flattened as described in the module docstring """
+    for key, value in box_info.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            yield from flatten_box_info(value, name + '.')
+        elif isinstance(value, (collections.abc.Sequence, array)) and not isinstance(value, (str, bytes, bytearray)):
+            yield name + '.length', len(value)
+            if len(value) <= MAX_FLATTENED_ENTRIES:
+                yield from flatten_box_info(dict(enumerate(value)), name + '.')
+        else:
+            yield name, _to_sql_value(value)
+
+
+def _to_sql_value(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value if _MIN_SQL_INTEGER <= value <= _MAX_SQL_INTEGER else str(value)
+    if value is None or isinstance(value, (float, str, bytes)):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return str(value)
+
+
+def write_entry(connection, entry):
+    """ Replaces the rows of the file of entry, a result of index_file(), in the catalog of connection """
+    path, stat, boxes, error = entry
+    row = connection.execute('SELECT file_id FROM files WHERE path = ?', (path,)).fetchone()
+    if row is not None:
+        _delete_file(connection, row[0])
+    if stat is None:
+        # the file went away before it could be parsed
+        return
+    file_id = connection.execute('INSERT INTO files (path, size, mtime_ns, error) VALUES (?, ?, ?, ?)',
+                                 (path, stat.st_size, stat.st_mtime_ns, error)).lastrowid
+    connection.executemany('INSERT INTO boxes VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           ((file_id,) + box_row for box_row, info_rows in boxes))
+    connection.executemany('INSERT INTO box_info VALUES (?, ?, ?, ?)',
+                           ((file_id,) + info_row for box_row, info_rows in boxes for info_row in info_rows))
+
+
+def _delete_file(connection, file_id):
+    connection.execute('DELETE FROM box_info WHERE file_id = ?', (file_id,))
+    connection.execute('DELETE FROM boxes WHERE file_id = ?', (file_id,))
+    connection.execute('DELETE FROM files WHERE file_id = ?', (file_id,))
@@ -3,8 +3,12 @@ core.py contains class definitions used by both iso.py and non_iso.py, namely cl
 that are used as parents for all the real, instantiated boxes. Also contains a header class definition.
 """
 import os
+import collections.abc
 from mp4.util import *
 
+# only the start of an 'mdat' is kept for the hex view
+MDAT_BYTES_SHOWN = 1000001
+
 
 class Mp4Box:
     """
@@ -20,14 +24,14 @@ class Mp4Box:
         self.box_info = {}
         self.byte_string = None
         # only top-level boxes contain an actual byte array for displaying the hex view, lower-level boxes simply
-        # take a slice from the top-level box.
+        # take a slice from the top-level box. For an Mp4File.from_buffer() it is a memoryview of the buffer.
         if parent.type == 'file':
             end_of_header = fp.tell()
             fp.seek(self.start_of_box)
-            if self.type == 'mdat' and self.size > 1000001:
-                self.byte_string = fp.read(1000001)
+            if self.type == 'mdat' and self.size > MDAT_BYTES_SHOWN:
+                self.byte_string = fp.read_view(MDAT_BYTES_SHOWN)
             else:
-                self.byte_string = fp.read(self.size)
+                self.byte_string = fp.read_view(self.size)
             fp.seek(end_of_header)
 
     @property
@@ -51,12 +55,28 @@ class Mp4Box:
         return top_box.byte_string[offset:offset + self.size]
 
 
+class SkippedBox(Mp4Box):
+    """ Stands in for a box that the box filter of the Mp4File excluded: only its header is read """
+    def __init__(self, fp, header, parent):
+        self.header = header
+        self.parent = parent
+        self.start_of_box = fp.tell() - self.header.header_size
+        self.child_boxes = []
+        self.box_info = {'message': 'Not decoded, as excluded by the box filter'}
+        self.byte_string = None
+        # a top-level box keeps just its header for the hex view
+        if parent.type == 'file':
+            fp.seek(self.start_of_box)
+            self.byte_string = fp.read_view(self.header.header_size)
+        fp.seek(self.start_of_box + self.size)
+
+
 class Mp4FullBox(Mp4Box):
     """ Derived from Mp4Box, but with version and flags.  """
     def __init__(self, fp, header, parent):
         """ The file pointer, fp will move forward 4 bytes """
         super().__init__(fp, header, parent)
-        four_bytes = read_u32(fp)
+        four_bytes = fp.u32()
         self.box_info = {'version': four_bytes // 16777216, 'flags': "{0:#08x}".format(four_bytes % 16777216)}
 
 
@@ -73,10 +93,10 @@ class Header:
         fp.seek(0, os.SEEK_END)
         max_len_of_box = fp.tell() - start_of_box
         fp.seek(start_of_box)
-        self._size = read_u32(fp)
+        self._size = fp.u32()
         self.type = fp.read(4).decode('utf-8', errors="ignore")
         if self._size == 1:
-            self._largesize = read_u64(fp)
+            self._largesize = fp.u64()
             if max_len_of_box < self._largesize:
                 self.trunc = self._largesize - max_len_of_box
         else:
@@ -106,3 +126,66 @@ class Header:
         if self.trunc > 0:
             ret_header['TruncatedSize'] = self.trunc
         return ret_header
+
+
+def find_boxes(parent, box_type):
+    """ Generator yielding, depth first, every box of the given type below parent (an Mp4File or any box) """
+    for child in parent.child_boxes:
+        if child.type == box_type:
+            yield child
+        yield from find_boxes(child, box_type)
+
+
+def find_box(parent, box_type):
+    """ Returns the first box of the given type below parent, or None """
+    return next(find_boxes(parent, box_type), None)
+
+
+class BoxFilter:
+    """
+    Decides which boxes an Mp4File decodes. A box is decoded if its type is in include (every type, if include is
+    None) and not in exclude; include may instead be a predicate taking the box type. Container boxes are always
+    decoded so that the boxes inside them can be reached, and the boxes inside a decoded box that is not a pure
+    container (e.g. the sample entries inside 'stsd') are decoded with it. A filter used in parallel parsing is
+    pickled for the worker processes, so a predicate must then be a function defined at module level.
+    """
+    def __init__(self, include=None, exclude=None):
+        self.include = include
+        self.exclude = frozenset(exclude or ())
+
+    def __call__(self, box_type):
+        if box_type in self.exclude:
+            return False
+        if self.include is None:
+            return True
+        if callable(self.include):
+            return self.include(box_type)
+        return box_type in self.include
+
+
+class ColumnList(collections.abc.Sequence):
+    """
+    A table decoded in bulk into one sequence per field (e.g. bytes or an array), presented as a list with a dict
+    per entry, such as a box would hold in its box_info if it decoded its table one entry at a time. The dicts are
+    only made when the entries are looked at (e.g. displayed), which for a large table may be never.
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        self.length = min(map(len, columns.values()), default=0)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('table index out of range')
+        return {name: column[index] for name, column in self.columns.items()}
+
+    def __eq__(self, other):
+        if not isinstance(other, ColumnList):
+            return NotImplemented
+        return self.columns == other.columns
@@ -0,0 +1,103 @@
+"""
+cut.py
+
+Extracts an excerpt of a file into a new progressive file. The excerpt is given by a start and end time in seconds on
+the presentation timeline, i.e. after the edit lists have been applied.
+Each track of the excerpt starts at the last sync sample presented at or before the start time, so that it decodes
+without any of the samples before it, and is given an edit list that hides the samples before the start time.
+The file is written by remux.write_progressive(), which builds new sample tables for just the selected samples and
+copies their byte ranges with kernel-side copies, so the time taken depends on the length of the excerpt rather than
+the length of the source.
+
+"""
+import bisect
+from mp4.core import find_box
+from mp4.iso import Mp4File
+from mp4.remux import write_progressive
+
+
+def get_cut_ranges(mp4file, start, end=None):
+    """
+    Resolves start and end (in seconds, end None for the end of the file) to the samples of each track that the
+    excerpt needs. Returns a dict of track_ID: (first, last, edits), where samples first to last - 1 are needed and
+    edits is the edit list of the excerpt as a list of (segment_duration, media_time). Tracks with nothing to present
+    between start and end are left out.
+    """
+    movie_timescale = find_box(mp4file, 'mvhd').box_info['timescale']
+    movie_start = round(start * movie_timescale)
+    movie_end = None if end is None else round(end * movie_timescale)
+    ranges = {}
+    for track in mp4file.get_tracks():
+        if not track.sample_count:
+            continue
+        edit_list = track.get_edit_list()
+        begin = _movie_to_media(edit_list, movie_start, movie_timescale, track.timescale)
+        if begin is None:
+            continue
+        delay, media_start = begin
+        if movie_end is not None and movie_start + delay >= movie_end:
+            continue
+        dts = track.dts
+        media_end = dts[-1] + track.durations[-1]
+        if media_start >= media_end:
+            continue
+        if movie_end is not None:
+            finish = _movie_to_media(edit_list, movie_end, movie_timescale, track.timescale, at_end=True)
+            if finish is not None and finish[0] == 0:
+                media_end = min(media_end, finish[1])
+
+        # the last sync sample that is presented no later than media_start
+        composition_offsets = track.composition_offsets
+        sync = track.sync
+        first = sync.rfind(1, 0, max(1, bisect.bisect_right(dts, media_start)))
+        while first > 0 and dts[first] + composition_offsets[first] > media_start:
+            first = sync.rfind(1, 0, first)
+        first = max(first, 0)
+        # every sample decoded before media_end; the samples they depend on are decoded before them, so are included
+        last = max(first + 1, bisect.bisect_left(dts, media_end))
+
+        media_time = max(0, media_start - dts[first])
+        segment_duration = -(-(media_end - media_start) * movie_timescale // track.timescale)
+        if movie_end is not None:
+            segment_duration = min(segment_duration, movie_end - movie_start - delay)
+        edits = [(delay, -1)] if delay else []
+        edits.append((max(0, segment_duration), media_time))
+        ranges[track.track_id] = (first, last, edits)
+    return ranges
+
+
+def _movie_to_media(edit_list, movie_time, movie_timescale, media_timescale, at_end=False):
+    """
+    Maps a time on the movie timeline to the media of a track through its edit list. Returns (delay, media_time):
+    the movie time until the track presents media at or after movie_time (non-zero if movie_time falls in an empty
+    edit) and the media time presented then. Returns None if the track presents nothing at or after movie_time.
+    With at_end, a time at the very end of an edit is mapped to the end of that edit rather than the next one.
+    """
+    position = 0
+    for segment_duration, media_time, media_rate in edit_list:
+        segment_end = position + segment_duration
+        # a segment_duration of 0 means the edit lasts as long as the media
+        in_edit = segment_duration == 0 or segment_end > movie_time or (at_end and segment_end == movie_time)
+        if media_time != -1 and in_edit:
+            elapsed = max(0, movie_time - position) if media_rate else 0
+            return max(0, position - movie_time), media_time + elapsed * media_timescale // movie_timescale
+        position = segment_end
+    return None
+
+
+def cut(in_filename, out_filename, start, end=None):
+    """
+    Writes the part of in_filename presented between start and end (in seconds, end None for the end of the file)
+    to out_filename. Returns a dict of track_ID: dict with the first sample and the number of samples taken from the
+    source, for each track in the excerpt.
+    """
+    mp4file = Mp4File(in_filename)
+    ranges = get_cut_ranges(mp4file, start, end)
+    if not ranges:
+        raise ValueError('{} has nothing to present between {} and {} seconds'.format(in_filename, start, end))
+    sample_ranges = {track.track_id: (0, 0) for track in mp4file.get_tracks()}
+    sample_ranges.update({track_id: (first, last) for track_id, (first, last, edits) in ranges.items()})
+    edit_lists = {track_id: edits for track_id, (first, last, edits) in ranges.items()}
+    write_progressive(mp4file, out_filename, sample_ranges, edit_lists)
+    return {track_id: {'first_sample': first, 'sample_count': last - first}
+            for track_id, (first, last, edits) in ranges.items()}
@@ -0,0 +1,148 @@
+"""
+diff.py
+
+Structural comparison of two parsed MP4 files. The box trees are walked side by side, pairing each box with the box
+of the other file that has the same type and the same position among its siblings of that type, e.g. the second
+'trak' of one 'moov' with the second 'trak' of the other. A pair of boxes is first compared by a digest of its raw
+bytes, so that identical subtrees, normally almost all of the file, are passed over without looking at any field.
+A pair that differs has its size and its box_info compared field by field, and then its children in turn.
+Media data is not parsed beyond the 'mdat' header and by default is compared by size only; with compare_payload it
+is compared byte for byte up to the first difference.
+
+The result is a dict ready for json.dumps(): {'identical': bool, 'differences': [...]}, each difference having the
+'path' of the box (e.g. '/moov[0]/trak[1]/tkhd[0]') and a 'change' of 'added', 'removed' or 'changed'.
+
+"""
+import collections.abc
+import hashlib
+from collections import Counter
+from mp4.source import open_source
+
+# boxes holding media data, whose get_bytes() is truncated and which are compared as payload
+PAYLOAD_BOX_TYPES = ('mdat',)
+
+# size of the reads when comparing payloads
+PAYLOAD_BLOCK_SIZE = 1024 * 1024
+
+
+def diff_files(mp4file_a, mp4file_b, compare_payload=False):
+    """ Returns the differences between two Mp4File objects (see module docstring) """
+    differences = []
+    # payloads are read through the byte sources of the files (see source.py)
+    with open_source(mp4file_a.source) as source_a, open_source(mp4file_b.source) as source_b:
+        context = {'payload_sources': (source_a, source_b) if compare_payload else None, 'digests': {}}
+        _diff_children(mp4file_a.child_boxes, mp4file_b.child_boxes, '', differences, context)
+    return {'identical': not differences, 'differences': differences}
+
+
+def _align(boxes_a, boxes_b):
+    """
+    Generator yielding (key, box_a, box_b) with key (type, n) for the nth box of that type; one of the boxes is None
+    if only one side has it. Boxes are yielded in the order of boxes_a, then the extra ones of boxes_b.
+    """
+    keyed_b = dict(_keyed(boxes_b))
+    for key, box_a in _keyed(boxes_a):
+        yield key, box_a, keyed_b.pop(key, None)
+    for key, box_b in keyed_b.items():
+        yield key, None, box_b
+
+
+def _keyed(boxes):
+    seen = Counter()
+    for box in boxes:
+        yield (box.type, seen[box.type]), box
+        seen[box.type] += 1
+
+
+def _diff_children(boxes_a, boxes_b, parent_path, differences, context):
+    for (box_type, n), box_a, box_b in _align(boxes_a, boxes_b):
+        path = '{}/{}[{}]'.format(parent_path, box_type, n)
+        if box_b is None:
+            differences.append({'path': path, 'change': 'removed', 'size': box_a.size})
+        elif box_a is None:
+            differences.append({'path': path, 'change': 'added', 'size': box_b.size})
+        else:
+            _diff_boxes(box_a, box_b, path, differences, context)
+
+
+def _diff_boxes(box_a, box_b, path, differences, context):
+    if box_a.type in PAYLOAD_BOX_TYPES:
+        difference = {}
+        if box_a.size != box_b.size:
+            difference['size'] = [box_a.size, box_b.size]
+        elif context['payload_sources'] is not None:
+            first_difference = _compare_payload(box_a, box_b, *context['payload_sources'])
+            if first_difference is not None:
+                difference['first_differing_byte'] = first_difference
+        if difference:
+            differences.append(dict({'path': path, 'change': 'changed'}, **difference))
+        return
+    if _digest(box_a, context) == _digest(box_b, context):
+        return
+    difference = {}
+    if box_a.size != box_b.size:
+        difference['size'] = [box_a.size, box_b.size]
+    if box_a.header.header_size != box_b.header.header_size:
+        difference['header_size'] = [box_a.header.header_size, box_b.header.header_size]
+    fields = _diff_fields(box_a.box_info, box_b.box_info)
+    if fields:
+        difference['fields'] = fields
+    count = len(differences)
+    _diff_children(box_a.child_boxes, box_b.child_boxes, path, differences, context)
+    if difference or len(differences) == count:
+        # with nothing else to show, the difference is in bytes that are not parsed into fields
+        if not difference:
+            difference['raw_bytes'] = True
+        differences.insert(count, dict({'path': path, 'change': 'changed'}, **difference))
+
+
+def _digest(box, context):
+    digests = context['digests']
+    if box not in digests:
+        digests[box] = hashlib.blake2b(box.get_bytes(), digest_size=16).digest()
+    return digests[box]
+
+
+def _diff_fields(info_a, info_b):
+    """ Returns a dict of field name: [value_a, value_b] for the fields that differ, lists being summarised """
+    fields = {}
+    for name in list(info_a) + [name for name in info_b if name not in info_a]:
+        value_a = info_a.get(name)
+        value_b = info_b.get(name)
+        if value_a == value_b:
+            continue
+        if _is_list(value_a) and _is_list(value_b):
+            first_difference = next((i for i, (a, b) in enumerate(zip(value_a, value_b)) if a != b),
+                                    min(len(value_a), len(value_b)))
+            fields[name] = {'length': [len(value_a), len(value_b)], 'first_differing_entry': first_difference}
+        else:
+            fields[name] = [_printable(value_a), _printable(value_b)]
+    return fields
+
+
+def _is_list(value):
+    """ True for lists and for list-like columns such as the sample list of a 'senc' """
+    return isinstance(value, collections.abc.Sequence) and not isinstance(value, (str, bytes, bytearray))
+
+
+def _printable(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if _is_list(value):
+        return {'length': len(value)}
+    return value
+
+
+def _compare_payload(box_a, box_b, source_a, source_b):
+    """ Returns the offset, within the box, of the first byte that differs, or None if the boxes are identical """
+    position = 0
+    while position < box_a.size:
+        block_a = source_a.read_at(box_a.start_of_box + position, min(PAYLOAD_BLOCK_SIZE, box_a.size - position))
+        block_b = source_b.read_at(box_b.start_of_box + position, len(block_a))
+        if block_a != block_b:
+            return position + next((i for i, (a, b) in enumerate(zip(block_a, block_b)) if a != b),
+                                   min(len(block_a), len(block_b)))
+        if not block_a:
+            break
+        position += len(block_a)
+    return None
@@ -0,0 +1,165 @@
+"""
+drift.py
+
+Audio/video sync drift, found from the timestamps alone. The timeline of each track (see timeline.py) places its
+samples on the movie timeline, from the media timescale of the 'mdhd', the decode times of the 'stts' (or, in a
+fragmented file, the 'tfdt' of each fragment), the composition offsets of the 'ctts' and the edit list. Played back
+to back, each sample would start where the one before it in presentation order ends; where a timestamp says
+otherwise, the track has a discontinuity: a gap (positive) or an overlap (negative), e.g. where a 'tfdt' does not
+follow on from the durations of the fragment before it. A player keeping to the timestamps stays in sync across
+them, but one that plays a track continuously (as audio usually is) slips by the size of each.
+
+The drift at a movie time is the sum of the discontinuities of the audio up to then, less that of the video: how
+far the audio has moved later relative to the video since the start, on top of the initial offset between the start
+of the two. Points where the drift exceeds a threshold are flagged. The discontinuities are found with array
+operations over every sample (numpy if it is installed, as in analytics.py), so a track of millions of samples
+takes a fraction of a second once its sample index is built.
+
+"""
+import bisect
+import itertools
+import math
+import operator
+from mp4.timeline import get_timelines
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# drift in seconds beyond which a point is flagged; about where lip sync errors start to be noticed
+DEFAULT_DRIFT_THRESHOLD = 0.04
+
+# the most points the drift is listed at with an interval
+MAX_DRIFT_POINTS = 1000000
+
+
+def get_discontinuities(timeline):
+    """
+    Returns (times, gaps): the movie time (in seconds) of each sample of timeline that does not start where the one
+    before it in presentation order ends, and the size of the gap (in seconds, negative for an overlap), both as
+    lists in order of time. Only samples presented by the edit list, after one that is, are counted.
+    """
+    order = timeline.presentation_order
+    if numpy is not None:
+        np_order = numpy.frombuffer(order, dtype=numpy.int64)
+        pts = numpy.frombuffer(timeline.sorted_pts, dtype=numpy.int64)
+        durations = numpy.frombuffer(timeline.durations, dtype=numpy.uint64).astype(numpy.int64)[np_order]
+        times = numpy.frombuffer(timeline.get_presentation_times(), dtype=numpy.int64)[np_order]
+        gaps = pts[1:] - pts[:-1] - durations[:-1]
+        found = (gaps != 0) & (times[1:] >= 0) & (times[:-1] >= 0)
+        found_times = times[1:][found]
+        by_time = numpy.argsort(found_times, kind='stable')
+        return ((found_times[by_time] / timeline.movie_timescale).tolist(),
+                (gaps[found][by_time] / timeline.media_timescale).tolist())
+    pts = timeline.sorted_pts
+    durations = list(map(timeline.durations.__getitem__, order))
+    times = list(map(timeline.get_presentation_times().__getitem__, order))
+    gaps = map(operator.sub, map(operator.sub, pts[1:], pts[:-1]), durations[:-1])
+    found = sorted((time, gap) for time, gap, previous_time in zip(times[1:], gaps, times[:-1])
+                   if gap and time >= 0 and previous_time >= 0)
+    return ([time / timeline.movie_timescale for time, gap in found],
+            [gap / timeline.media_timescale for time, gap in found])
+
+
+def analyze_drift(mp4file, threshold=DEFAULT_DRIFT_THRESHOLD, interval=None, timelines=None):
+    """
+    Returns a dict describing the sync of the first audio and the first video track of mp4file: the initial offset
+    (the start of the audio less the start of the video, in seconds), the number and total of the discontinuities of
+    each track, the drift at the end and the largest drift (see the module docstring), and the events where the
+    drift is more than threshold seconds either way, each with its start, end and peak drift. With interval, the
+    drift every interval seconds is listed too, as [time, drift] pairs; ValueError is raised if that would be more
+    than MAX_DRIFT_POINTS of them. The tracks are taken from timelines if given (see timeline.get_timelines()), so
+    that the sample index of a file analysed several times is built only once.
+    """
+    if not threshold > 0:
+        raise ValueError('threshold {} is not more than 0'.format(threshold))
+    if interval is not None and not interval > 0:
+        raise ValueError('interval {} is not more than 0'.format(interval))
+    if timelines is None:
+        timelines = get_timelines(mp4file)
+    audio = next((timeline for timeline in timelines if timeline.handler_type == 'soun'), None)
+    video = next((timeline for timeline in timelines if timeline.handler_type == 'vide'), None)
+    result = {'audio_track': audio and audio.track_id, 'video_track': video and video.track_id,
+              'threshold': threshold}
+    if audio is None or video is None:
+        return result
+    audio_start = audio.get_start()['start_time']
+    video_start = video.get_start()['start_time']
+    result['initial_offset'] = audio_start - video_start if audio_start is not None and video_start is not None \
+        else None
+    audio_times, audio_gaps = get_discontinuities(audio)
+    video_times, video_gaps = get_discontinuities(video)
+    result['audio_discontinuities'] = len(audio_gaps)
+    result['audio_gap_total'] = math.fsum(audio_gaps)
+    result['video_discontinuities'] = len(video_gaps)
+    result['video_gap_total'] = math.fsum(video_gaps)
+
+    # the drift only changes where either track has a discontinuity
+    times, drifts = _get_drift(audio_times, audio_gaps, video_times, video_gaps)
+    end = max(audio.duration / audio.movie_timescale, video.duration / video.movie_timescale)
+    result['final_drift'] = drifts[-1] if drifts else 0.0
+    peak = _get_peak(drifts)
+    result['max_drift'] = drifts[peak] if drifts else 0.0
+    result['max_drift_time'] = times[peak] if drifts else None
+    result['events'] = _get_events(times, drifts, threshold, end)
+    if interval:
+        if end / interval >= MAX_DRIFT_POINTS:
+            raise ValueError('an interval of {} s lists the drift at more than {} points'.format(interval,
+                                                                                               MAX_DRIFT_POINTS))
+        grid = [i * interval for i in range(int(end / interval) + 1)]
+        result['drift'] = [[time, drifts[i - 1] if i else 0.0]
+                           for time, i in zip(grid, map(bisect.bisect_right, itertools.repeat(times), grid))]
+    return result
+
+
+def _get_drift(audio_times, audio_gaps, video_times, video_gaps):
+    """
+    Returns (times, drifts): each time at which the drift changes, in order, and the drift from then on, as lists
+    """
+    if numpy is not None:
+        times = numpy.unique(numpy.array(audio_times + video_times, dtype=numpy.float64))
+        drifts = _get_totals(audio_times, audio_gaps, times) - _get_totals(video_times, video_gaps, times)
+        return times.tolist(), drifts.tolist()
+    times = sorted(set(audio_times + video_times))
+    audio_totals = list(itertools.accumulate(audio_gaps, initial=0.0))
+    video_totals = list(itertools.accumulate(video_gaps, initial=0.0))
+    drifts = list(map(operator.sub,
+                      map(audio_totals.__getitem__, map(bisect.bisect_right, itertools.repeat(audio_times), times)),
+                      map(video_totals.__getitem__, map(bisect.bisect_right, itertools.repeat(video_times), times))))
+    return times, drifts
+
+
+def _get_totals(gap_times, gaps, times):
+    """ Returns a numpy array of the sum of the gaps at or before each of times """
+    totals = numpy.concatenate(([0.0], numpy.cumsum(numpy.array(gaps, dtype=numpy.float64))))
+    return totals[numpy.searchsorted(numpy.array(gap_times, dtype=numpy.float64), times, 'right')]
+
+
+def _get_peak(drifts):
+    """ Returns the index of the drift furthest from 0 (the first if there are several) """
+    if not drifts:
+        return None
+    if numpy is not None:
+        return int(numpy.abs(numpy.array(drifts)).argmax())
+    magnitudes = list(map(abs, drifts))
+    return magnitudes.index(max(magnitudes))
+
+
+def _get_events(times, drifts, threshold, end):
+    """
+    Returns a list of the runs of drifts of more than threshold either way, each a dict with its start and end
+    time (the end of the timeline if it lasts until then) and its peak drift
+    """
+    if numpy is not None:
+        over = numpy.abs(numpy.array(drifts, dtype=numpy.float64)) > threshold
+        # each run over the threshold starts where over goes from False to True, and ends where it goes back
+        changes = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], over, [False])).astype(numpy.int8)))
+        starts, ends = changes[0::2].tolist(), changes[1::2].tolist()
+    else:
+        over = [abs(drift) > threshold for drift in drifts]
+        changes = [i for i, (before, after) in enumerate(zip([False] + over, over + [False])) if before != after]
+        starts, ends = changes[0::2], changes[1::2]
+    return [{'start': times[start], 'end': times[stop] if stop < len(times) else end,
+             'peak_drift': drifts[start + _get_peak(drifts[start:stop])]}
+            for start, stop in zip(starts, ends)]
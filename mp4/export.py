@@ -0,0 +1,161 @@
+"""
+export.py
+
+Exports the sample index of a file (see track.py) as columns of binary data, so that analysis tools can load the
+per-sample tables of thousands of files without parsing them again or going through JSON. There are three tables,
+the rows of every track one after the other, in track order and then decode order:
+
+- 'samples': track_id, dts, pts, duration, size, offset, sync and dependencies (the 'sdtp' flags), times being in
+  media timescale units before any edit list, and pts being dts plus the composition offset
+- 'chunks': track_id, offset, first_sample and sample_count of each chunk, which in a fragmented file is the run of
+  samples of a 'trun'; first_sample counts from the first sample of the track
+- 'tracks': track_id, timescale and sample_count of each track
+
+Each column is written in a single call straight from the arrays of the index, without a pass over the rows.
+Two formats are supported:
+
+- 'columns' (the default, needing nothing but the standard library): the magic number COLUMNS_MAGIC and the length
+  of the header (little-endian u64), a JSON header, then the columns as little-endian data, each one starting at a
+  multiple of 8 bytes. The header lists the tables and, for every column, its name, NumPy dtype string, file offset
+  and length in bytes, so a column can be read with numpy.fromfile(filename, dtype, count, offset=offset) or mapped
+  with numpy.memmap; read_columns() reads them back as array.array objects.
+- 'npz': a NumPy archive holding one array per column, named '<table>.<column>', which needs numpy.
+
+"""
+import itertools
+import json
+import operator
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMNS_MAGIC = b'MP4COL01'
+COLUMNS_HEADER = struct.Struct('<8sQ')
+
+# columns start on multiples of this many bytes
+COLUMN_ALIGNMENT = 8
+
+EXPORT_FORMATS = ('columns', 'npz')
+
+# NumPy dtype strings of the array.array typecodes used for the columns
+_DTYPES = {'B': '|u1', 'I': '<u4', 'Q': '<u8', 'q': '<i8'}
+_TYPECODES = {dtype: typecode for typecode, dtype in _DTYPES.items()}
+
+
+def get_tables(mp4file):
+    """
+    Returns the tables described in the module docstring as a dict of table name: dict of column name: array.array
+    """
+    samples = {name: array(typecode) for name, typecode in [('track_id', 'I'), ('dts', 'Q'), ('pts', 'q'),
+                                                              ('duration', 'Q'), ('size', 'Q'), ('offset', 'Q'),
+                                                              ('sync', 'B'), ('dependencies', 'B')]}
+    chunks = {name: array(typecode) for name, typecode in [('track_id', 'I'), ('offset', 'Q'),
+                                                             ('first_sample', 'Q'), ('sample_count', 'Q')]}
+    tracks = {name: array(typecode) for name, typecode in [('track_id', 'I'), ('timescale', 'I'),
+                                                             ('sample_count', 'Q')]}
+    for track in mp4file.get_tracks():
+        count = track.sample_count
+        samples['track_id'].extend(array('I', [track.track_id]) * count)
+        samples['dts'].extend(track.dts)
+        samples['pts'].extend(track.pts)
+        samples['duration'].extend(track.durations)
+        samples['size'].extend(track.sizes)
+        samples['offset'].extend(track.offsets)
+        samples['sync'].frombytes(track.sync)
+        samples['dependencies'].frombytes(track.dependencies)
+        first_samples = track.chunk_first_samples
+        chunks['track_id'].extend(array('I', [track.track_id]) * len(first_samples))
+        chunks['offset'].extend(track.chunk_offsets)
+        chunks['first_sample'].extend(first_samples)
+        chunks['sample_count'].extend(map(operator.sub, itertools.chain(first_samples[1:], [count]), first_samples))
+        tracks['track_id'].append(track.track_id)
+        tracks['timescale'].append(track.timescale or 0)
+        tracks['sample_count'].append(count)
+    return {'samples': samples, 'chunks': chunks, 'tracks': tracks}
+
+
+def export_samples(mp4file, out_filename, export_format='columns'):
+    """
+    Writes the tables of mp4file to out_filename in export_format, one of EXPORT_FORMATS. Returns a dict of table
+    name: row count.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('unknown export format {}'.format(export_format))
+    tables = get_tables(mp4file)
+    if export_format == 'npz':
+        if numpy is None:
+            raise ImportError('the npz format needs numpy')
+        columns = {'{}.{}'.format(table, name): numpy.frombuffer(values, dtype=_DTYPES[values.typecode])
+                   for table, table_columns in tables.items() for name, values in table_columns.items()}
+        with open(out_filename, 'wb') as f:
+            numpy.savez(f, **columns)
+    else:
+        write_columns(tables, out_filename, {'source': mp4file.filename})
+    return {table: _get_row_count(table_columns) for table, table_columns in tables.items()}
+
+
+def _get_row_count(table_columns):
+    return len(next(iter(table_columns.values()), ()))
+
+
+def write_columns(tables, out_filename, metadata=None):
+    """
+    Writes tables (a dict of table name: dict of column name: array.array) in the 'columns' format, with the
+    entries of the dict metadata added to the header
+    """
+    # the header holds the column offsets, which depend on the length of the header, so repeat until it is stable
+    header_size = 0
+    while True:
+        position = _align(COLUMNS_HEADER.size + header_size)
+        header = dict(metadata or {}, tables={})
+        for table, table_columns in tables.items():
+            columns = []
+            for name, values in table_columns.items():
+                size = len(values) * values.itemsize
+                columns.append({'name': name, 'dtype': _DTYPES[values.typecode], 'offset': position, 'size': size})
+                position = _align(position + size)
+            header['tables'][table] = {'rows': _get_row_count(table_columns), 'columns': columns}
+        header_bytes = json.dumps(header).encode('utf-8')
+        if len(header_bytes) <= header_size:
+            break
+        header_size = len(header_bytes)
+    with open(out_filename, 'wb') as f:
+        f.write(COLUMNS_HEADER.pack(COLUMNS_MAGIC, header_size))
+        f.write(header_bytes.ljust(header_size))
+        for table_columns in tables.values():
+            for values in table_columns.values():
+                f.seek(_align(f.tell()))
+                if sys.byteorder == 'big' and values.itemsize > 1:
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                f.write(values)
+        f.truncate(position)
+
+
+def read_columns(filename):
+    """ Reads a file written by write_columns(). Returns (header, tables), tables as given to write_columns() """
+    with open(filename, 'rb') as f:
+        magic, header_size = COLUMNS_HEADER.unpack(f.read(COLUMNS_HEADER.size))
+        if magic != COLUMNS_MAGIC:
+            raise ValueError('{} is not a sample table export'.format(filename))
+        header = json.loads(f.read(header_size))
+        tables = {}
+        for table, table_header in header['tables'].items():
+            tables[table] = {}
+            for column in table_header['columns']:
+                values = array(_TYPECODES[column['dtype']])
+                f.seek(column['offset'])
+                values.frombytes(f.read(column['size']))
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                tables[table][column['name']] = values
+    return header, tables
+
+
+def _align(position):
+    return -(-position // COLUMN_ALIGNMENT) * COLUMN_ALIGNMENT
@@ -0,0 +1,84 @@
+"""
+faststart.py
+
+Rewrites a progressive MP4 file so that the 'moov' comes before the media data, allowing playback to start
+before the whole file has been downloaded.
+The 'moov' is moved to just in front of the first 'mdat' and every chunk offset in its 'stco'/'co64' tables is
+shifted by the distance its 'mdat' moves. An 'stco' is promoted to 'co64' if any shifted offset no longer fits in 32
+bits, which in turn makes the 'moov' bigger, so the layout is recalculated until it is stable.
+Apart from the 'moov', which is rebuilt in memory, every box is copied with writer.copy_range(), so memory use does
+not depend on the size of the file.
+
+"""
+import bisect
+import operator
+import itertools
+from mp4.core import find_boxes
+from mp4.iso import Mp4File
+from mp4.writer import rebuild_box, make_chunk_offset_box, copy_range
+
+
+def is_faststart(mp4file):
+    """ True if the 'moov' precedes the first 'mdat' """
+    for box in mp4file.child_boxes:
+        if box.type == 'moov':
+            return True
+        if box.type == 'mdat':
+            return False
+    return True
+
+
+def faststart(in_filename, out_filename):
+    """
+    Writes a copy of in_filename to out_filename with the 'moov' in front of the media data.
+    Returns False, having copied the file unchanged, if the 'moov' was already at the front.
+    """
+    mp4file = Mp4File(in_filename)
+    top_level = mp4file.child_boxes
+    if any(box.type == 'moof' for box in top_level):
+        raise ValueError('{} is fragmented; only progressive files can be rewritten'.format(in_filename))
+    moov = next((box for box in top_level if box.type == 'moov'), None)
+    if moov is None:
+        raise ValueError('{} has no moov box'.format(in_filename))
+    if is_faststart(mp4file):
+        new_order = top_level
+        new_moov = None
+    else:
+        first_mdat = next(i for i, box in enumerate(top_level) if box.type == 'mdat')
+        new_order = top_level[:first_mdat] + [moov] + [box for box in top_level[first_mdat:] if box is not moov]
+        new_moov = _relocated_moov(top_level, new_order, moov)
+    with open(in_filename, 'rb') as src, open(out_filename, 'wb') as dst:
+        for box in new_order:
+            if box is moov and new_moov is not None:
+                dst.write(new_moov)
+            else:
+                copy_range(src, dst, box.start_of_box, box.size)
+    return new_moov is not None
+
+
+def _relocated_moov(top_level, new_order, moov):
+    """ Returns the bytes of the moov with its chunk offsets adjusted for the boxes' new positions """
+    chunk_offset_boxes = list(find_boxes(moov, 'stco')) + list(find_boxes(moov, 'co64'))
+    old_offsets = {box: [entry['chunk_offset'] for entry in box.box_info['entry_list']] for box in chunk_offset_boxes}
+    old_starts = [box.start_of_box for box in top_level]
+    moov_size = moov.size
+    while True:
+        # where each top-level box ends up, given the current size of the new moov
+        new_starts = {}
+        position = 0
+        for box in new_order:
+            new_starts[box] = position
+            position += moov_size if box is moov else box.size
+        deltas = [new_starts[box] - box.start_of_box for box in top_level]
+        replacements = {}
+        for box, offsets in old_offsets.items():
+            if len(set(deltas)) == 1:
+                new_offsets = list(map(operator.add, offsets, itertools.repeat(deltas[0])))
+            else:
+                # offsets are moved by the delta of the top-level box (normally an mdat) they point into
+                new_offsets = [offset + deltas[bisect.bisect_right(old_starts, offset) - 1] for offset in offsets]
+            replacements[box] = make_chunk_offset_box(new_offsets)
+        new_moov = rebuild_box(moov, replacements)
+        if len(new_moov) == moov_size:
+            return new_moov
+        moov_size = len(new_moov)
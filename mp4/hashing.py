@@ -0,0 +1,159 @@
+"""
+hashing.py
+
+Content hashes at box granularity, arranged as a Merkle tree so that two copies of a file can be compared by their
+root hash and, if they differ, the damaged boxes found by descending only into the subtrees whose hashes differ.
+
+- A box without children hashes to H(0x00 || box bytes).
+- A box with children hashes to H(0x01 || H(0x00 || its own bytes) || child hashes), its own bytes being the header
+  and any fields outside the children.
+- A media data box ('mdat') has its payload hashed in blocks of block_size bytes, H(0x00 || block), and hashes to
+  H(0x02 || header || block hashes). Blocks are read through the byte source of the file (see source.py) and hashed
+  in a thread pool; hashlib releases the GIL while hashing, so the blocks are hashed in parallel.
+- The file hashes to H(0x01 || hashes of the top-level boxes).
+
+Boxes other than 'mdat' are hashed from memoryviews of the bytes already read by the parser. Root hashes can only be
+compared if they were computed with the same algorithm and block size.
+
+A box that runs past the end of a truncated file is hashed over the bytes that are there, its blocks past the end
+hashing as empty, and its node records the number of missing_bytes, so that find_mismatches() still leads to it.
+
+"""
+import concurrent.futures
+import hashlib
+from collections import Counter
+from mp4.source import open_source
+
+# boxes whose payload is hashed in blocks read from the file
+PAYLOAD_BOX_TYPES = ('mdat',)
+
+DEFAULT_ALGORITHM = 'sha256'
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+PAYLOAD_PREFIX = b'\x02'
+
+
+class HashNode:
+    """ The hash of one box, with the hashes of its children or, for an 'mdat', of its payload blocks """
+
+    def __init__(self, box_type, offset, size, digest, children=None, block_digests=None, missing_bytes=0):
+        self.box_type = box_type
+        self.offset = offset
+        self.size = size
+        self.digest = digest
+        self.children = children or []
+        self.block_digests = block_digests or []
+        # the bytes of the box past the end of the file, or of the boxes below it for the file
+        self.missing_bytes = missing_bytes
+
+    def hexdigest(self):
+        return self.digest.hex()
+
+    def to_dict(self):
+        node = {'type': self.box_type, 'offset': self.offset, 'size': self.size, 'digest': self.hexdigest()}
+        if self.children:
+            node['children'] = [child.to_dict() for child in self.children]
+        if self.block_digests:
+            node['block_digests'] = [digest.hex() for digest in self.block_digests]
+        if self.missing_bytes:
+            node['missing_bytes'] = self.missing_bytes
+        return node
+
+
+def hash_tree(mp4file, algorithm=DEFAULT_ALGORITHM, block_size=DEFAULT_BLOCK_SIZE, max_workers=None):
+    """ Returns the HashNode at the root of the hash tree of a parsed Mp4File """
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor, open_source(mp4file.source) as source:
+        children = [_hash_box(box, algorithm, block_size, executor, source) for box in mp4file.child_boxes]
+    digest = _hash(algorithm, NODE_PREFIX, *(child.digest for child in children))
+    size = sum(child.size for child in children)
+    return HashNode('file', 0, size, digest, children, missing_bytes=sum(child.missing_bytes for child in children))
+
+
+def _hash(algorithm, *parts):
+    h = hashlib.new(algorithm)
+    for part in parts:
+        h.update(part)
+    return h.digest()
+
+
+def _get_view(box):
+    """ Returns a memoryview of the box's bytes within the bytes read for its top-level box """
+    top_box = box.get_top()
+    offset = box.start_of_box - top_box.start_of_box
+    return memoryview(top_box.byte_string)[offset:offset + box.size]
+
+
+def _hash_box(box, algorithm, block_size, executor, source):
+    if box.type in PAYLOAD_BOX_TYPES:
+        header_size = box.header.header_size
+        blocks = range(box.start_of_box + header_size, box.start_of_box + box.size, block_size)
+        end = box.start_of_box + box.size
+        block_digests = list(executor.map(_hash_block, [source] * len(blocks), blocks,
+                                          [min(block_size, end - offset) for offset in blocks],
+                                          [algorithm] * len(blocks)))
+        header = source.read_at(box.start_of_box, header_size)
+        digest = _hash(algorithm, PAYLOAD_PREFIX, header, *block_digests)
+        return HashNode(box.type, box.start_of_box, box.size, digest, block_digests=block_digests,
+                        missing_bytes=max(0, end - source.size))
+    view = _get_view(box)
+    if not box.child_boxes:
+        return HashNode(box.type, box.start_of_box, box.size, _hash(algorithm, LEAF_PREFIX, view),
+                        missing_bytes=box.size - len(view))
+    children = [_hash_box(child, algorithm, block_size, executor, source) for child in box.child_boxes]
+    # the bytes of the box that are not in any child: its header and fields before, and anything after, them
+    first_child = children[0].offset - box.start_of_box
+    end_of_children = children[-1].offset + children[-1].size - box.start_of_box
+    own_digest = _hash(algorithm, LEAF_PREFIX, view[:first_child], view[end_of_children:])
+    digest = _hash(algorithm, NODE_PREFIX, own_digest, *(child.digest for child in children))
+    return HashNode(box.type, box.start_of_box, box.size, digest, children, missing_bytes=box.size - len(view))
+
+
+def _hash_block(source, offset, size, algorithm):
+    # fewer bytes, or none, past the end of a truncated file
+    return _hash(algorithm, LEAF_PREFIX, source.read_at(offset, size))
+
+
+def find_mismatches(node_a, node_b, path=''):
+    """
+    Generator yielding the paths (e.g. '/moof[3]/traf[0]/trun[0]' or '/mdat[0]#block12') of the smallest parts
+    that differ between two hash trees. Children are paired by type and occurrence as in diff.py.
+    """
+    if node_a.digest == node_b.digest:
+        return
+    if node_a.block_digests and len(node_a.block_digests) == len(node_b.block_digests):
+        differing_blocks = [i for i, (digest_a, digest_b) in enumerate(zip(node_a.block_digests, node_b.block_digests))
+                            if digest_a != digest_b]
+        for i in differing_blocks:
+            yield '{}#block{}'.format(path, i)
+        if not differing_blocks:
+            yield path
+        return
+    if not node_a.children or not node_b.children:
+        yield path or '/'
+        return
+    children_b = dict(_keyed(node_b.children))
+    mismatched_children = False
+    for key, child_a in _keyed(node_a.children):
+        child_path = '{}/{}[{}]'.format(path, *key)
+        child_b = children_b.pop(key, None)
+        if child_b is None:
+            mismatched_children = True
+            yield child_path
+        elif child_a.digest != child_b.digest:
+            mismatched_children = True
+            yield from find_mismatches(child_a, child_b, child_path)
+    for key in children_b:
+        mismatched_children = True
+        yield '{}/{}[{}]'.format(path, *key)
+    if not mismatched_children:
+        # the children all match, so the difference is in the box's own fields
+        yield path or '/'
+
+
+def _keyed(nodes):
+    seen = Counter()
+    for node in nodes:
+        yield (node.box_type, seen[node.box_type]), node
+        seen[node.box_type] += 1
@@ -10,7 +10,17 @@ import sys
 import binascii
 import datetime
 import traceback
+import concurrent.futures
+import contextlib
+import mmap
+import pickle
+from array import array
 import mp4.non_iso
+import mp4.resync
+import mp4.track
+import mp4.hashing
+import mp4.remote
+import mp4.source
 from mp4.core import *
 from mp4.util import *
 
@@ -23,7 +33,7 @@ from mp4.util import *
 # 'skip', 'cprt', 'tsel', 'strk', 'stri', 'strd', 'iloc', 'ipro', 'rinf', 'sinf', 'frma', 'schm',
 # 'xml ', 'pitm', 'iref', 'meco', 'mere', 'styp', 'sidx', 'ssix', 'prft', 'avc1', 'hvc1', 'avcC',
 # 'hvcC', 'btrt', 'pasp', 'mp4a', 'ac-3', 'ec-3', 'esds', 'dac3', 'dec3', 'ilst', 'data', 'pssh',
-# 'senc'
+# 'senc', 'avc3', 'hev1', 'schi', 'tenc', 'encv', 'enca'
 # Not supported
 # 'sthd', 'iinf', 'bxml', 'fiin', 'paen', 'fire', 'fpar', 'fecr', 'segr', 'gitn', 'idat'
 
@@ -33,8 +43,9 @@ def box_factory(fp, header, parent):
     an instance of that class.
     """
     the_box = None
-    box_type = header.type.replace(' ', '_')
-    _box_class = globals().get(box_type.capitalize()+'Box') # globals() Return a dictionary representing the current global symbol table
+    _box_class = _get_box_class(header.type)
+    if _box_class not in CONTAINER_BOX_CLASSES and not _is_wanted(header.type, parent):
+        return SkippedBox(fp, header, parent)
     if _box_class:
         the_box = _box_class(fp, header, parent)
         return the_box
@@ -42,33 +53,339 @@ def box_factory(fp, header, parent):
         return mp4.non_iso.box_factory_non_iso(fp, header, parent)
 
 
+def _get_box_class(box_type):
+    box_type = box_type.replace(' ', '_')
+    return globals().get(box_type.capitalize()+'Box') # globals() Return a dictionary representing the current global symbol table
+
+
+# bytes read to decode the header of a top-level box: size, type, largesize and uuid
+HEADER_READ_SIZE = 32
+
+
+def parse_box(fp, parent, file_size):
+    """
+    Parses the top-level box at the position of the file fp, leaving fp at the end of the box. The box is read in
+    one go (an 'mdat' only as far as the hex view shows, a box the box filter skips only as far as its header) and
+    decoded from memory, with a BoxReader standing in for the file. fp may itself be a BoxReader over the whole
+    file (see Mp4File.from_buffer()), which hands out slices of its data rather than copies.
+    """
+    read = getattr(fp, 'read_view', fp.read)
+    start_of_box = fp.tell()
+    header = Header(BoxReader(read(HEADER_READ_SIZE), start_of_box, file_size))
+    if header.type == 'mdat':
+        read_size = min(header.size, MDAT_BYTES_SHOWN)
+    elif _get_box_class(header.type) not in CONTAINER_BOX_CLASSES and not _is_wanted(header.type, parent):
+        read_size = header.header_size
+    else:
+        read_size = header.size
+    fp.seek(start_of_box)
+    reader = BoxReader(read(read_size), start_of_box, file_size)
+    reader.seek(start_of_box + header.header_size)
+    current_box = box_factory(reader, header, parent)
+    fp.seek(start_of_box + header.size)
+    return current_box
+
+
+def _is_wanted(box_type, parent):
+    """
+    True if the box filter of the Mp4File lets a box of box_type be decoded. Boxes inside a box that is not a pure
+    container are decoded along with it.
+    """
+    if parent.type != 'file' and type(parent) not in CONTAINER_BOX_CLASSES:
+        return True
+    root = parent
+    while root.type != 'file':
+        root = root.parent
+    box_filter = getattr(root, 'box_filter', None)
+    return box_filter is None or box_filter(box_type)
+
+
 # Box classes
 
 
 class Mp4File:
 
-    def __init__(self, filename):
-        self.filename = filename
+    def __init__(self, filename, parallel=False, max_workers=None, include=None, exclude=None, recover=False):
+        """
+        filename may be an http(s) URL, read with a remote.RangeFile, or a binary file object that can seek, such
+        as a byte source of source.py, which is left open. A local file is read through a source.FileSource, which
+        coalesces the small reads of parsing into reads of at least source.DEFAULT_MIN_READ bytes.
+        If parallel is True, the top-level boxes are located first and then every 'moof' is parsed in a pool of
+        max_workers processes, each with its own file handle. All other boxes are parsed in this process.
+        include and exclude restrict the boxes that are decoded (see core.BoxFilter); any other box is only a
+        SkippedBox holding its header. get_tracks() needs the boxes of the sample tables to be decoded. In parallel
+        parsing the filter is sent to the worker processes, so include must then be picklable: a predicate has to
+        be a function defined at module level, not a lambda or a nested function.
+        Parsing normally stops at the first top-level box that cannot be decoded. If recover is True it carries on
+        from the next plausible top-level box header after it (see resync.py), and damaged_regions lists each part
+        of the file that was passed over as a dict with offset, size and error.
+        """
+        if mp4.remote.is_url(filename):
+            filename = mp4.remote.RangeFile(filename)
+        self._set_up(filename, include, exclude, recover)
+        if parallel and not _is_filename(filename):
+            raise ValueError('parallel parsing needs a filename, for the workers to open')
+        if parallel and self.box_filter is not None:
+            try:
+                pickle.dumps(self.box_filter)
+            except (pickle.PicklingError, AttributeError, TypeError) as e:
+                raise ValueError('parallel parsing needs a box filter that can be sent to the workers; '
+                                 'include cannot be a lambda or a nested function ({})'.format(e)) from None
+        with mp4.source.FileSource(filename) if _is_filename(filename) else contextlib.nullcontext(filename) as f:
+            if parallel:
+                self._parse_parallel(f, max_workers)
+            else:
+                self._parse(f)
+
+    @classmethod
+    def from_buffer(cls, buffer, include=None, exclude=None, recover=False, name=None):
+        """
+        Returns the Mp4File of the file held in buffer (bytes, bytearray, memoryview, mmap or any other object with
+        the buffer protocol), e.g. a segment already in memory, with include, exclude and recover as for Mp4File().
+        The boxes are decoded straight from the buffer, and the byte_string of each top-level box is a memoryview
+        of it rather than a copy, so the buffer must not be changed while the Mp4File is in use. name stands for
+        the filename in messages.
+        """
+        view = memoryview(buffer).cast('B')
+        mp4file = cls.__new__(cls)
+        mp4file._set_up(mp4.source.BytesSource(view, name), include, exclude, recover)
+        mp4file._parse(BoxReader(view))
+        return mp4file
+
+    def _set_up(self, source, include, exclude, recover):
+        # what the samples are read from (see track.read_ranges())
+        self.source = source
+        self.filename = source if _is_filename(source) else getattr(source, 'name', None)
         self.type = 'file'
         self.child_boxes = []
-        with open(filename, 'rb') as f:
-            end_of_file = False
-            while not end_of_file:
-                try:
-                    current_header = Header(f)
-                    current_box = box_factory(f, current_header, self)
-                    self.child_boxes.append(current_box)
-                    if current_box.size == 0:
-                        end_of_file = True
-                    if len(f.read(4)) != 4:
-                        end_of_file = True
-                    else:
-                        f.seek(-4, 1)
-                except:
-                    print('Error decoding stream at {}'.format(f.tell()))
-                    traceback.print_exc(file=sys.stdout)
+        self.box_filter = BoxFilter(include, exclude) if include is not None or exclude is not None else None
+        self.recover = recover
+        self.damaged_regions = []
+        # track_ID: IV size, from the 'tenc' boxes of the moov once it is parsed, for decoding the 'senc' boxes of
+        # the fragments after it (see non_iso.SencBox)
+        self.iv_sizes = None
+
+    def _parse(self, f):
+        """ Parses the top-level boxes of the file f one after the other, from the start """
+        file_size = _get_file_size(f)
+        end_of_file = False
+        while not end_of_file:
+            start_of_box = f.tell()
+            if self.recover:
+                next_box = self._check_header(f, start_of_box, file_size)
+                if next_box is not None:
+                    end_of_file = next_box == file_size
+                    f.seek(next_box)
+                    continue
+            try:
+                current_box = parse_box(f, self, file_size)
+                self.child_boxes.append(current_box)
+                if current_box.type == 'moov':
+                    self.iv_sizes = mp4.non_iso.get_iv_sizes(current_box)
+                if current_box.size == 0:
                     end_of_file = True
-        f.close()
+                if len(f.read(4)) != 4:
+                    end_of_file = True
+                else:
+                    f.seek(-4, 1)
+            except Exception as e:
+                print('Error decoding stream at {}'.format(f.tell()))
+                traceback.print_exc(file=sys.stdout)
+                next_box = self._resync(f, start_of_box, file_size, e) if self.recover else None
+                if next_box is None:
+                    end_of_file = True
+                else:
+                    f.seek(next_box)
+
+    def _check_header(self, fp, offset, file_size):
+        """
+        Checks that the bytes at offset look like the header of a top-level box, with a type of printable characters
+        and a size that fits in the file (except for an 'mdat' that was still being written). Returns None if they do.
+        If not, records the damaged region and returns the offset of the next plausible box, or file_size.
+        A sound header of a box that runs beyond the end of the file is only taken as damaged if a box is found
+        within its extent; otherwise the file is just truncated.
+        """
+        header = fp.read(HEADER_READ_SIZE)
+        fp.seek(offset)
+        end = mp4.resync.get_box_end(header, 0, file_size - offset)
+        if end is not None and (end <= file_size - offset or header[4:8] == b'mdat'):
+            return None
+        next_box = self._find_next_box(fp, offset, file_size)
+        if end is None:
+            error = 'implausible box header {}'.format(header[:8].hex())
+        elif next_box is None:
+            return None
+        else:
+            error = 'box size {} runs beyond the end of the file'.format(end)
+        next_box = file_size if next_box is None else next_box
+        self._add_damaged_region(offset, next_box - offset, error)
+        return next_box
+
+    def _resync(self, fp, offset, file_size, error):
+        """
+        Records the damaged region from the box at offset, which could not be decoded, to the next plausible box.
+        Returns the offset of that box, or None if there is none.
+        """
+        next_box = self._find_next_box(fp, offset, file_size)
+        self._add_damaged_region(offset, (file_size if next_box is None else next_box) - offset, error)
+        return next_box
+
+    def _find_next_box(self, fp, offset, file_size):
+        try:
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            # a file object without a file descriptor (io.UnsupportedOperation is an OSError): read it all
+            fp.seek(0)
+            buffer = contextlib.nullcontext(fp.read())
+        with buffer as buffer:
+            return mp4.resync.find_next_box(buffer, offset + 1, file_size)
+
+    def _add_damaged_region(self, offset, size, error):
+        self.damaged_regions.append({'offset': offset, 'size': size,
+                                     'error': '{}: {}'.format(type(error).__name__, error)
+                                     if isinstance(error, BaseException) else error})
+
+    def _scan_top_level(self, fp):
+        """ Returns a list of (offset, type) for each top-level box, reading only the headers """
+        box_list = []
+        end_of_file = _get_file_size(fp)
+        while end_of_file - fp.tell() >= 8:
+            start_of_box = fp.tell()
+            if self.recover:
+                next_box = self._check_header(fp, start_of_box, end_of_file)
+                if next_box is not None:
+                    fp.seek(next_box)
+                    continue
+            try:
+                current_header = Header(BoxReader(fp.read(HEADER_READ_SIZE), start_of_box, end_of_file))
+            except Exception as e:
+                print('Error decoding stream at {}'.format(start_of_box))
+                traceback.print_exc(file=sys.stdout)
+                next_box = self._resync(fp, start_of_box, end_of_file, e) if self.recover else None
+                if next_box is None:
+                    break
+                fp.seek(next_box)
+                continue
+            box_list.append((start_of_box, current_header.type))
+            fp.seek(start_of_box + current_header.size)
+        return box_list
+
+    def _parse_parallel(self, fp, max_workers):
+        box_list = self._scan_top_level(fp)
+        file_size = _get_file_size(fp)
+        # where each box ends, for a box that cannot be decoded: at the next box found by the scan
+        box_ends = dict(zip([offset for offset, box_type in box_list],
+                            [offset for offset, box_type in box_list[1:]] + [file_size]))
+        moof_offsets = [offset for offset, box_type in box_list if box_type == 'moof']
+        parsed_moofs = {}
+        # the moov is parsed first as the 'senc' boxes in the fragments need the IV sizes from its 'tenc' boxes
+        iv_sizes = {}
+        parsed_moov = None
+        moov_offset = next((offset for offset, box_type in box_list if box_type == 'moov'), None)
+        if moov_offset is not None:
+            try:
+                fp.seek(moov_offset)
+                parsed_moov = parse_box(fp, self, file_size)
+                iv_sizes = self.iv_sizes = mp4.non_iso.get_iv_sizes(parsed_moov)
+            except:
+                print('Error decoding stream at {}'.format(moov_offset))
+                traceback.print_exc(file=sys.stdout)
+        if len(moof_offsets) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                                        initargs=(self.filename, iv_sizes,
+                                                                  self.box_filter)) as executor:
+                chunksize = max(1, len(moof_offsets) // (4 * (max_workers or os.cpu_count() or 1)))
+                results = executor.map(_parse_box_at, moof_offsets, chunksize=chunksize)
+                for offset, (current_box, error) in zip(moof_offsets, results):
+                    if error is not None:
+                        print('Error decoding stream at {}'.format(offset))
+                        print(error)
+                        if not self.recover:
+                            # as in sequential parsing, stop at the first box that could not be decoded
+                            box_list = [b for b in box_list if b[0] < offset]
+                            break
+                        self._add_damaged_region(offset, box_ends[offset] - offset, error.splitlines()[-1])
+                        continue
+                    current_box.parent = self
+                    parsed_moofs[offset] = current_box
+        # merge everything back in file order
+        for offset, box_type in box_list:
+            if offset in parsed_moofs:
+                self.child_boxes.append(parsed_moofs[offset])
+                continue
+            if offset == moov_offset and parsed_moov is not None:
+                self.child_boxes.append(parsed_moov)
+                continue
+            if box_type == 'moof' and len(moof_offsets) > 1:
+                # could not be decoded by a worker
+                continue
+            try:
+                fp.seek(offset)
+                self.child_boxes.append(parse_box(fp, self, file_size))
+            except Exception as e:
+                print('Error decoding stream at {}'.format(fp.tell()))
+                traceback.print_exc(file=sys.stdout)
+                if not self.recover:
+                    break
+                self._add_damaged_region(offset, box_ends[offset] - offset, e)
+        self.damaged_regions.sort(key=lambda region: region['offset'])
+
+    def hash_tree(self, algorithm=mp4.hashing.DEFAULT_ALGORITHM, block_size=mp4.hashing.DEFAULT_BLOCK_SIZE,
+                  max_workers=None):
+        """ Returns the root mp4.hashing.HashNode of a Merkle tree of the hashes of every box """
+        return mp4.hashing.hash_tree(self, algorithm, block_size, max_workers)
+
+    def get_tracks(self):
+        """ Returns a Track (see track.py) for each 'trak' in the 'moov' """
+        return [mp4.track.Track(self, trak) for trak in find_boxes(self, 'trak')]
+
+
+def _is_filename(filename):
+    return isinstance(filename, (str, bytes, os.PathLike))
+
+
+def _get_file_size(fp):
+    """ Returns the size of the file fp, leaving it at the start """
+    file_size = fp.seek(0, os.SEEK_END)
+    fp.seek(0)
+    return file_size
+
+
+class _WorkerFile:
+    """
+    Stands in for the Mp4File as the parent of top-level boxes parsed in a worker process. The real Mp4File
+    replaces it once the box has been returned.
+    """
+    def __init__(self, iv_sizes, box_filter):
+        self.type = 'file'
+        self.child_boxes = []
+        # track_ID: IV size, for decoding 'senc' boxes without the moov (see non_iso.SencBox)
+        self.iv_sizes = iv_sizes
+        self.box_filter = box_filter
+
+
+# per-process file handle, file size, IV sizes and box filter used by _parse_box_at()
+_worker_fp = None
+_worker_file_size = None
+_worker_iv_sizes = None
+_worker_box_filter = None
+
+
+def _init_worker(filename, iv_sizes, box_filter):
+    global _worker_fp, _worker_file_size, _worker_iv_sizes, _worker_box_filter
+    _worker_fp = open(filename, 'rb')
+    _worker_file_size = os.fstat(_worker_fp.fileno()).st_size
+    _worker_iv_sizes = iv_sizes
+    _worker_box_filter = box_filter
+
+
+def _parse_box_at(offset):
+    """ Returns (box, None), or (None, the traceback) if the box could not be decoded """
+    _worker_fp.seek(offset)
+    try:
+        return parse_box(_worker_fp, _WorkerFile(_worker_iv_sizes, _worker_box_filter), _worker_file_size), None
+    except Exception:
+        return None, traceback.format_exc()
 
 
 class FreeBox(Mp4Box):
@@ -91,7 +408,7 @@ class FtypBox(Mp4Box):
         try:
             self.box_info = {
                             'major_brand': fp.read(4).decode('utf-8'),
-                            'minor_version': "{0:#010x}".format(read_u32(fp)),
+                            'minor_version': "{0:#010x}".format(fp.u32()),
                             'compatible_brands': []
                             }
             bytes_left = self.size - (self.header.header_size + 8)
@@ -113,7 +430,7 @@ class PdinBox(Mp4FullBox):
         try:
             self.box_info['rates'] = []
             while fp.tell() < end_of_box:
-                self.box_info('rates').append({'rate': read_u32(fp), 'initial_delay': read_u32(fp)})
+                self.box_info('rates').append({'rate': fp.u32(), 'initial_delay': fp.u32()})
         finally:
             fp.seek(end_of_box)
 
@@ -135,7 +452,7 @@ class ContainerBox(Mp4Box):
 
 # All these are pure container boxes
 DinfBox = MinfBox = MdiaBox = TrefBox = EdtsBox = TrafBox = TrakBox = MoofBox = MoovBox = ContainerBox
-UdtaBox = TrgrBox = MvexBox = MfraBox = StrkBox = StrdBox = RinfBox = SinfBox = MecoBox = ContainerBox
+UdtaBox = TrgrBox = MvexBox = MfraBox = StrkBox = StrdBox = RinfBox = SinfBox = MecoBox = SchiBox = ContainerBox
 
 
 class MetaBox(Mp4FullBox):
@@ -170,24 +487,24 @@ class MvhdBox(Mp4FullBox):
             dt_base = datetime.datetime(1904, 1, 1, 0, 0, 0)
             if self.box_info['version'] == 1:
                 self.box_info['creation_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u64(fp)))).strftime('%Y-%m-%d %H:%M:%S')
+                        dt_base + datetime.timedelta(seconds=(fp.u64()))).strftime('%Y-%m-%d %H:%M:%S')
                 self.box_info['modification_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u64(fp)))).strftime('%Y-%m-%d %H:%M:%S')
-                self.box_info['timescale'] = read_u32(fp)
-                self.box_info['duration'] = read_u64(fp)
+                        dt_base + datetime.timedelta(seconds=(fp.u64()))).strftime('%Y-%m-%d %H:%M:%S')
+                self.box_info['timescale'] = fp.u32()
+                self.box_info['duration'] = fp.u64()
             else:
                 self.box_info['creation_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u32(fp)))).strftime('%Y-%m-%d %H:%M:%S')
+                        dt_base + datetime.timedelta(seconds=(fp.u32()))).strftime('%Y-%m-%d %H:%M:%S')
                 self.box_info['modification_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u32(fp)))).strftime('%Y-%m-%d %H:%M:%S')
-                self.box_info['timescale'] = read_u32(fp)
-                self.box_info['duration'] = read_u32(fp)
-            self.box_info['rate'] = read_u16_16(fp)
-            self.box_info['volume'] = read_u8_8(fp)
+                        dt_base + datetime.timedelta(seconds=(fp.u32()))).strftime('%Y-%m-%d %H:%M:%S')
+                self.box_info['timescale'] = fp.u32()
+                self.box_info['duration'] = fp.u32()
+            self.box_info['rate'] = fp.u16_16()
+            self.box_info['volume'] = fp.u8_8()
             fp.seek(10, 1)
-            self.box_info['matrix'] = ["{0:#010x}".format(b) for b in struct.unpack('>9I', fp.read(36))]
+            self.box_info['matrix'] = ["{0:#010x}".format(b) for b in fp.unpack('>9I')]
             fp.seek(24, 1)
-            self.box_info['next_track_id'] = read_u32(fp)
+            self.box_info['next_track_id'] = fp.u32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -197,7 +514,7 @@ class MfhdBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['sequence_number'] = read_u32(fp)
+            self.box_info['sequence_number'] = fp.u32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -208,28 +525,32 @@ class MehdBox(Mp4FullBox):
         super().__init__(fp, header, parent)
         try:
             if self.box_info['version'] == 1:
-                self.box_info['fragment_duration'] = read_u64(fp)
+                self.box_info['fragment_duration'] = fp.u64()
             else:
-                self.box_info['fragment_duration'] = read_u32(fp)
+                self.box_info['fragment_duration'] = fp.u32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
 
 class ElstBox(Mp4FullBox):
+    """
+    The edit list, decoded in one go into an array per field (segment_duration, media_time, media_rate_integer and
+    media_rate_fraction), shown as a list of entries by ColumnList. timeline.py works on the arrays.
+    """
 
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
-            for i in range(self.box_info['entry_count']):
-                if self.box_info['version'] == 1:
-                    self.box_info['segment_duration'] = read_u64(fp)
-                    self.box_info['media_time'] = read_i64(fp)
-                else:
-                    self.box_info['segment_duration'] = read_u32(fp)
-                    self.box_info['media_time'] = read_i32(fp)
-                self.box_info['media_rate_integer'] = read_i16(fp)
-            self.box_info['media_rate_fraction'] = read_i16(fp)
+            self.box_info['entry_count'] = fp.u32()
+            if self.box_info['version'] == 1:
+                fmt, typecodes = '>Qqhh', 'Qqhh'
+            else:
+                fmt, typecodes = '>Iihh', 'Iihh'
+            fields = list(zip(*fp.records(fmt, self.box_info['entry_count']))) or [()] * 4
+            self.box_info['entry_list'] = ColumnList({
+                name: array(typecode, values) for name, typecode, values in
+                zip(['segment_duration', 'media_time', 'media_rate_integer', 'media_rate_fraction'], typecodes,
+                    fields)})
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -242,28 +563,28 @@ class TkhdBox(Mp4FullBox):
             dt_base = datetime.datetime(1904, 1, 1, 0, 0, 0)
             if self.box_info['version'] == 1:
                 self.box_info['creation_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u64(fp)))).strftime('%Y-%m-%d %H:%M:%S')
+                        dt_base + datetime.timedelta(seconds=(fp.u64()))).strftime('%Y-%m-%d %H:%M:%S')
                 self.box_info['modification_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u64(fp)))).strftime('%Y-%m-%d %H:%M:%S')
-                self.box_info['track_ID'] = read_u32(fp)
+                        dt_base + datetime.timedelta(seconds=(fp.u64()))).strftime('%Y-%m-%d %H:%M:%S')
+                self.box_info['track_ID'] = fp.u32()
                 fp.seek(4, 1)
-                self.box_info['duration'] = read_u64(fp)
+                self.box_info['duration'] = fp.u64()
             else:
                 self.box_info['creation_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u32(fp)))).strftime('%Y-%m-%d %H:%M:%S')
+                        dt_base + datetime.timedelta(seconds=(fp.u32()))).strftime('%Y-%m-%d %H:%M:%S')
                 self.box_info['modification_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u32(fp)))).strftime('%Y-%m-%d %H:%M:%S')
-                self.box_info['track_ID'] = read_u32(fp)
+                        dt_base + datetime.timedelta(seconds=(fp.u32()))).strftime('%Y-%m-%d %H:%M:%S')
+                self.box_info['track_ID'] = fp.u32()
                 fp.seek(4, 1)
-                self.box_info['duration'] = read_u32(fp)
+                self.box_info['duration'] = fp.u32()
             fp.seek(8, 1)
-            self.box_info['layer'] = read_i16(fp)
-            self.box_info['alternate_group'] = read_i16(fp)
-            self.box_info['volume'] = read_u8_8(fp)
+            self.box_info['layer'] = fp.i16()
+            self.box_info['alternate_group'] = fp.i16()
+            self.box_info['volume'] = fp.u8_8()
             fp.seek(2, 1)
-            self.box_info['matrix'] = ["{0:#010x}".format(b) for b in struct.unpack('>9I', fp.read(36))]
-            self.box_info['width'] = read_u16_16(fp)
-            self.box_info['height'] = read_u16_16(fp)
+            self.box_info['matrix'] = ["{0:#010x}".format(b) for b in fp.unpack('>9I')]
+            self.box_info['width'] = fp.u16_16()
+            self.box_info['height'] = fp.u16_16()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -273,17 +594,20 @@ class TfhdBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['track_id'] = read_u32(fp)
-            if int(self.box_info['flags'][-1]) & 1 == 1:
-                self.box_info['base_data_offset'] = read_u64(fp)
-            if int(self.box_info['flags'][-1]) & 2 == 2:
-                self.box_info['sample_description_index'] = read_u32(fp)
-            if int(self.box_info['flags'][-2]) & 1 == 1:
-                self.box_info['default_sample_duration'] = read_u32(fp)
-            if int(self.box_info['flags'][-2]) & 2 == 2:
-                self.box_info['default_sample_size'] = read_u32(fp)
-            if int(self.box_info['flags'][-5]) & 2 == 2:
-                self.box_info['default_sample_flags'] = "{0:#08x}".format(read_u32(fp))
+            flags = int(self.box_info['flags'], 16)
+            self.box_info['track_id'] = fp.u32()
+            if flags & 0x000001:
+                self.box_info['base_data_offset'] = fp.u64()
+            if flags & 0x000002:
+                self.box_info['sample_description_index'] = fp.u32()
+            if flags & 0x000008:
+                self.box_info['default_sample_duration'] = fp.u32()
+            if flags & 0x000010:
+                self.box_info['default_sample_size'] = fp.u32()
+            if flags & 0x000020:
+                self.box_info['default_sample_flags'] = "{0:#08x}".format(fp.u32())
+            self.box_info['duration_is_empty'] = flags >> 16 & 1
+            self.box_info['default_base_is_moof'] = flags >> 17 & 1
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -293,11 +617,11 @@ class TrexBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['track_ID'] = read_u32(fp)
-            self.box_info['default_sample_description_index'] = read_u32(fp)
-            self.box_info['default_sample_duration'] = read_u32(fp)
-            self.box_info['default_sample_size'] = read_u32(fp)
-            self.box_info['default_sample_flags'] = "{0:#08x}".format(read_u32(fp))
+            self.box_info['track_ID'] = fp.u32()
+            self.box_info['default_sample_description_index'] = fp.u32()
+            self.box_info['default_sample_duration'] = fp.u32()
+            self.box_info['default_sample_size'] = fp.u32()
+            self.box_info['default_sample_flags'] = "{0:#08x}".format(fp.u32())
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -307,20 +631,20 @@ class LevaBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['level_count'] = read_u8(fp)
+            self.box_info['level_count'] = fp.u8()
             self.box_info['level_list'] = []
             for i in range(self.box_info['level_count']):
-                level_dict = {'track_ID': read_u32(fp)}
-                pad_assign = read_u8(fp)
+                level_dict = {'track_ID': fp.u32()}
+                pad_assign = fp.u8()
                 level_dict['padding_flag'] = pad_assign // 128
                 level_dict['assignment_type'] = pad_assign % 128
                 if level_dict['assignment_type'] == 0:
                     level_dict['grouping_type'] = fp.read(4).decode('utf-8')
                 elif level_dict['assignment_type'] == 1:
                     level_dict['grouping_type'] = fp.read(4).decode('utf-8')
-                    level_dict['grouping_type_parameter'] = read_u32(fp)
+                    level_dict['grouping_type_parameter'] = fp.u32()
                 elif level_dict['assignment_type'] == 4:
-                    level_dict['sub_track_id'] = read_u32(fp)
+                    level_dict['sub_track_id'] = fp.u32()
                 self.box_info['level_list'].append(level_dict)
         finally:
             fp.seek(self.start_of_box + self.size)
@@ -331,39 +655,39 @@ class TfraBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['track_ID'] = read_u32(fp)
-            length_fields = read_u32(fp)
+            self.box_info['track_ID'] = fp.u32()
+            length_fields = fp.u32()
             self.box_info['length_size_of_traf_num'] = length_fields >> 4 & 3
             self.box_info['length_size_of_trun_num'] = length_fields >> 2 & 3
             self.box_info['length_size_of_sample_num'] = length_fields & 3
-            self.box_info['number_of_entry'] = read_u32(fp)
+            self.box_info['number_of_entry'] = fp.u32()
             self.box_info['entry_list'] = []
             for i in range(self.box_info['number_of_entry']):
                 entry_dict = {}
                 if self.box_info['version'] == 1:
-                    entry_dict['time'] = read_u64(fp)
-                    entry_dict['moof_offset'] = read_u64(fp)
+                    entry_dict['time'] = fp.u64()
+                    entry_dict['moof_offset'] = fp.u64()
                 else:
-                    entry_dict['time'] = read_u32(fp)
-                    entry_dict['moof_offset'] = read_u32(fp)
+                    entry_dict['time'] = fp.u32()
+                    entry_dict['moof_offset'] = fp.u32()
                 if self.box_info['length_size_of_traf_num'] == 0:
-                    entry_dict['traf_number'] = read_u8(fp)
+                    entry_dict['traf_number'] = fp.u8()
                 elif self.box_info['length_size_of_traf_num'] == 1:
-                    entry_dict['traf_number'] = read_u16(fp)
+                    entry_dict['traf_number'] = fp.u16()
                 elif self.box_info['length_size_of_traf_num'] == 3:
-                    entry_dict['traf_number'] = read_u32(fp)
+                    entry_dict['traf_number'] = fp.u32()
                 if self.box_info['length_size_of_trun_num'] == 0:
-                    entry_dict['trun_number'] = read_u8(fp)
+                    entry_dict['trun_number'] = fp.u8()
                 elif self.box_info['length_size_of_trun_num'] == 1:
-                    entry_dict['trun_number'] = read_u16(fp)
+                    entry_dict['trun_number'] = fp.u16()
                 elif self.box_info['length_size_of_trun_num'] == 3:
-                    entry_dict['trun_number'] = read_u32(fp)
+                    entry_dict['trun_number'] = fp.u32()
                 if self.box_info['length_size_of_sample_num'] == 0:
-                    entry_dict['sample_number'] = read_u8(fp)
+                    entry_dict['sample_number'] = fp.u8()
                 elif self.box_info['length_size_of_sample_num'] == 1:
-                    entry_dict['sample_number'] = read_u16(fp)
+                    entry_dict['sample_number'] = fp.u16()
                 elif self.box_info['length_size_of_sample_num'] == 3:
-                    entry_dict['sample_number'] = read_u32(fp)
+                    entry_dict['sample_number'] = fp.u32()
                 self.box_info['entry_list'].append(entry_dict)
         finally:
             fp.seek(self.start_of_box + self.size)
@@ -374,7 +698,7 @@ class MfroBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['size'] = read_u32(fp)
+            self.box_info['size'] = fp.u32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -385,7 +709,7 @@ class CprtBox(Mp4FullBox):
         super().__init__(fp, header, parent)
         try:
             # I think this is right
-            lang = read_u16(fp)
+            lang = fp.u16()
             if lang == 0:
                 self.box_info['language'] = '0x00'
             else:
@@ -404,7 +728,7 @@ class TselBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['switch_group'] = read_u32(fp)
+            self.box_info['switch_group'] = fp.u32()
             bytes_left = self.size - (self.header.length + 8)
             attr_list = []
             while bytes_left > 0:
@@ -420,9 +744,9 @@ class StriBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['switch_group'] = read_u16(fp)
-            self.box_info['alternate_group'] = read_u16(fp)
-            self.box_info['sub_track_ID'] = read_u32(fp)
+            self.box_info['switch_group'] = fp.u16()
+            self.box_info['alternate_group'] = fp.u16()
+            self.box_info['sub_track_ID'] = fp.u32()
             bytes_left = self.size - (self.header.length + 12)
             attr_list = []
             while bytes_left > 0:
@@ -438,48 +762,48 @@ class IlocBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['offset_size'] = read_u32(fp)
-            self.box_info['length_size'] = read_u32(fp)
-            self.box_info['base_offset_size'] = read_u32(fp)
+            self.box_info['offset_size'] = fp.u32()
+            self.box_info['length_size'] = fp.u32()
+            self.box_info['base_offset_size'] = fp.u32()
             if self.box_info['version'] == 1 or self.box_info['version'] == 2:
-                self.box_info['index_size'] = read_u32(fp)
+                self.box_info['index_size'] = fp.u32()
             else:
-                self.box_info['reserved'] = read_u32(fp)
+                self.box_info['reserved'] = fp.u32()
             if self.box_info['version'] < 2:
-                self.box_info['item_count'] = read_u16(fp)
+                self.box_info['item_count'] = fp.u16()
             elif self.box_info['version'] == 2:
-                self.box_info['item_count'] = read_u32(fp)
+                self.box_info['item_count'] = fp.u32()
             self.box_info['item_list'] = []
             for i in range(self.box_info['item_count']):
                 item = {}
                 if self.box_info['version'] < 2:
-                    item['item_ID'] = read_u16(fp)
+                    item['item_ID'] = fp.u16()
                 elif self.box_info['version'] == 2:
-                    item['item_ID'] = read_u32(fp)
+                    item['item_ID'] = fp.u32()
                 if self.box_info['version'] == 1 or self.box_info['version'] == 2:
-                    item['construction_method'] = read_u16(fp) % 16
-                item['data_reference_index'] = read_u16(fp)
+                    item['construction_method'] = fp.u16() % 16
+                item['data_reference_index'] = fp.u16()
                 if self.box_info['offset_size'] == 4:
-                    item['base_offset'] = read_u32(fp)
+                    item['base_offset'] = fp.u32()
                 elif self.box_info['offset_size'] == 8:
-                    item['base_offset'] = read_u64(fp)
-                item['extent_count'] = read_u16(fp)
+                    item['base_offset'] = fp.u64()
+                item['extent_count'] = fp.u16()
                 item['extent_list'] = []
                 for j in range(item['extent_count']):
                     extent = {}
                     if self.box_info['version'] == 1 or self.box_info['version'] == 2:
                         if self.box_info['index_size'] == 4:
-                            extent['extent_index'] = read_u32(fp)
+                            extent['extent_index'] = fp.u32()
                         elif self.box_info['index_size'] == 8:
-                            extent['extent_index'] = read_u64(fp)
+                            extent['extent_index'] = fp.u64()
                     if self.box_info['offset_size'] == 4:
-                        extent['extent_offset'] = read_u32(fp)
+                        extent['extent_offset'] = fp.u32()
                     elif self.box_info['offset_size'] == 8:
-                        extent['extent_offset'] = read_u64(fp)
+                        extent['extent_offset'] = fp.u64()
                     if self.box_info['length_size'] == 4:
-                        extent['extent_length'] = read_u32(fp)
+                        extent['extent_length'] = fp.u32()
                     elif self.box_info['length_size'] == 8:
-                        extent['extent_length'] = read_u64(fp)
+                        extent['extent_length'] = fp.u64()
                     item['extent_list'].append(extent)
                 self.box_info['item_list'].append(item)
         finally:
@@ -491,7 +815,7 @@ class IproBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['protection_count'] = read_u16(fp)
+            self.box_info['protection_count'] = fp.u16()
             for i in range(self.box_info['protection_count']):
                 current_header = Header(fp)
                 current_box = box_factory(fp, current_header, self)
@@ -516,7 +840,7 @@ class SchmBox(Mp4FullBox):
         super().__init__(fp, header, parent)
         try:
             self.box_info['scheme_type'] = fp.read(4).decode('utf-8')
-            self.box_info['scheme_version'] = read_u32(fp)
+            self.box_info['scheme_version'] = fp.u32()
             if int(self.box_info['flags'][-1], 16) & 1 == 1:
                 self.box_info['data_offset'] = fp.read(self.size - (self.header.length + 12)).decode('utf-8')
         finally:
@@ -539,9 +863,9 @@ class PitmBox(Mp4FullBox):
         super().__init__(fp, header, parent)
         try:
             if self.box_info['version'] == 0:
-                self.box_info['item_ID'] = read_u16(fp)
+                self.box_info['item_ID'] = fp.u16()
             else:
-                self.box_info['item_ID'] = read_u32(fp)
+                self.box_info['item_ID'] = fp.u32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -569,7 +893,7 @@ class MereBox(Mp4FullBox):
         try:
             self.box_info['first_metabox_handler_type'] = fp.read(4).decode('utf-8')
             self.box_info['second_metabox_handler_type'] = fp.read(4).decode('utf-8')
-            self.box_info['metabox_relation'] = read_u8(fp)
+            self.box_info['metabox_relation'] = fp.u8()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -580,15 +904,15 @@ class TrunBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['sample_count'] = read_u32(fp)
+            self.box_info['sample_count'] = fp.u32()
             has_sample_duration = False
             has_sample_size = False
             has_sample_flags = False
             has_scto = False
             if int(self.box_info['flags'][-1], 16) & 1 == 1:
-                self.box_info['data_offset'] = read_i32(fp)
+                self.box_info['data_offset'] = fp.i32()
             if int(self.box_info['flags'][-1], 16) & 4 == 4:
-                self.box_info['first_sample_flags'] = "{0:#08x}".format(read_u32(fp))
+                self.box_info['first_sample_flags'] = "{0:#08x}".format(fp.u32())
             if int(self.box_info['flags'][-3], 16) & 1 == 1:
                 has_sample_duration = True
             if int(self.box_info['flags'][-3], 16) & 2 == 2:
@@ -597,21 +921,25 @@ class TrunBox(Mp4FullBox):
                 has_sample_flags = True
             if int(self.box_info['flags'][-3], 16) & 8 == 8:
                 has_scto = True
-            sample_list = []
-            for i in range(self.box_info['sample_count']):
-                sample = {}
-                if has_sample_duration:
-                    sample['sample_duration'] = read_u32(fp)
-                if has_sample_size:
-                    sample['sample_size'] = read_u32(fp)
-                if has_sample_flags:
-                    sample['sample_flags'] = "{0:#08x}".format(read_u32(fp))
-                if has_scto:
-                    if int(self.box_info['version']) == 1:
-                        self.box_info['sample_composition_time_offset'] = read_u64(fp)
-                    else:
-                        self.box_info['sample_composition_time_offset'] = read_u32(fp)
-                sample_list.append(sample)
+            # every sample has the same fields, so the samples are read as records of one struct format
+            names = []
+            fmt = '>'
+            if has_sample_duration:
+                names.append('sample_duration')
+                fmt += 'I'
+            if has_sample_size:
+                names.append('sample_size')
+                fmt += 'I'
+            if has_sample_flags:
+                names.append('sample_flags')
+                fmt += 'I'
+            if has_scto:
+                names.append('sample_composition_time_offset')
+                fmt += 'i' if int(self.box_info['version']) == 1 else 'I'
+            sample_list = [dict(zip(names, record)) for record in fp.records(fmt, self.box_info['sample_count'])]
+            if has_sample_flags:
+                for sample in sample_list:
+                    sample['sample_flags'] = "{0:#08x}".format(sample['sample_flags'])
             self.box_info['samples'] = sample_list
         finally:
             fp.seek(self.start_of_box + self.size)
@@ -623,9 +951,9 @@ class TfdtBox(Mp4FullBox):
         super().__init__(fp, header, parent)
         try:
             if int(self.box_info['version']) == 1:
-                self.box_info['baseMediaDecode'] = read_u64(fp)
+                self.box_info['baseMediaDecode'] = fp.u64()
             else:
-                self.box_info['baseMediaDecode'] = read_u32(fp)
+                self.box_info['baseMediaDecode'] = fp.u32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -638,22 +966,20 @@ class MdhdBox(Mp4FullBox):
             dt_base = datetime.datetime(1904, 1, 1, 0, 0, 0)
             if self.box_info['version'] == 1:
                 self.box_info['creation_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u64(fp)))).strftime('%Y-%m-%d %H:%M:%S')
+                        dt_base + datetime.timedelta(seconds=(fp.u64()))).strftime('%Y-%m-%d %H:%M:%S')
                 self.box_info['modification_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u64(fp)))).strftime('%Y-%m-%d %H:%M:%S')
-                self.box_info['timescale'] = read_u32(fp)
-                fp.seek(4, 1)
-                self.box_info['duration'] = read_u64(fp)
+                        dt_base + datetime.timedelta(seconds=(fp.u64()))).strftime('%Y-%m-%d %H:%M:%S')
+                self.box_info['timescale'] = fp.u32()
+                self.box_info['duration'] = fp.u64()
             else:
                 self.box_info['creation_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u32(fp)))).strftime('%Y-%m-%d %H:%M:%S')
+                        dt_base + datetime.timedelta(seconds=(fp.u32()))).strftime('%Y-%m-%d %H:%M:%S')
                 self.box_info['modification_time'] = (
-                        dt_base + datetime.timedelta(seconds=(read_u32(fp)))).strftime('%Y-%m-%d %H:%M:%S')
-                self.box_info['timescale'] = read_u32(fp)
-                fp.seek(4, 1)
-                self.box_info['duration'] = read_u32(fp)
+                        dt_base + datetime.timedelta(seconds=(fp.u32()))).strftime('%Y-%m-%d %H:%M:%S')
+                self.box_info['timescale'] = fp.u32()
+                self.box_info['duration'] = fp.u32()
             # I think this is right
-            lang = struct.unpack('>H', fp.read(2))[0]
+            lang = fp.u16()
             if lang == 0:
                 self.box_info['language'] = '0x00'
             else:
@@ -680,7 +1006,7 @@ class DrefBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
+            self.box_info['entry_count'] = fp.u32()
             for i in range(self.box_info['entry_count']):
                 current_header = Header(fp)
                 current_box = box_factory(fp, current_header, self)
@@ -746,6 +1072,8 @@ class StblBox(Mp4Box):
             stdp_ord = None
             sdtp_ord = None
             for i, this_child in enumerate(self.child_boxes):
+                if isinstance(this_child, SkippedBox):
+                    continue
                 if this_child.type == 'stsz' or this_child.type == 'stz2':
                     sc = this_child.box_info['sample_count']
                     if stdp_ord is not None and sdtp_ord is not None:
@@ -766,13 +1094,17 @@ class StblBox(Mp4Box):
             fp.seek(self.start_of_box + self.size)
 
 
+# the boxes that hold other boxes, which are decoded whatever the box filter so that their children can be reached
+CONTAINER_BOX_CLASSES = (ContainerBox, MetaBox, StblBox)
+
+
 class VmhdBox(Mp4FullBox):
 
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['graphicsmode'] = read_u16(fp)
-            self.box_info['opcolor'] = struct.unpack('>3H', fp.read(6))
+            self.box_info['graphicsmode'] = fp.u16()
+            self.box_info['opcolor'] = fp.unpack('>3H')
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -782,7 +1114,7 @@ class SmhdBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['balance'] = read_i8_8(fp)
+            self.box_info['balance'] = fp.i8_8()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -792,10 +1124,10 @@ class HmhdBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['maxPDUsize'] = read_u16(fp)
-            self.box_info['avgPDUsize'] = read_u16(fp)
-            self.box_info['maxbitrate'] = read_u32(fp)
-            self.box_info['avgbitrate'] = read_u32(fp)
+            self.box_info['maxPDUsize'] = fp.u16()
+            self.box_info['avgPDUsize'] = fp.u16()
+            self.box_info['maxbitrate'] = fp.u32()
+            self.box_info['avgbitrate'] = fp.u32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -816,7 +1148,7 @@ class StsdBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
+            self.box_info['entry_count'] = fp.u32()
             for i in range(self.box_info['entry_count']):
                 current_header = Header(fp)
                 current_box = box_factory(fp, current_header, self)
@@ -830,10 +1162,10 @@ class SttsBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
-            self.box_info['entry_list'] = []
-            for i in range(self.box_info['entry_count']):
-                self.box_info['entry_list'].append({'sample_count': read_u32(fp), 'sample_delta': read_u32(fp)})
+            self.box_info['entry_count'] = fp.u32()
+            self.box_info['entry_list'] = [{'sample_count': sample_count, 'sample_delta': sample_delta}
+                                           for sample_count, sample_delta in
+                                           fp.records('>II', self.box_info['entry_count'])]
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -843,13 +1175,11 @@ class CttsBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
-            self.box_info['entry_list'] = []
-            for i in range(self.box_info['entry_count']):
-                if self.box_info['version'] == 1:
-                    self.box_info['entry_list'].append({'sample_count': read_u32(fp), 'sample_offset': read_i32(fp)})
-                else:
-                    self.box_info['entry_list'].append({'sample_count': read_u32(fp), 'sample_offset': read_i32(fp)})
+            self.box_info['entry_count'] = fp.u32()
+            # read as signed for both versions, as negative offsets are found in version 0 boxes too
+            self.box_info['entry_list'] = [{'sample_count': sample_count, 'sample_offset': sample_offset}
+                                           for sample_count, sample_offset in
+                                           fp.records('>Ii', self.box_info['entry_count'])]
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -860,17 +1190,17 @@ class CslgBox(Mp4FullBox):
         super().__init__(fp, header, parent)
         try:
             if self.box_info['version'] == 1:
-                self.box_info['compositionToDTSShift'] = read_i64(fp)
-                self.box_info['leastDecodeToDisplayDelta'] = read_i64(fp)
-                self.box_info['greatestDecodeToDisplayDelta'] = read_i64(fp)
-                self.box_info['compositionStartTime'] = read_i64(fp)
-                self.box_info['compositionEndTime'] = read_i64(fp)
+                self.box_info['compositionToDTSShift'] = fp.i64()
+                self.box_info['leastDecodeToDisplayDelta'] = fp.i64()
+                self.box_info['greatestDecodeToDisplayDelta'] = fp.i64()
+                self.box_info['compositionStartTime'] = fp.i64()
+                self.box_info['compositionEndTime'] = fp.i64()
             else:
-                self.box_info['compositionToDTSShift'] = read_i32(fp)
-                self.box_info['leastDecodeToDisplayDelta'] = read_i32(fp)
-                self.box_info['greatestDecodeToDisplayDelta'] = read_i32(fp)
-                self.box_info['compositionStartTime'] = read_i32(fp)
-                self.box_info['compositionEndTime'] = read_i32(fp)
+                self.box_info['compositionToDTSShift'] = fp.i32()
+                self.box_info['leastDecodeToDisplayDelta'] = fp.i32()
+                self.box_info['greatestDecodeToDisplayDelta'] = fp.i32()
+                self.box_info['compositionStartTime'] = fp.i32()
+                self.box_info['compositionEndTime'] = fp.i32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -880,10 +1210,9 @@ class StssBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
-            self.box_info['entry_list'] = []
-            for i in range(self.box_info['entry_count']):
-                self.box_info['entry_list'].append({'sample_number': read_u32(fp)})
+            self.box_info['entry_count'] = fp.u32()
+            self.box_info['entry_list'] = [{'sample_number': sample_number}
+                                           for sample_number in fp.u32_array(self.box_info['entry_count'])]
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -893,13 +1222,9 @@ class StshBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
-            self.box_info['entry_list'] = []
-            for i in range(self.box_info['entry_count']):
-                self.box_info['entry_list'].append({
-                                                    'shadowed_sample_number': read_u32(fp),
-                                                    'sync_sample_number': read_u32(fp)
-                                                    })
+            self.box_info['entry_count'] = fp.u32()
+            self.box_info['entry_list'] = [{'shadowed_sample_number': shadowed, 'sync_sample_number': sync}
+                                           for shadowed, sync in fp.records('>II', self.box_info['entry_count'])]
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -909,14 +1234,11 @@ class StscBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
-            self.box_info['entry_list'] = []
-            for i in range(self.box_info['entry_count']):
-                first_chunk = read_u32(fp)
-                samples_per_chunk = read_u32(fp)
-                samples_description_index = read_u32(fp)
-                self.box_info['entry_list'].append({'first_chunk': first_chunk, 'samples_per_chunk': samples_per_chunk,
-                                                    'samples_description_index': samples_description_index})
+            self.box_info['entry_count'] = fp.u32()
+            self.box_info['entry_list'] = [{'first_chunk': first_chunk, 'samples_per_chunk': samples_per_chunk,
+                                            'samples_description_index': samples_description_index}
+                                           for first_chunk, samples_per_chunk, samples_description_index in
+                                           fp.records('>III', self.box_info['entry_count'])]
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -926,10 +1248,9 @@ class StcoBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
-            self.box_info['entry_list'] = []
-            for i in range(self.box_info['entry_count']):
-                self.box_info['entry_list'].append({'chunk_offset': read_u32(fp)})
+            self.box_info['entry_count'] = fp.u32()
+            self.box_info['entry_list'] = [{'chunk_offset': chunk_offset}
+                                           for chunk_offset in fp.u32_array(self.box_info['entry_count'])]
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -939,10 +1260,9 @@ class Co64Box(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
-            self.box_info['entry_list'] = []
-            for i in range(self.box_info['entry_count']):
-                self.box_info['entry_list'].append({'chunk_offset': read_u64(fp)})
+            self.box_info['entry_count'] = fp.u32()
+            self.box_info['entry_list'] = [{'chunk_offset': chunk_offset}
+                                           for chunk_offset in fp.u64_array(self.box_info['entry_count'])]
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -952,10 +1272,10 @@ class PadbBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['sample_count'] = read_u32(fp)
+            self.box_info['sample_count'] = fp.u32()
             self.box_info['sample_list'] = []
             for i in range(self.box_info['sample_count']):
-                pads = read_u8(fp)
+                pads = fp.u8()
                 self.box_info['entry_list'].append({'pad1': pads // 16, 'pad2': pads % 16})
         finally:
             fp.seek(self.start_of_box + self.size)
@@ -966,21 +1286,21 @@ class SubsBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['entry_count'] = read_u32(fp)
+            self.box_info['entry_count'] = fp.u32()
             self.box_info['entry_list'] = []
             for i in range(self.box_info['entry_count']):
-                sample_delta = read_u32(fp)
-                subsample_count = read_u16(fp)
+                sample_delta = fp.u32()
+                subsample_count = fp.u16()
                 if subsample_count > 0:
                     subsample_list = []
                     for j in range(subsample_count):
                         if self.box_info['version'] == 1:
-                            subsample_size = read_u32(fp)
+                            subsample_size = fp.u32()
                         else:
-                            subsample_size = read_u16(fp)
-                        subsample_priority = read_u8(fp)
-                        discardable = read_u8(fp)
-                        codec_specific_parameters = read_u32(fp)
+                            subsample_size = fp.u16()
+                        subsample_priority = fp.u8()
+                        discardable = fp.u8()
+                        codec_specific_parameters = fp.u32()
                         subsample_list.append({
                                                 'subsample_size': subsample_size,
                                                 'subsample_priority': subsample_priority,
@@ -1003,13 +1323,13 @@ class SbgpBox(Mp4FullBox):
         try:
             self.box_info['grouping_type'] = fp.read(4).decode('utf-8')
             if self.box_info['version'] == 1:
-                self.box_info['grouping_type_parameter'] = read_u32(fp)
-            self.box_info['entry_count'] = read_u32(fp)
+                self.box_info['grouping_type_parameter'] = fp.u32()
+            self.box_info['entry_count'] = fp.u32()
             self.box_info['entry_list'] = []
             for i in range(self.box_info['entry_count']):
                 self.box_info['entry_list'].append({
-                                                    'sample_count': read_u32(fp),
-                                                    'group_description_index': read_u32(fp)
+                                                    'sample_count': fp.u32(),
+                                                    'group_description_index': fp.u32()
                                                   })
         finally:
             fp.seek(self.start_of_box + self.size)
@@ -1022,14 +1342,14 @@ class SgpdBox(Mp4FullBox):
         try:
             self.box_info['grouping_type'] = fp.read(4).decode('utf-8')
             if self.box_info['version'] == 1:
-                self.box_info['default_length'] = read_u32(fp)
+                self.box_info['default_length'] = fp.u32()
             elif self.box_info['version'] >= 2:
-                self.box_info['default_sample_description_index'] = read_u32(fp)
-            self.box_info['entry_count'] = read_u32(fp)
+                self.box_info['default_sample_description_index'] = fp.u32()
+            self.box_info['entry_count'] = fp.u32()
             self.box_info['entry_list'] = []
             for i in range(self.box_info['entry_count']):
                 if self.box_info['default_length'] == 0 and self.box_info['version'] == 1:
-                    description_length = read_u32(fp)
+                    description_length = fp.u32()
                 else:
                     description_length = self.box_info['default_length']
                 sample_group_entry = binascii.b2a_hex(fp.read(description_length)).decode('utf-8')
@@ -1045,13 +1365,14 @@ class SaizBox(Mp4FullBox):
         try:
             if int(self.box_info['flags'][-1], 16) == 1:
                 self.box_info['aux_info_type'] = fp.read(4).decode('utf-8')
-                self.box_info['aux_info_type_parameter'] = read_u32(fp)
-            self.box_info['default_sample_info_size'] = read_u8(fp)
-            self.box_info['sample_count'] = read_u32(fp)
+                self.box_info['aux_info_type_parameter'] = fp.u32()
+            self.box_info['default_sample_info_size'] = fp.u8()
+            self.box_info['sample_count'] = fp.u32()
+            # one byte per sample, read in one go
+            self.sample_info_sizes = array('B')
             if self.box_info['default_sample_info_size'] == 0:
-                self.box_info['sample_info_size_list'] = []
-                for i in range(self.box_info['sample_count']):
-                    self.box_info['sample_info_size_list'].append({'sample_info_size': read_u8(fp)})
+                self.sample_info_sizes.frombytes(fp.read(self.box_info['sample_count']))
+                self.box_info['sample_info_size_list'] = ColumnList({'sample_info_size': self.sample_info_sizes})
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -1063,14 +1384,13 @@ class SaioBox(Mp4FullBox):
         try:
             if int(self.box_info['flags'][-1], 16) == 1:
                 self.box_info['aux_info_type'] = fp.read(4).decode('utf-8')
-                self.box_info['aux_info_type_parameter'] = read_u32(fp)
-            self.box_info['entry_count'] = read_u32(fp)
-            self.box_info['offset_list'] = []
-            for i in range(self.box_info['entry_count']):
-                if self.box_info['version'] == 0:
-                    self.box_info['offset_list'].append({'offset': read_u32(fp)})
-                else:
-                    self.box_info['offset_list'].append({'offset': read_u64(fp)})
+                self.box_info['aux_info_type_parameter'] = fp.u32()
+            self.box_info['entry_count'] = fp.u32()
+            if self.box_info['version'] == 0:
+                self.offsets = fp.u32_array(self.box_info['entry_count'])
+            else:
+                self.offsets = fp.u64_array(self.box_info['entry_count'])
+            self.box_info['offset_list'] = ColumnList({'offset': self.offsets})
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -1080,81 +1400,100 @@ class StszBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['sample_size'] = read_u32(fp)
-            self.box_info['sample_count'] = read_u32(fp)
+            self.box_info['sample_size'] = fp.u32()
+            self.box_info['sample_count'] = fp.u32()
             if self.box_info['sample_size'] == 0:
-                self.box_info['entry_list'] = []
-                for i in range(self.box_info['sample_count']):
-                    self.box_info['entry_list'].append({'entry_size': read_u32(fp)})
+                self.box_info['entry_list'] = [{'entry_size': entry_size}
+                                               for entry_size in fp.u32_array(self.box_info['sample_count'])]
         finally:
             fp.seek(self.start_of_box + self.size)
 
 
+# tables for bytes.translate() splitting each byte of 4-bit 'stz2' sizes into its two samples
+STZ2_HIGH_NIBBLE = bytes(i >> 4 for i in range(256))
+STZ2_LOW_NIBBLE = bytes(i & 15 for i in range(256))
+
+
 class Stz2Box(Mp4FullBox):
+    """
+    Compact sample sizes, of 4, 8 or 16 bits each. 4-bit sizes are split out of their bytes with bytes.translate(),
+    the first of each pair of samples being in the high nibble.
+    """
 
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['field_size'] = read_u32(fp)
-            self.box_info['sample_count'] = read_u32(fp)
-            if self.box_info['sample_size'] == 0:
-                self.box_info['entry_list'] = []
-                for i in range(self.box_info['sample_count']):
-                    if self.box_info['field_size'] == 4:
-                        mybyte = read_u8(fp)
-                        self.box_info['entry_list'].append({'entry_size': mybyte // 16, 'entry_size+': mybyte % 16})
-                    if self.box_info['field_size'] == 8:
-                        self.box_info['entry_list'].append({'entry_size': read_u8(fp)})
-                    if self.box_info['field_size'] == 16:
-                        self.box_info['entry_list'].append({'entry_size': read_u16(fp)})
+            self.box_info['field_size'] = fp.u32() % 256
+            sample_count = self.box_info['sample_count'] = fp.u32()
+            if self.box_info['field_size'] == 4:
+                table = fp.u8_array((sample_count + 1) // 2).tobytes()
+                sizes = bytearray(2 * len(table))
+                sizes[0::2] = table.translate(STZ2_HIGH_NIBBLE)
+                sizes[1::2] = table.translate(STZ2_LOW_NIBBLE)
+                entry_sizes = array('B', sizes[:sample_count])
+            elif self.box_info['field_size'] == 8:
+                entry_sizes = fp.u8_array(sample_count)
+            elif self.box_info['field_size'] == 16:
+                entry_sizes = fp.u16_array(sample_count)
+            else:
+                entry_sizes = array('B')
+            self.box_info['entry_list'] = ColumnList({'entry_size': entry_sizes})
         finally:
             fp.seek(self.start_of_box + self.size)
 
 
 class StdpBox(Mp4FullBox):
+    """ Sample degradation priorities, one u16 per sample, the count coming from the 'stsz' (see StblBox) """
 
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            pass
+            self.priorities = array('H')
+            self.priorities.frombytes(fp.read((self.start_of_box + self.size - fp.tell()) // 2 * 2))
+            if sys.byteorder == 'little':
+                self.priorities.byteswap()
+            self.update_table(fp, len(self.priorities))
         finally:
             fp.seek(self.start_of_box + self.size)
 
     def update_table(self, fp, sc):
-        fp_orig = fp.tell()
-        fp.seek(self.start_of_box + self.header.header_size + 4)
-        self.box_info['sample_list'] = []
-        for i in range(sc):
-            self.box_info['sample_list'].append({'priority': read_u16(fp)})
-        fp.seek(fp_orig)
+        if sc is not None:
+            del self.priorities[sc:]
+        self.box_info['sample_list'] = ColumnList({'priority': self.priorities})
+
+
+# tables for bytes.translate() splitting the sdtp byte of each sample into its four 2-bit fields
+SDTP_IS_LEADING = bytes(i >> 6 for i in range(256))
+SDTP_SAMPLE_DEPENDS_ON = bytes(i >> 4 & 3 for i in range(256))
+SDTP_SAMPLE_IS_DEPENDED_ON = bytes(i >> 2 & 3 for i in range(256))
+SDTP_SAMPLE_HAS_REDUNDANCY = bytes(i & 3 for i in range(256))
 
 
 class SdtpBox(Mp4FullBox):
+    """
+    Independent and disposable samples, one byte per sample. In an 'stbl' the sample count comes from the 'stsz'
+    (see StblBox), in a 'traf' it is the rest of the box. The bytes are kept as they are in table and split into a
+    column per field with bytes.translate().
+    """
 
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            pass
+            self.table = fp.read(self.start_of_box + self.size - fp.tell())
+            self.update_table(fp, len(self.table))
         finally:
             fp.seek(self.start_of_box + self.size)
 
     def update_table(self, fp, sc):
-        fp_orig = fp.tell()
-        fp.seek(self.start_of_box + self.header.header_size + 4)
-        self.box_info['sample_list'] = []
-        for i in range(sc):
-            the_byte = read_u8(fp)
-            is_leading = the_byte >> 6
-            depends_on = the_byte >> 4 & 3
-            is_depended_on = the_byte >> 2 & 3
-            has_redundancy = the_byte & 3
-            self.box_info['sample_list'].append({
-                                                'is_leading': is_leading,
-                                                'sample_depends_on': depends_on,
-                                                'sample_is_depended_on': is_depended_on,
-                                                'sample_has_redundancy': has_redundancy
-                                                })
-        fp.seek(fp_orig)
+        self.table = self.table[:sc]
+        self.box_info['sample_list'] = ColumnList({
+                                                  'is_leading': self.table.translate(SDTP_IS_LEADING),
+                                                  'sample_depends_on': self.table.translate(SDTP_SAMPLE_DEPENDS_ON),
+                                                  'sample_is_depended_on':
+                                                      self.table.translate(SDTP_SAMPLE_IS_DEPENDED_ON),
+                                                  'sample_has_redundancy':
+                                                      self.table.translate(SDTP_SAMPLE_HAS_REDUNDANCY)
+                                                  })
 
 
 class SidxBox(Mp4FullBox):
@@ -1162,21 +1501,21 @@ class SidxBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['reference_ID'] = read_u32(fp)
-            self.box_info['timescale'] = read_u32(fp)
+            self.box_info['reference_ID'] = fp.u32()
+            self.box_info['timescale'] = fp.u32()
             if self.box_info['version'] == 0:
-                self.box_info['earliest_presentation_time'] = read_u32(fp)
-                self.box_info['first_offset'] = read_u32(fp)
+                self.box_info['earliest_presentation_time'] = fp.u32()
+                self.box_info['first_offset'] = fp.u32()
             else:
-                self.box_info['earliest_presentation_time'] = read_u64(fp)
-                self.box_info['first_offset'] = read_u64(fp)
+                self.box_info['earliest_presentation_time'] = fp.u64()
+                self.box_info['first_offset'] = fp.u64()
             fp.seek(2, 1)
-            self.box_info['reference_count'] = read_u16(fp)
+            self.box_info['reference_count'] = fp.u16()
             self.box_info['reference_list'] = []
             for i in range(self.box_info['reference_count']):
-                rt_sz = read_u32(fp)
-                subsegment_dur = read_u32(fp)
-                st_sz = read_u32(fp)
+                rt_sz = fp.u32()
+                subsegment_dur = fp.u32()
+                st_sz = fp.u32()
                 self.box_info['reference_list'].append({
                                                         'reference_type': rt_sz >> 31,
                                                         'reference_size': rt_sz % 2147483648,
@@ -1194,13 +1533,13 @@ class SsixBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['subsegment_count'] = read_u32(fp)
+            self.box_info['subsegment_count'] = fp.u32()
             self.box_info['subsegment_list'] = []
             for i in range(self.box_info['subsegment_count']):
-                subsegment_dict = {'range_count': read_u32(fp)}
+                subsegment_dict = {'range_count': fp.u32()}
                 range_list = []
                 for j in range(self.box_info['range_count']):
-                    l_r = read_u32(fp)
+                    l_r = fp.u32()
                     range_list.append({'level': l_r // 16777216, 'range_size': l_r % 16777216})
                 subsegment_dict['range_list'] = range_list
                 self.box_info['subsegment_list'].append(subsegment_dict)
@@ -1213,11 +1552,11 @@ class PrftBox(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['reference_track_id'] = read_u32(fp)
-            self.box_info['ntp_timestamp'] = read_u64(fp)
+            self.box_info['reference_track_id'] = fp.u32()
+            self.box_info['ntp_timestamp'] = fp.u64()
             if self.box_info['version'] == 0:
-                self.box_info['media_time'] = read_u32(fp)
+                self.box_info['media_time'] = fp.u32()
             else:
-                self.box_info['media_time'] = read_u64(fp)
+                self.box_info['media_time'] = fp.u64()
         finally:
             fp.seek(self.start_of_box + self.size)
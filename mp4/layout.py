@@ -0,0 +1,94 @@
+"""
+layout.py
+
+How quickly a progressive download can start playing depends on where the 'moov' is and on how the chunks of the
+different tracks are interleaved in the 'mdat'. analyze_layout() sweeps through the chunks of every track in file
+order (a merge of the per-track chunk tables, which are each already sorted by offset) and reports:
+
+- whether 'moov' precedes the first 'mdat',
+- the largest distance, in bytes, between successive chunks of the same track, i.e. how much of the other
+  tracks a sequential reader must get through before the next chunk of this one,
+- the largest difference, in seconds, between the media times reached by the audio and video tracks at any point
+  of the file,
+- an estimate of the bytes a progressive download client needs before it can show the first frame.
+
+"""
+import bisect
+import heapq
+import itertools
+import operator
+
+
+def get_chunks(track):
+    """
+    Generator yielding (offset, end_offset, start_time, end_time) for each chunk of a track, times in seconds.
+    """
+    first_samples = track.chunk_first_samples
+    sizes = track.sizes
+    dts = track.dts
+    durations = track.durations
+    timescale = track.timescale
+    last_samples = itertools.chain(itertools.islice(first_samples, 1, None), [len(sizes)])
+    for offset, first, last in zip(track.chunk_offsets, first_samples, last_samples):
+        if first >= last:
+            continue
+        yield (offset, offset + sum(sizes[first:last]), dts[first] / timescale,
+               (dts[last - 1] + durations[last - 1]) / timescale)
+
+
+def analyze_layout(mp4file, preroll=0.0):
+    """
+    Returns a dict describing the layout of the file (see module docstring). preroll is the number of seconds of
+    media of each track that must be downloaded before playback starts; with the default of 0 just the first sample
+    of each track is needed.
+    """
+    top_level = {}
+    for box in mp4file.child_boxes:
+        top_level.setdefault(box.type, box)
+    moov = top_level.get('moov')
+    mdat = top_level.get('mdat')
+    layout = {
+        'moov_offset': moov.start_of_box if moov else None,
+        'moov_size': moov.size if moov else None,
+        'first_mdat_offset': mdat.start_of_box if mdat else None,
+        'moov_before_mdat': bool(moov and (mdat is None or moov.start_of_box < mdat.start_of_box)),
+        'fragmented': 'moof' in top_level
+    }
+    tracks = [track for track in mp4file.get_tracks() if track.sample_count > 0]
+    track_stats = [{'track_id': track.track_id, 'handler_type': track.handler_type, 'chunk_count': 0,
+                    'max_gap_bytes': 0} for track in tracks]
+
+    # sweep through the chunks of all the tracks in file order
+    last_end = [None] * len(tracks)
+    media_time = [0.0] * len(tracks)
+    av_tracks = [i for i, track in enumerate(tracks) if track.handler_type in ('vide', 'soun')]
+    max_interleave_seconds = 0.0
+    max_interleave_offset = None
+    per_track = [zip(get_chunks(track), itertools.repeat(i)) for i, track in enumerate(tracks)]
+    for (offset, end_offset, start_time, end_time), i in heapq.merge(*per_track, key=operator.itemgetter(0)):
+        stats = track_stats[i]
+        stats['chunk_count'] += 1
+        if last_end[i] is not None and offset - last_end[i] > stats['max_gap_bytes']:
+            stats['max_gap_bytes'] = offset - last_end[i]
+        last_end[i] = end_offset
+        media_time[i] = end_time
+        if len(av_tracks) > 1:
+            reached = [media_time[j] for j in av_tracks]
+            if max(reached) - min(reached) > max_interleave_seconds:
+                max_interleave_seconds = max(reached) - min(reached)
+                max_interleave_offset = offset
+    layout['tracks'] = track_stats
+    av_stats = [track_stats[i] for i in av_tracks]
+    layout['max_interleave_bytes'] = max([stats['max_gap_bytes'] for stats in av_stats], default=0)
+    layout['max_interleave_seconds'] = max_interleave_seconds
+    layout['max_interleave_offset'] = max_interleave_offset
+
+    # a progressive client needs the moov and, for each track, the samples of the first preroll seconds
+    needed = moov.start_of_box + moov.size if moov else 0
+    for track in tracks:
+        dts = track.dts
+        last = max(1, bisect.bisect_left(dts, dts[0] + preroll * track.timescale))
+        ends = map(operator.add, track.offsets[:last], track.sizes[:last])
+        needed = max(needed, max(ends))
+    layout['bytes_before_first_frame'] = needed
+    return layout
@@ -0,0 +1,146 @@
+"""
+manifest.py
+
+A per-sample checksum manifest: the CRC-32 of every sample of every track, so that damaged samples can be found by
+comparing the manifests of two copies of a file, and duplicated or blanked frames found within one.
+The chunks of all the tracks are read front to back with track.read_ranges(), which coalesces adjacent chunks into
+large reads, and zlib.crc32() is mapped over memoryviews of the samples of each chunk, so that the Python work is
+per chunk rather than per sample and the speed is close to that of reading the file. A sample is reported as all
+zero bytes if its CRC is that of a run of zeros of the same length; an empty sample is not.
+
+The manifest is a binary file: a header of the magic number MANIFEST_MAGIC and the record count (little-endian u64),
+then one record per sample in file order, each holding track_ID, sample index, file offset, size and CRC-32 as
+little-endian u32, u32, u64, u32, u32.
+
+"""
+import functools
+import heapq
+import itertools
+import operator
+import struct
+import zlib
+from array import array
+from mp4.track import read_ranges, DEFAULT_MAX_READ
+
+MANIFEST_MAGIC = b'MP4CRC01'
+MANIFEST_HEADER = struct.Struct('<8sQ')
+MANIFEST_RECORD = struct.Struct('<IIQII')
+
+# records are read back in batches of this many
+READ_BATCH = 4096
+
+# the number of record structs (one per number of samples in a chunk) and of CRCs of runs of zeros (one per sample
+# size) kept for reuse
+RECORDS_STRUCT_CACHE_SIZE = 256
+ZERO_CRC_CACHE_SIZE = 65536
+
+
+def write_manifest(mp4file, out_filename, max_read=DEFAULT_MAX_READ):
+    """
+    Writes the manifest of mp4file to out_filename. Returns a dict with the number of samples and a list of the
+    runs of consecutive samples of a track that are all zero bytes ('zero') or identical to each other
+    ('identical'), each given as a dict with track_id, first_sample, sample_count and kind.
+    """
+    tracks = [track for track in mp4file.get_tracks() if track.sample_count]
+    crcs = [array('I') for track in tracks]
+    # whole chunks, whose samples are contiguous, are read in file order and the samples cut out of them
+    per_track = [zip(track.chunk_offsets, _get_chunk_sizes(track), _get_chunk_samples(track), itertools.repeat(i))
+                 for i, track in enumerate(tracks)]
+    ranges = ((offset, size, (i, first, last)) for offset, size, (first, last), i in
+              heapq.merge(*per_track, key=operator.itemgetter(0)) if first < last)
+    track_ids = [track.track_id for track in tracks]
+    track_sizes = [track.sizes for track in tracks]
+    track_offsets = [track.offsets for track in tracks]
+    with open(out_filename, 'wb') as f:
+        f.write(MANIFEST_HEADER.pack(MANIFEST_MAGIC, sum(track.sample_count for track in tracks)))
+        for (i, first, last), view in read_ranges(mp4file.source, ranges, max_read):
+            sizes = track_sizes[i][first:last]
+            ends = list(itertools.accumulate(sizes))
+            chunk_crcs = array('I', map(zlib.crc32, map(view.__getitem__, map(slice, [0] + ends[:-1], ends))))
+            crcs[i].extend(chunk_crcs)
+            records = zip(itertools.repeat(track_ids[i]), range(first, last), track_offsets[i][first:last], sizes,
+                          chunk_crcs)
+            f.write(_get_records_struct(last - first).pack(*itertools.chain.from_iterable(records)))
+
+    runs = []
+    for track, track_crcs in zip(tracks, crcs):
+        sizes = track.sizes
+        # a sample is taken to be all zeros if its CRC is that of the same number of zero bytes, unless it is empty
+        zero = bytearray(map(operator.and_, map(bool, sizes), map(operator.eq, track_crcs, map(_get_zero_crc, sizes))))
+        for first, last in _get_flag_runs(zero):
+            runs.append(_make_run(track.track_id, first, last, 'zero'))
+        # same[i] is 1 if sample i + 1 is identical to sample i
+        same = bytearray(map(operator.and_, map(operator.eq, sizes[1:], sizes[:-1]),
+                             map(operator.eq, track_crcs[1:], track_crcs[:-1])))
+        for first, last in _get_flag_runs(same):
+            if not zero[first]:
+                runs.append(_make_run(track.track_id, first, last + 1, 'identical'))
+    runs.sort(key=operator.itemgetter('track_id', 'first_sample'))
+    return {'sample_count': sum(track.sample_count for track in tracks), 'runs': runs}
+
+
+def _get_chunk_samples(track):
+    """ Generator yielding (first, last) sample indices of each chunk of track """
+    first_samples = track.chunk_first_samples
+    return zip(first_samples, itertools.chain(itertools.islice(first_samples, 1, None), [track.sample_count]))
+
+
+def _get_chunk_sizes(track):
+    sizes = track.sizes
+    return (sum(sizes[first:last]) for first, last in _get_chunk_samples(track))
+
+
+@functools.lru_cache(maxsize=RECORDS_STRUCT_CACHE_SIZE)
+def _get_records_struct(count):
+    return struct.Struct('<' + 'IIQII' * count)
+
+
+@functools.lru_cache(maxsize=ZERO_CRC_CACHE_SIZE)
+def _get_zero_crc(size):
+    return zlib.crc32(bytes(size))
+
+
+def _get_flag_runs(flags):
+    """ Generator yielding (first, last) for each run of 1s in the bytearray flags, last being exclusive """
+    first = flags.find(1)
+    while first != -1:
+        last = flags.find(0, first)
+        if last == -1:
+            last = len(flags)
+        yield first, last
+        first = flags.find(1, last)
+
+
+def _make_run(track_id, first, last, kind):
+    return {'track_id': track_id, 'first_sample': first, 'sample_count': last - first, 'kind': kind}
+
+
+def read_manifest(filename):
+    """ Generator yielding the (track_id, sample_index, offset, size, crc) records of a manifest file """
+    with open(filename, 'rb') as f:
+        magic, record_count = MANIFEST_HEADER.unpack(f.read(MANIFEST_HEADER.size))
+        if magic != MANIFEST_MAGIC:
+            raise ValueError('{} is not a sample checksum manifest'.format(filename))
+        while record_count:
+            batch = min(record_count, READ_BATCH)
+            data = f.read(batch * MANIFEST_RECORD.size)
+            if len(data) != batch * MANIFEST_RECORD.size:
+                raise EOFError('{} is truncated'.format(filename))
+            yield from MANIFEST_RECORD.iter_unpack(data)
+            record_count -= batch
+
+
+def compare_manifests(filename_a, filename_b):
+    """
+    Returns a list of the samples whose size or CRC differs between two manifests, or which are in only one of them,
+    as dicts with track_id, sample, and the [size, crc] pairs of each side (None if the sample is missing).
+    """
+    samples_a = {(track_id, index): (size, crc) for track_id, index, offset, size, crc in read_manifest(filename_a)}
+    mismatches = []
+    for track_id, index, offset, size, crc in read_manifest(filename_b):
+        entry_a = samples_a.pop((track_id, index), None)
+        if entry_a != (size, crc):
+            mismatches.append({'track_id': track_id, 'sample': index, 'a': entry_a, 'b': [size, crc]})
+    mismatches.extend({'track_id': track_id, 'sample': index, 'a': entry_a, 'b': None}
+                      for (track_id, index), entry_a in samples_a.items())
+    return sorted(mismatches, key=lambda mismatch: (mismatch['track_id'], mismatch['sample']))
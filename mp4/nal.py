@@ -0,0 +1,120 @@
+"""
+nal.py
+
+In 'avc1'/'avc3' and 'hvc1'/'hev1' tracks each sample is a sequence of NAL units, each one preceded by its length.
+The size of that length field comes from the 'avcC' or 'hvcC' box (lengthSizeMinusOne + 1).
+The functions here split samples into NAL units (as memoryviews, so nothing is copied), classify them, and
+gather per-GOP statistics for a whole track.
+
+"""
+import struct
+from mp4.core import find_box
+
+# NAL unit categories reported by nal_category() and gop_statistics()
+IDR = 'IDR'
+IRAP = 'IRAP'  # HEVC CRA/BLA pictures: random access points that are not IDRs
+NON_IDR = 'non-IDR'
+SEI = 'SEI'
+SPS = 'SPS'
+PPS = 'PPS'
+VPS = 'VPS'
+AUD = 'AUD'
+OTHER = 'other'
+
+_AVC_TYPES = {1: NON_IDR, 2: NON_IDR, 3: NON_IDR, 4: NON_IDR, 5: IDR, 6: SEI, 7: SPS, 8: PPS, 9: AUD}
+_HEVC_TYPES = {19: IDR, 20: IDR, 16: IRAP, 17: IRAP, 18: IRAP, 21: IRAP,
+               32: VPS, 33: SPS, 34: PPS, 35: AUD, 39: SEI, 40: SEI}
+_HEVC_TYPES.update({t: NON_IDR for t in range(10)})
+
+# Lookup tables indexed by the first byte of a NAL unit, so classification is a single subscript
+_AVC_CATEGORY = tuple(_AVC_TYPES.get(b & 0x1f, OTHER) for b in range(256))
+_HEVC_CATEGORY = tuple(_HEVC_TYPES.get(b >> 1 & 0x3f, OTHER) for b in range(256))
+
+_LENGTH_STRUCTS = {1: struct.Struct('>B'), 2: struct.Struct('>H'), 4: struct.Struct('>I')}
+
+
+def get_codec(track):
+    """ Returns ('avc', length_size) or ('hevc', length_size) for a video track, or None if it is neither """
+    avcc = find_box(track.trak, 'avcC')
+    if avcc is not None:
+        return 'avc', avcc.box_info['lengthSizeMinusOne'] + 1
+    hvcc = find_box(track.trak, 'hvcC')
+    if hvcc is not None:
+        return 'hevc', hvcc.box_info['length_size_minus1'] + 1
+    return None
+
+
+def nal_type(nal, codec):
+    """ nal_unit_type from the NAL unit header """
+    if codec == 'avc':
+        return nal[0] & 0x1f
+    return nal[0] >> 1 & 0x3f
+
+
+def nal_category(nal, codec):
+    """ One of the category constants above, e.g. IDR or SPS """
+    return (_AVC_CATEGORY if codec == 'avc' else _HEVC_CATEGORY)[nal[0]]
+
+
+def iter_nal_units(sample, length_size):
+    """ Generator yielding a memoryview of each NAL unit in a length-prefixed sample """
+    sample = memoryview(sample)
+    unpack_from = _LENGTH_STRUCTS[length_size].unpack_from
+    pos = 0
+    end = len(sample)
+    while pos + length_size <= end:
+        nal_length = unpack_from(sample, pos)[0]
+        pos += length_size
+        if pos + nal_length > end:
+            raise ValueError('NAL unit of length {} overruns the sample at byte {}'.format(nal_length, pos))
+        yield sample[pos:pos + nal_length]
+        pos += nal_length
+
+
+def count_nal_units(sample, codec, length_size, counts):
+    """
+    Adds the number of NAL units of each category in sample to the dict counts and returns the number of NAL units.
+    This is the inner loop of gop_statistics(), so it avoids creating a view per NAL unit.
+    """
+    unpack_from = _LENGTH_STRUCTS[length_size].unpack_from
+    categories = _AVC_CATEGORY if codec == 'avc' else _HEVC_CATEGORY
+    pos = 0
+    end = len(sample) - length_size
+    n = 0
+    while pos < end:
+        nal_length = unpack_from(sample, pos)[0]
+        pos += length_size
+        if nal_length:
+            category = categories[sample[pos]]
+            counts[category] = counts.get(category, 0) + 1
+            n += 1
+        pos += nal_length
+    if pos > len(sample):
+        raise ValueError('last NAL unit overruns the sample by {} bytes'.format(pos - len(sample)))
+    return n
+
+
+def gop_statistics(track):
+    """
+    Walks every sample of a video track and returns a list with one dict per GOP, a GOP starting at each sample that
+    contains an IDR (or, for HEVC, another IRAP) picture. Samples before the first random access point form a GOP of
+    their own with 'start_type' None.
+    """
+    codec_info = get_codec(track)
+    if codec_info is None:
+        raise ValueError('track {} is not an AVC or HEVC track'.format(track.track_id))
+    codec, length_size = codec_info
+    gops = []
+    gop = None
+    for index, sample in enumerate(track.iter_samples()):
+        counts = {}
+        count_nal_units(sample, codec, length_size, counts)
+        start_type = IDR if IDR in counts else IRAP if IRAP in counts else None
+        if gop is None or start_type is not None:
+            gop = {'start_sample': index, 'start_type': start_type, 'sample_count': 0, 'bytes': 0, 'nal_counts': {}}
+            gops.append(gop)
+        gop['sample_count'] += 1
+        gop['bytes'] += len(sample)
+        for category, count in counts.items():
+            gop['nal_counts'][category] = gop['nal_counts'].get(category, 0) + count
+    return gops
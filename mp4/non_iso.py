@@ -7,6 +7,10 @@ https://developer.apple.com/library/archive/documentation/QuickTime/QTFF/QTFFCha
 
 """
 import binascii
+import collections.abc
+import itertools
+import struct
+from array import array
 
 import mp4.iso
 from mp4.util import *
@@ -43,23 +47,23 @@ class Avc1Box(Mp4FullBox):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['num_of_entries'] = read_u32(fp)
+            self.box_info['num_of_entries'] = fp.u32()
             fp.seek(16, 1)
-            self.box_info['width'] = read_u16(fp)
-            self.box_info['height'] = read_u16(fp)
-            self.box_info['horizresolution'] = "{0:#010x}".format(read_u32(fp))
-            self.box_info['vertresolution'] = "{0:#010x}".format(read_u32(fp))
+            self.box_info['width'] = fp.u16()
+            self.box_info['height'] = fp.u16()
+            self.box_info['horizresolution'] = "{0:#010x}".format(fp.u32())
+            self.box_info['vertresolution'] = "{0:#010x}".format(fp.u32())
             fp.seek(4, 1)
-            self.box_info['frame_count'] = read_u16(fp)
-            self.box_info['compressorname'] = "{0:#010x}".format(read_u32(fp))
+            self.box_info['frame_count'] = fp.u16()
+            self.box_info['compressorname'] = "{0:#010x}".format(fp.u32())
             # a 16-bit int value of -1 seems to be used as a marker in front of any child boxes
             bytes_left = self.start_of_box + self.size - fp.tell()
-            while bytes_left > 0 and read_i16(fp) != -1:
+            while bytes_left > 0 and fp.i16() != -1:
                 bytes_left -= 2
             bytes_left -= 2    # need this because there is no do ...until in Python
             fp.seek(-4, 1)
-            self.box_info['depth'] = "{0:#06x}".format(read_u16(fp))
-            self.box_info['pre-defined'] = read_i16(fp)
+            self.box_info['depth'] = "{0:#06x}".format(fp.u16())
+            self.box_info['pre-defined'] = fp.i16()
             # need to check this is correct
             while bytes_left > 7:
                 current_header = Header(fp)
@@ -70,7 +74,8 @@ class Avc1Box(Mp4FullBox):
             fp.seek(self.start_of_box + self.size)
 
 
-Hvc1Box = Avc1Box
+# 'encv' is the sample entry of an encrypted video track, its sinf box saying what the original format was
+Hvc1Box = Avc3Box = Hev1Box = EncvBox = Avc1Box
 
 
 class AvcCBox(Mp4Box):
@@ -78,24 +83,24 @@ class AvcCBox(Mp4Box):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['configuration_version'] = read_u8(fp)
-            self.box_info['avc_profile_indication'] = read_u8(fp)
-            self.box_info['avc_compatibility'] = read_u8(fp)
-            self.box_info['avc_level_indication'] = read_u8(fp)
-            self.box_info['lengthSizeMinusOne'] = read_u8(fp) % 4
-            self.box_info['numOfSequenceParameterSets'] = read_u8(fp) % 32
+            self.box_info['configuration_version'] = fp.u8()
+            self.box_info['avc_profile_indication'] = fp.u8()
+            self.box_info['avc_compatibility'] = fp.u8()
+            self.box_info['avc_level_indication'] = fp.u8()
+            self.box_info['lengthSizeMinusOne'] = fp.u8() % 4
+            self.box_info['numOfSequenceParameterSets'] = fp.u8() % 32
             self.box_info['SequenceParameterSets_list'] = []
             for i in range(self.box_info['numOfSequenceParameterSets']):
-                spsl = read_u16(fp)
+                spsl = fp.u16()
                 sequence_param = {
                                     'sequenceParameterSetLength': spsl,
                                     'sequenceParameterSetNALUnit': binascii.b2a_hex(fp.read(spsl)).decode('utf-8')
                                  }
                 self.box_info['SequenceParameterSets_list'].append(sequence_param)
-            self.box_info['numOfPictureParameterSets'] = read_u8(fp)
+            self.box_info['numOfPictureParameterSets'] = fp.u8()
             self.box_info['PictureParameterSets_list'] = []
             for i in range(self.box_info['numOfPictureParameterSets']):
-                ppsl = read_u16(fp)
+                ppsl = fp.u16()
                 picture_param = {
                                     'pictureParameterSetLength': ppsl,
                                     'pictureParameterSetNALUnit': binascii.b2a_hex(fp.read(ppsl)).decode('utf-8')
@@ -104,13 +109,13 @@ class AvcCBox(Mp4Box):
             if (self.box_info['avc_profile_indication'] == 100 or self.box_info['avc_profile_indication'] == 110 or
                 self.box_info['avc_profile_indication'] == 122 or self.box_info['avc_profile_indication'] == 144) \
                     and (self.start_of_box + self.size - fp.tell()) > 7:
-                self.box_info['chroma_format'] = read_u8(fp) % 4
-                self.box_info['bit_depth_luma_minus8'] = read_u8(fp) % 8
-                self.box_info['bit_depth_chroma_minus8'] = read_u8(fp) % 8
-                self.box_info['numOfSequenceParameterSetExtLength'] = read_u8(fp)
+                self.box_info['chroma_format'] = fp.u8() % 4
+                self.box_info['bit_depth_luma_minus8'] = fp.u8() % 8
+                self.box_info['bit_depth_chroma_minus8'] = fp.u8() % 8
+                self.box_info['numOfSequenceParameterSetExtLength'] = fp.u8()
                 self.box_info['SequenceParameterSetExt_list'] = []
                 for i in range(self.box_info['numOfSequenceParameterSetExtLength']):
-                    spse = read_u16(fp)
+                    spse = fp.u16()
                     sequence_param = {
                         'sequenceParameterSetExtLength': spse,
                         'sequenceParameterSetExtNALUnit': binascii.b2a_hex(fp.read(spse)).decode('utf-8')
@@ -125,34 +130,34 @@ class HvcCBox(Mp4Box):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['configuration_version'] = read_u8(fp)
-            profile_info = read_u8(fp)
+            self.box_info['configuration_version'] = fp.u8()
+            profile_info = fp.u8()
             self.box_info['general_profile_space'] = profile_info >> 6
             self.box_info['general_tier_flag'] = profile_info >> 5 & 1
             self.box_info['general_profile_idc'] = profile_info & 31
-            self.box_info['general_profile_compatibility_flags'] = "{0:#010x}".format(read_u32(fp))
+            self.box_info['general_profile_compatibility_flags'] = "{0:#010x}".format(fp.u32())
             self.box_info['general_constraint_indicator_flags'] = "0x" + binascii.b2a_hex(fp.read(6)).decode('utf-8')
-            self.box_info['general_level_idc'] = read_u8(fp)
-            self.box_info['min_spatial_segmentation_idc'] = read_u16(fp) % 4096
-            self.box_info['parallelismType'] = read_u8(fp) % 4
-            self.box_info['chroma_format_idc'] = read_u8(fp) % 4
-            self.box_info['bit_depth_luma_minus8'] = read_u8(fp) % 8
-            self.box_info['bit_depth_chroma_minus8'] = read_u8(fp) % 8
-            self.box_info['avg_frame_rate'] = read_u16(fp)
-            fr = read_u8(fp)
+            self.box_info['general_level_idc'] = fp.u8()
+            self.box_info['min_spatial_segmentation_idc'] = fp.u16() % 4096
+            self.box_info['parallelismType'] = fp.u8() % 4
+            self.box_info['chroma_format_idc'] = fp.u8() % 4
+            self.box_info['bit_depth_luma_minus8'] = fp.u8() % 8
+            self.box_info['bit_depth_chroma_minus8'] = fp.u8() % 8
+            self.box_info['avg_frame_rate'] = fp.u16()
+            fr = fp.u8()
             self.box_info['constant_frame_rate'] = fr >> 6
             self.box_info['num_temporal_layers'] = fr >> 3 & 7
             self.box_info['temporal_id_nested'] = fr >> 2 & 1
             self.box_info['length_size_minus1'] = fr & 3
-            self.box_info['num_of_arrays'] = read_u8(fp)
+            self.box_info['num_of_arrays'] = fp.u8()
             self.box_info['array_list'] = []
             for i in range(self.box_info['num_of_arrays']):
-                nt = read_u8(fp)
+                nt = fp.u8()
                 nal_dict = {'array_completeness': nt >> 7, 'NAL_unit_type': nt % 64}
-                nal_dict['num_nalus'] = read_u16(fp)
+                nal_dict['num_nalus'] = fp.u16()
                 nal_dict['nalu_list'] = []
                 for j in range(nal_dict['num_nalus']):
-                    nul = read_u16(fp)
+                    nul = fp.u16()
                     nal_dict['nalu_list'].append({
                                                     'nal_unit_length': nul,
                                                     'nal_unit': binascii.b2a_hex(fp.read(nul)).decode('utf-8')
@@ -162,14 +167,19 @@ class HvcCBox(Mp4Box):
             fp.seek(self.start_of_box + self.size)
 
 
+# box_factory_non_iso() looks classes up by type.capitalize(), i.e. 'Avcc' and 'Hvcc'
+AvccBox = AvcCBox
+HvccBox = HvcCBox
+
+
 class BtrtBox(Mp4Box):
 
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['bufferSizeDB'] = read_u32(fp)
-            self.box_info['maxBitrate'] = read_u32(fp)
-            self.box_info['avgBitrate'] = read_u32(fp)
+            self.box_info['bufferSizeDB'] = fp.u32()
+            self.box_info['maxBitrate'] = fp.u32()
+            self.box_info['avgBitrate'] = fp.u32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -179,8 +189,8 @@ class PaspBox(Mp4Box):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['hSpacing'] = read_u32(fp)
-            self.box_info['vSpacing'] = read_u32(fp)
+            self.box_info['hSpacing'] = fp.u32()
+            self.box_info['vSpacing'] = fp.u32()
         finally:
             fp.seek(self.start_of_box + self.size)
 
@@ -191,15 +201,15 @@ class Mp4aBox(Mp4Box):
         super().__init__(fp, header, parent)
         try:
             fp.seek(6, 1)
-            self.box_info['reference_index'] = "{0:#06x}".format(read_u16(fp))
-            self.box_info['audio_encoding_version'] = "{0:#06x}".format(read_u16(fp))
-            self.box_info['audio_encoding_revision'] = "{0:#06x}".format(read_u16(fp))
-            self.box_info['audio_encoding_vendor'] = "{0:#010x}".format(read_u32(fp))
-            self.box_info['audio_channel_count'] = "{0:#06x}".format(read_u16(fp))
-            self.box_info['audio_sample_size'] = "{0:#06x}".format(read_u16(fp))
-            self.box_info['audio_compression_id'] = "{0:#06x}".format(read_u16(fp))
-            self.box_info['audio_packet_size'] = "{0:#06x}".format(read_u16(fp))
-            self.box_info['audio_sample_rate'] = read_u16_16(fp)
+            self.box_info['reference_index'] = "{0:#06x}".format(fp.u16())
+            self.box_info['audio_encoding_version'] = "{0:#06x}".format(fp.u16())
+            self.box_info['audio_encoding_revision'] = "{0:#06x}".format(fp.u16())
+            self.box_info['audio_encoding_vendor'] = "{0:#010x}".format(fp.u32())
+            self.box_info['audio_channel_count'] = "{0:#06x}".format(fp.u16())
+            self.box_info['audio_sample_size'] = "{0:#06x}".format(fp.u16())
+            self.box_info['audio_compression_id'] = "{0:#06x}".format(fp.u16())
+            self.box_info['audio_packet_size'] = "{0:#06x}".format(fp.u16())
+            self.box_info['audio_sample_rate'] = fp.u16_16()
             # need to check this is correct
             bytes_left = self.start_of_box + self.size - fp.tell()
             while bytes_left > 7:
@@ -211,7 +221,7 @@ class Mp4aBox(Mp4Box):
             fp.seek(self.start_of_box + self.size)
 
 
-Ac_3Box = Ec_3Box = Mp4aBox
+Ac_3Box = Ec_3Box = EncaBox = Mp4aBox
 
 
 class EsdsBox(Mp4FullBox):
@@ -246,25 +256,25 @@ class Dec3Box(Mp4Box):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            my_data_sub = read_u16(fp)
+            my_data_sub = fp.u16()
             self.box_info['data_rate'] = my_data_sub >> 3
             self.box_info['num_ind_sub'] = my_data_sub & 7
             self.box_info['ind_sub_list'] = []
             for i in range(self.box_info['num_ind_sub']):
-                in_s = read_u16(fp)
+                in_s = fp.u16()
                 fscod = in_s >> 14
                 bsid = in_s >> 9 & 31
                 asvc = in_s >> 7 & 1
                 bsmod = in_s >> 4 & 7
                 acmod = in_s >> 1 & 7
                 lfeon = in_s & 1
-                dep_s = read_u8(fp)
+                dep_s = fp.u8()
                 num_dep_sub = dep_s >> 1 & 15
                 bit_9 = dep_s & 1
                 sub_dict = {'fscod': fscod, 'bsid': bsid, 'asvc': asvc, 'bsmod': bsmod, 'acmod': acmod,
                             'lfeon': lfeon, 'num_dep_sub': num_dep_sub}
                 if num_dep_sub > 0:
-                    sub_dict['chan_loc'] = (bit_9 * 512) + read_u8(fp)
+                    sub_dict['chan_loc'] = (bit_9 * 512) + fp.u8()
                 self.box_info['ind_sub_list'].append(sub_dict)
         finally:
             fp.seek(self.start_of_box + self.size)
@@ -275,7 +285,7 @@ class IlstBox(Mp4Box):
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['offset'] = read_u32(fp)
+            self.box_info['offset'] = fp.u32()
             my_4bytes = fp.read(4)
             # WTF! a non-printing character in the box type.
             if (struct.unpack('>I', my_4bytes)[0]) >> 24 == 169:
@@ -311,7 +321,7 @@ class PsshBox(Mp4FullBox):
             self.box_info['system_id'] = binascii.b2a_hex(fp.read(16)).decode('utf-8')
             if self.box_info['system_id'] == '1077efecc0b24d02ace33c1e52e2fb4b':
                 # it is cenc
-                self.box_info['key_count'] = read_u32(fp)
+                self.box_info['key_count'] = fp.u32()
                 self.box_info['key_list'] = []
                 for i in range(self.box_info['key_count']):
                     self.box_info['key_list'].append(binascii.b2a_hex(fp.read(16)).decode('utf-8'))
@@ -319,37 +329,169 @@ class PsshBox(Mp4FullBox):
             fp.seek(self.start_of_box + self.size)
 
 
+class TencBox(Mp4FullBox):
+    """ Track encryption defaults, ISO/IEC 23001-7 """
+
+    def __init__(self, fp, header, parent):
+        super().__init__(fp, header, parent)
+        try:
+            fp.seek(1, 1)
+            if self.box_info['version'] == 0:
+                fp.seek(1, 1)
+            else:
+                pattern = fp.u8()
+                self.box_info['default_crypt_byte_block'] = pattern >> 4
+                self.box_info['default_skip_byte_block'] = pattern % 16
+            self.box_info['default_isProtected'] = fp.u8()
+            self.box_info['default_Per_Sample_IV_Size'] = fp.u8()
+            self.box_info['default_KID'] = binascii.b2a_hex(fp.read(16)).decode('utf-8')
+            if self.box_info['default_isProtected'] == 1 and self.box_info['default_Per_Sample_IV_Size'] == 0:
+                self.box_info['default_constant_IV_size'] = fp.u8()
+                self.box_info['default_constant_IV'] = binascii.b2a_hex(
+                    fp.read(self.box_info['default_constant_IV_size'])).decode('utf-8')
+        finally:
+            fp.seek(self.start_of_box + self.size)
+
+
+def get_iv_sizes(moov):
+    """ Returns a dict of track_ID: per-sample IV size, from the 'tenc' of each encrypted track in the moov """
+    iv_sizes = {}
+    for trak in find_boxes(moov, 'trak'):
+        tenc = find_box(trak, 'tenc')
+        if tenc is not None:
+            iv_sizes[find_box(trak, 'tkhd').box_info['track_ID']] = tenc.box_info['default_Per_Sample_IV_Size']
+    return iv_sizes
+
+
 class SencBox(Mp4FullBox):
+    """
+    Sample encryption information, ISO/IEC 23001-7. The box does not say how big the IVs are: that comes from the
+    'tenc' of the track, unless the box overrides it (flag 0x1). Failing both, the size given by the 'saiz' of the
+    same 'traf', then each of the usual sizes, is tried until one accounts for exactly the bytes of the box.
+    The box is read in one go and decoded into columns: ivs (the IVs end to end), and, if the samples have
+    subsamples (flag 0x2), subsample_counts, clear_bytes and encrypted_bytes. box_info['sample_list'] is a
+    SencSampleList, which only formats a sample as hex strings and dicts when it is looked at.
+    """
 
     def __init__(self, fp, header, parent):
         super().__init__(fp, header, parent)
         try:
-            self.box_info['sample_count'] = read_u32(fp)
-            iv_size_guess = ((self.size - 16) // self.box_info['sample_count'])
-            if int(self.box_info['flags'][-1], 16) & 2:
-                # I don't think this logic is infallible
-                if iv_size_guess < 10:
-                    iv_size = 0
-                elif 10 <= iv_size_guess < 18:
-                    iv_size = 8
-                else:
-                    iv_size = 16
-                self.box_info['iv_size'] = iv_size
-                self.box_info['sample_list'] = []
-                for i in range(self.box_info['sample_count']):
-                    sample_dict = {'iv': binascii.b2a_hex(fp.read(iv_size)).decode('utf-8'),
-                                   'subsample_count': read_u16(fp), 'subsample_list': []}
-                    for j in range(sample_dict['subsample_count']):
-                        sample_dict['subsample_list'].append({
-                                                            'BytesOfClearData': read_u16(fp),
-                                                            'BytesOfEncryptedData': read_u32(fp)
-                                                            })
-                    self.box_info['sample_list'].append(sample_dict)
+            flags = int(self.box_info['flags'], 16)
+            sample_count = self.box_info['sample_count'] = fp.u32()
+            override_iv_size = None
+            if flags & 1:
+                self.box_info['AlgorithmID'] = int.from_bytes(fp.read(3), 'big')
+                override_iv_size = fp.u8()
+                self.box_info['KID'] = binascii.b2a_hex(fp.read(16)).decode('utf-8')
+            self.has_subsamples = bool(flags & 2)
+            payload = fp.read(self.start_of_box + self.size - fp.tell())
+            for iv_size, source, exact in self._get_iv_size_candidates(override_iv_size):
+                columns = _decode_senc(payload, sample_count, iv_size, self.has_subsamples)
+                if columns is not None and (not exact or columns[-1] == len(payload)):
+                    break
             else:
-                iv_size = iv_size_guess
-                self.box_info['iv_size'] = iv_size
-                self.box_info['sample_list'] = []
-                for i in range(self.box_info['sample_count']):
-                    self.box_info['sample_list'].append({'iv': binascii.b2a_hex(fp.read(iv_size)).decode('utf-8')})
+                self.box_info['message'] = 'the samples do not fit the box with any IV size'
+                return
+            self.iv_size = iv_size
+            self.ivs, self.subsample_counts, self.clear_bytes, self.encrypted_bytes, bytes_used = columns
+            self.box_info['iv_size'] = iv_size
+            self.box_info['iv_size_source'] = source
+            self.box_info['sample_list'] = SencSampleList(self)
         finally:
             fp.seek(self.start_of_box + self.size)
+
+    def _get_iv_size_candidates(self, override_iv_size):
+        """ Generator yielding (iv_size, source, must_fit_exactly), most reliable first """
+        if override_iv_size is not None:
+            yield override_iv_size, 'senc', False
+        siblings = self.parent.child_boxes
+        tfhd = next((box for box in siblings if box.type == 'tfhd'), None)
+        if tfhd is not None:
+            root = self.parent
+            while root.type != 'file':
+                root = root.parent
+            # the Mp4File keeps the IV sizes of its moov once it is parsed, and the stand-in for it in a worker
+            # process is given them, so the moov is not searched for each fragment
+            iv_sizes = getattr(root, 'iv_sizes', None)
+            if iv_sizes is None:
+                moov = next((box for box in root.child_boxes if box.type == 'moov'), None)
+                iv_sizes = get_iv_sizes(moov) if moov is not None else {}
+            if tfhd.box_info['track_id'] in iv_sizes:
+                yield iv_sizes[tfhd.box_info['track_id']], 'tenc', False
+        saiz = next((box for box in siblings if box.type == 'saiz'), None)
+        if saiz is not None and not self.has_subsamples:
+            # without subsamples the auxiliary information of a sample is just its IV
+            if saiz.box_info['default_sample_info_size']:
+                yield saiz.box_info['default_sample_info_size'], 'saiz', True
+            elif saiz.sample_info_sizes:
+                yield saiz.sample_info_sizes[0], 'saiz', True
+        for iv_size in (8, 16, 0):
+            yield iv_size, 'box size', True
+
+
+def _decode_senc(payload, sample_count, iv_size, has_subsamples):
+    """
+    Decodes the samples of a 'senc' payload. Returns (ivs, subsample_counts, clear_bytes, encrypted_bytes,
+    bytes_used) or None if the samples would run past the end of the payload.
+    """
+    if not has_subsamples:
+        bytes_used = sample_count * iv_size
+        if bytes_used > len(payload):
+            return None
+        return payload[:bytes_used], array('H'), array('H'), array('I'), bytes_used
+    ivs = []
+    subsamples = []
+    subsample_counts = array('H')
+    position = 0
+    for i in range(sample_count):
+        end_of_iv = position + iv_size
+        if end_of_iv + 2 > len(payload):
+            return None
+        ivs.append(payload[position:end_of_iv])
+        subsample_count = int.from_bytes(payload[end_of_iv:end_of_iv + 2], 'big')
+        subsample_counts.append(subsample_count)
+        position = end_of_iv + 2 + 6 * subsample_count
+        subsamples.append(payload[end_of_iv + 2:position])
+    if position > len(payload):
+        return None
+    subsamples = b''.join(subsamples)
+    values = struct.unpack('>' + 'HI' * (len(subsamples) // 6), subsamples)
+    return b''.join(ivs), subsample_counts, array('H', values[0::2]), array('I', values[1::2]), position
+
+
+class SencSampleList(collections.abc.Sequence):
+    """
+    The samples of a 'senc' box, as the dicts the box would hold if it were decoded sample by sample:
+    {'iv': hex string, 'subsample_count': n, 'subsample_list': [{'BytesOfClearData': .., 'BytesOfEncryptedData': ..}]}.
+    Each dict is made when the sample is looked at.
+    """
+
+    def __init__(self, senc):
+        self.senc = senc
+        self.first_subsamples = array('Q', itertools.accumulate(senc.subsample_counts, initial=0))
+
+    def __len__(self):
+        return self.senc.box_info['sample_count']
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('senc sample index out of range')
+        senc = self.senc
+        sample = {'iv': senc.ivs[index * senc.iv_size:(index + 1) * senc.iv_size].hex()}
+        if senc.has_subsamples:
+            first, last = self.first_subsamples[index], self.first_subsamples[index + 1]
+            sample['subsample_count'] = last - first
+            sample['subsample_list'] = [{'BytesOfClearData': clear, 'BytesOfEncryptedData': encrypted}
+                                        for clear, encrypted in zip(senc.clear_bytes[first:last],
+                                                                    senc.encrypted_bytes[first:last])]
+        return sample
+
+    def __eq__(self, other):
+        if not isinstance(other, SencSampleList):
+            return NotImplemented
+        return all(getattr(self.senc, column) == getattr(other.senc, column)
+                   for column in ('ivs', 'subsample_counts', 'clear_bytes', 'encrypted_bytes'))
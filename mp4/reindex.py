@@ -0,0 +1,955 @@
+"""
+reindex.py
+
+Rebuilds the index of a recording whose 'moov' was never written, e.g. because the camera or encoder stopped before
+it could finish the file. What is left is an 'ftyp' and an 'mdat' running to the end of the file (often declared with
+a size of 0), holding the samples of every track with nothing to say where one ends and the next begins.
+The samples are found again by walking the media data with the help of a healthy reference file from the same
+encoder, whose 'moov' supplies the sample descriptions, timescales and sample durations:
+
+- video (AVC or HEVC) is a sequence of NAL units, each preceded by its length in lengthSizeMinusOne + 1 bytes (from
+  the 'avcC' or 'hvcC'). A NAL unit is accepted where its header, and for most types its first syntax elements, are
+  valid for the parameter sets seen so far; a NAL unit of any other type needs the next one to check out. The NAL
+  units are grouped into samples (access units) at the first slice of each picture and at the types that start an
+  access unit. Sync samples are the IDR (AVC) or IRAP (HEVC) pictures, and composition offsets follow from the
+  picture order counts.
+- the bytes between two runs of video are taken to be a chunk of the audio track. They are split into frames of the
+  constant sample size of the reference or, for variable sized frames such as AAC, at positions where a frame could
+  start (a first byte seen at the start of the reference samples) and the one before it end (an AAC ID_END element
+  and its padding, if all of the reference samples end that way). Of the possible splits, the one with frame sizes
+  closest to the typical size of the reference wins. A chunk that does not split exactly is not audio, which is
+  what rules out false starts of the next run of video.
+
+Bytes that fit neither are reported as skipped, as is a last sample cut short by the end of the file. Tracks other
+than the first video and audio tracks of the reference are left out. The media data is read front to back through a
+window of READ_BLOCK_SIZE bytes, so memory use does not grow with the size of the recording beyond the index itself.
+The rebuilt file is written by remux.write_progressive() with the 'moov' of the reference and the new sample tables.
+
+"""
+import bisect
+import itertools
+import math
+import os
+import statistics
+import struct
+from array import array
+from collections import Counter, namedtuple
+from mp4.core import find_box
+from mp4.iso import Mp4File
+from mp4.remux import write_progressive
+from mp4.track import Track
+
+# size of the reads from the damaged file
+READ_BLOCK_SIZE = 8 * 1024 * 1024
+
+# bytes of a NAL unit read to check the start of a slice header; smaller NAL units are read whole
+NAL_HEAD_SIZE = 32
+MAX_WHOLE_NAL_SIZE = 4096
+
+# a NAL unit may be this much larger than the largest sample of the reference, and at least MIN_MAX_NAL_SIZE
+NAL_SIZE_MARGIN = 4
+MIN_MAX_NAL_SIZE = 4 * 1024 * 1024
+
+# a gap between runs of video may be this much larger than the largest audio chunk of the reference
+AUDIO_CHUNK_MARGIN = 4
+MIN_MAX_AUDIO_CHUNK_SIZE = 256 * 1024
+
+# NAL units in a row that confirm the start of a run of video, where no audio chunk does
+RESYNC_NAL_COUNT = 3
+
+# samples of the reference audio track read to learn how its frames start and end
+REFERENCE_SAMPLE_COUNT = 1000
+# at most this many first bytes are taken as the start of an audio frame; they must cover this share of the samples
+MAX_FRAME_START_BYTES = 16
+MIN_FRAME_START_COVERAGE = 0.99
+
+# bytes at the start of an audio frame whose values in the reference samples count towards a split
+FRAME_HEAD_SIZE = 4
+
+# sample sizes accepted for variable sized audio frames, relative to the smallest and largest of the reference
+AUDIO_SIZE_RANGE = (0.5, 1.5)
+
+# frames that an audio-only scan holds back at the end of each block, in case the next block changes the split
+AUDIO_ONLY_MARGIN_FRAMES = 8
+
+# H.264 profiles whose SPS has chroma_format_idc and the fields after it
+AVC_HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+# a NAL unit as found by inspect(); nal_size includes the length field, picture holds what the picture order count
+# needs (for the first slice of a picture only) and parameter_set is (table, id, fields) for an SPS or PPS
+_Nal = namedtuple('_Nal', 'nal_size nal_type vcl first_slice starts_unit sync confirmed picture parameter_set')
+
+
+class _BitReader:
+    """ Reads the fields of an RBSP, msb first, raising ValueError beyond the end of the data """
+
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'big')
+        self.bits = len(data) * 8
+        self.position = 0
+
+    def u(self, n):
+        self.position += n
+        if self.position > self.bits:
+            raise ValueError('read beyond the end of the data')
+        return self.value >> (self.bits - self.position) & ((1 << n) - 1)
+
+    def ue(self):
+        zeros = 0
+        while not self.u(1):
+            zeros += 1
+            if zeros > 31:
+                raise ValueError('invalid Exp-Golomb code')
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        k = self.ue()
+        return (k + 1) // 2 if k & 1 else -(k // 2)
+
+
+def _get_rbsp(data):
+    """ Removes the emulation prevention bytes from the payload of a NAL unit """
+    return data.replace(b'\x00\x00\x03', b'\x00\x00')
+
+
+def _get_poc_msb(lsb, previous_msb, previous_lsb, max_lsb):
+    if lsb < previous_lsb and previous_lsb - lsb >= max_lsb // 2:
+        return previous_msb + max_lsb
+    if lsb > previous_lsb and lsb - previous_lsb > max_lsb // 2:
+        return previous_msb - max_lsb
+    return previous_msb
+
+
+def _is_trailing(data, nal_size, header_size):
+    """ True if the NAL unit, read whole, ends with the rbsp_trailing_bits of a byte-aligned payload """
+    return len(data) == nal_size > header_size and data[-1] == 0x80
+
+
+class _AvcSyntax:
+    """ The parts of H.264 (ISO/IEC 14496-10) needed to find and group the NAL units of a track """
+
+    header_size = 1
+    end_of_sequence_type = 10
+
+    def __init__(self, avcc):
+        self.length_size = avcc.box_info['lengthSizeMinusOne'] + 1
+        self.sps = {}
+        self.pps = {}
+        self._previous = (0, 0)
+        for entry in avcc.box_info['SequenceParameterSets_list']:
+            self.add_parameter_set(*self.parse_sps(bytes.fromhex(entry['sequenceParameterSetNALUnit'])))
+        for entry in avcc.box_info['PictureParameterSets_list']:
+            self.add_parameter_set(*self.parse_pps(bytes.fromhex(entry['pictureParameterSetNALUnit'])))
+
+    def add_parameter_set(self, table, parameter_set_id, fields):
+        getattr(self, table)[parameter_set_id] = fields
+
+    def inspect(self, data, nal_size):
+        """
+        Returns a Nal for the NAL unit starting with data (all of it if nal_size <= MAX_WHOLE_NAL_SIZE), or None
+        if it cannot be one
+        """
+        header = data[0]
+        nal_ref_idc = header >> 5 & 3
+        nal_type = header & 31
+        if header & 0x80 or not 1 <= nal_type <= 21:
+            return None
+        if (nal_type in (5, 7, 8)) != (nal_ref_idc != 0) and nal_type in (5, 6, 7, 8, 9, 10, 11, 12):
+            return None
+        size = self.length_size + nal_size
+        starts_unit = nal_type in (6, 7, 8, 9) or 13 <= nal_type <= 18
+        try:
+            if nal_type in (1, 2, 5):
+                first_mb, picture = self._parse_slice_header(data, nal_type, nal_ref_idc)
+                return _Nal(size, nal_type, True, first_mb == 0, False, nal_type == 5, True,
+                           picture if first_mb == 0 else None, None)
+            if nal_type in (7, 8) and len(data) == nal_size:
+                parameter_set = self.parse_sps(data) if nal_type == 7 else self.parse_pps(data)
+                return _Nal(size, nal_type, False, False, True, False, True, None, parameter_set)
+        except ValueError:
+            return None
+        if nal_type == 9:
+            confirmed = nal_size == 2 and data[1] & 0x1f == 0x10
+        elif nal_type in (10, 11):
+            confirmed = nal_size == 1
+        elif nal_type in (6, 12):
+            confirmed = _is_trailing(data, nal_size, 1)
+        else:
+            confirmed = False
+        if nal_type in (6, 9, 10, 11, 12) and not confirmed and len(data) == nal_size:
+            return None
+        return _Nal(size, nal_type, 1 <= nal_type <= 5, False, starts_unit, False, confirmed, None, None)
+
+    def parse_sps(self, data):
+        reader = _BitReader(_get_rbsp(data[1:]))
+        profile_idc = reader.u(8)
+        reader.u(16)
+        sps_id = reader.ue()
+        if sps_id > 31:
+            raise ValueError('invalid seq_parameter_set_id')
+        separate_colour_plane = 0
+        if profile_idc in AVC_HIGH_PROFILES:
+            chroma_format_idc = reader.ue()
+            if chroma_format_idc > 3:
+                raise ValueError('invalid chroma_format_idc')
+            if chroma_format_idc == 3:
+                separate_colour_plane = reader.u(1)
+            reader.ue()
+            reader.ue()
+            reader.u(1)
+            if reader.u(1):
+                for i in range(12 if chroma_format_idc == 3 else 8):
+                    if reader.u(1):
+                        last_scale = next_scale = 8
+                        for j in range(16 if i < 6 else 64):
+                            if next_scale:
+                                next_scale = (last_scale + reader.se()) % 256
+                            last_scale = next_scale or last_scale
+        log2_max_frame_num = reader.ue() + 4
+        poc_type = reader.ue()
+        log2_max_poc_lsb = None
+        if poc_type == 0:
+            log2_max_poc_lsb = reader.ue() + 4
+        elif poc_type == 1:
+            reader.u(1)
+            reader.se()
+            reader.se()
+            for i in range(reader.ue()):
+                reader.se()
+        if log2_max_frame_num > 16 or poc_type > 2 or (log2_max_poc_lsb or 0) > 16:
+            raise ValueError('invalid SPS')
+        reader.ue()
+        reader.u(1)
+        reader.ue()
+        reader.ue()
+        frame_mbs_only = reader.u(1)
+        return 'sps', sps_id, {'separate_colour_plane': separate_colour_plane, 'log2_max_frame_num': log2_max_frame_num,
+                               'log2_max_poc_lsb': log2_max_poc_lsb, 'frame_mbs_only': frame_mbs_only}
+
+    def parse_pps(self, data):
+        reader = _BitReader(_get_rbsp(data[1:]))
+        pps_id = reader.ue()
+        sps_id = reader.ue()
+        if pps_id > 255 or sps_id not in self.sps:
+            raise ValueError('invalid PPS')
+        reader.u(1)
+        return 'pps', pps_id, {'sps_id': sps_id, 'bottom_field_pic_order_in_frame_present': reader.u(1)}
+
+    def _parse_slice_header(self, data, nal_type, nal_ref_idc):
+        reader = _BitReader(_get_rbsp(data[1:NAL_HEAD_SIZE]))
+        first_mb = reader.ue()
+        slice_type = reader.ue()
+        pps = self.pps.get(reader.ue())
+        if slice_type > 9 or pps is None or nal_type == 5 and slice_type % 5 not in (2, 4):
+            raise ValueError('invalid slice header')
+        sps = self.sps[pps['sps_id']]
+        if sps['separate_colour_plane']:
+            reader.u(2)
+        reader.u(sps['log2_max_frame_num'])
+        field_pic = 0
+        if not sps['frame_mbs_only']:
+            field_pic = reader.u(1)
+            if field_pic:
+                reader.u(1)
+        if nal_type == 5:
+            reader.ue()
+        poc_lsb = None
+        if sps['log2_max_poc_lsb'] is not None and not field_pic:
+            poc_lsb = reader.u(sps['log2_max_poc_lsb'])
+        return first_mb, (nal_type == 5, nal_ref_idc != 0, poc_lsb, sps['log2_max_poc_lsb'])
+
+    def end_sequence(self):
+        pass
+
+    def get_picture_order_count(self, picture):
+        """
+        Returns (poc, restarts) for the first slice of a picture, poc being None if it is not known and restarts True
+        if the picture order count starts over at this picture. Only pic_order_cnt_type 0 is supported.
+        """
+        idr, reference, lsb, log2_max_lsb = picture
+        if idr:
+            self._previous = (0, 0)
+        if lsb is None:
+            return None, idr
+        msb = _get_poc_msb(lsb, *self._previous, 1 << log2_max_lsb)
+        if reference:
+            self._previous = (msb, lsb)
+        return msb + lsb, idr
+
+
+class _HevcSyntax:
+    """ The parts of H.265 (ISO/IEC 23008-2) needed to find and group the NAL units of a track """
+
+    header_size = 2
+    end_of_sequence_type = 36
+
+    def __init__(self, hvcc):
+        self.length_size = hvcc.box_info['length_size_minus1'] + 1
+        self.sps = {}
+        self.pps = {}
+        self._previous = (0, 0)
+        self._restart = True
+        parsers = {33: self.parse_sps, 34: self.parse_pps}
+        for array_entry in sorted(hvcc.box_info['array_list'], key=lambda entry: entry['NAL_unit_type']):
+            parser = parsers.get(array_entry['NAL_unit_type'])
+            for nalu in array_entry['nalu_list'] if parser else []:
+                self.add_parameter_set(*parser(bytes.fromhex(nalu['nal_unit'])))
+
+    def add_parameter_set(self, table, parameter_set_id, fields):
+        getattr(self, table)[parameter_set_id] = fields
+
+    def inspect(self, data, nal_size):
+        """ As _AvcSyntax.inspect() """
+        if len(data) < 2:
+            return None
+        nal_type = data[0] >> 1 & 63
+        layer_id = (data[0] & 1) << 5 | data[1] >> 3
+        temporal_id = (data[1] & 7) - 1
+        if data[0] & 0x80 or layer_id or temporal_id < 0:
+            return None
+        if 10 <= nal_type <= 15 or 22 <= nal_type <= 31 or 41 <= nal_type <= 47:
+            return None
+        if (16 <= nal_type <= 21 or 32 <= nal_type <= 34) and temporal_id:
+            return None
+        size = self.length_size + nal_size
+        starts_unit = 32 <= nal_type <= 35 or nal_type == 39 or 48 <= nal_type <= 55
+        try:
+            if nal_type < 32:
+                first_slice, picture = self._parse_slice_header(data, nal_type, temporal_id)
+                return _Nal(size, nal_type, True, first_slice, False, 16 <= nal_type <= 21, True, picture, None)
+            if nal_type in (33, 34) and len(data) == nal_size:
+                parameter_set = self.parse_sps(data) if nal_type == 33 else self.parse_pps(data)
+                return _Nal(size, nal_type, False, False, True, False, True, None, parameter_set)
+        except ValueError:
+            return None
+        if nal_type == 32:
+            # vps_reserved_0xffff_16bits
+            confirmed = len(data) >= 6 and data[4:6] == b'\xff\xff'
+        elif nal_type == 35:
+            confirmed = nal_size == 3 and data[2] & 0x1f == 0x10
+        elif nal_type in (36, 37):
+            confirmed = nal_size == 2
+        elif nal_type in (38, 39, 40):
+            confirmed = _is_trailing(data, nal_size, 2)
+        else:
+            confirmed = False
+        if 35 <= nal_type <= 40 and not confirmed and len(data) == nal_size:
+            return None
+        return _Nal(size, nal_type, False, False, starts_unit, False, confirmed, None, None)
+
+    def parse_sps(self, data):
+        reader = _BitReader(_get_rbsp(data[2:]))
+        reader.u(4)
+        max_sub_layers_minus1 = reader.u(3)
+        reader.u(1)
+        # profile_tier_level()
+        reader.u(96)
+        sub_layer_flags = [(reader.u(1), reader.u(1)) for i in range(max_sub_layers_minus1)]
+        if max_sub_layers_minus1:
+            reader.u(2 * (8 - max_sub_layers_minus1))
+        for profile_present, level_present in sub_layer_flags:
+            reader.u(88 * profile_present + 8 * level_present)
+        sps_id = reader.ue()
+        chroma_format_idc = reader.ue()
+        if sps_id > 15 or chroma_format_idc > 3:
+            raise ValueError('invalid SPS')
+        separate_colour_plane = reader.u(1) if chroma_format_idc == 3 else 0
+        reader.ue()
+        reader.ue()
+        if reader.u(1):
+            for i in range(4):
+                reader.ue()
+        reader.ue()
+        reader.ue()
+        log2_max_poc_lsb = reader.ue() + 4
+        if log2_max_poc_lsb > 16:
+            raise ValueError('invalid SPS')
+        return 'sps', sps_id, {'separate_colour_plane': separate_colour_plane, 'log2_max_poc_lsb': log2_max_poc_lsb}
+
+    def parse_pps(self, data):
+        reader = _BitReader(_get_rbsp(data[2:]))
+        pps_id = reader.ue()
+        sps_id = reader.ue()
+        if pps_id > 63 or sps_id not in self.sps:
+            raise ValueError('invalid PPS')
+        reader.u(1)
+        return 'pps', pps_id, {'sps_id': sps_id, 'output_flag_present': reader.u(1),
+                               'num_extra_slice_header_bits': reader.u(3)}
+
+    def _parse_slice_header(self, data, nal_type, temporal_id):
+        reader = _BitReader(_get_rbsp(data[2:NAL_HEAD_SIZE]))
+        first_slice = reader.u(1)
+        if 16 <= nal_type <= 23:
+            reader.u(1)
+        pps = self.pps.get(reader.ue())
+        if pps is None:
+            raise ValueError('invalid slice header')
+        if not first_slice:
+            return False, None
+        sps = self.sps[pps['sps_id']]
+        reader.u(pps['num_extra_slice_header_bits'])
+        slice_type = reader.ue()
+        if slice_type > 2 or 16 <= nal_type <= 23 and slice_type != 2:
+            raise ValueError('invalid slice header')
+        if pps['output_flag_present']:
+            reader.u(1)
+        if sps['separate_colour_plane']:
+            reader.u(2)
+        poc_lsb = 0 if nal_type in (19, 20) else reader.u(sps['log2_max_poc_lsb'])
+        return True, (nal_type, temporal_id, poc_lsb, sps['log2_max_poc_lsb'])
+
+    def end_sequence(self):
+        self._restart = True
+
+    def get_picture_order_count(self, picture):
+        """ As _AvcSyntax.get_picture_order_count() """
+        nal_type, temporal_id, lsb, log2_max_lsb = picture
+        # IDR and BLA pictures, and a CRA picture that starts a coded video sequence, set PicOrderCntMsb to 0
+        restarts = 16 <= nal_type <= 20 or nal_type == 21 and self._restart
+        self._restart = False
+        msb = 0 if restarts else _get_poc_msb(lsb, *self._previous, 1 << log2_max_lsb)
+        # the previous picture with TemporalId 0 that is not a RASL, RADL or sub-layer non-reference picture
+        if temporal_id == 0 and not (nal_type <= 14 and nal_type % 2 == 0) and nal_type not in (7, 9):
+            self._previous = (msb, lsb)
+        return msb + lsb, restarts
+
+
+class _Window:
+    """
+    Reads the damaged file through a buffer that moves forward with the scan, keeping up to history bytes before the
+    position of the latest read in case the scan looks back.
+    """
+
+    def __init__(self, f, end, history):
+        self.f = f
+        self.end = end
+        self.history = history
+        self.base = 0
+        self.data = b''
+
+    def get(self, position, size):
+        stop = min(position + size, self.end)
+        if position < self.base or stop > self.base + len(self.data):
+            self._fill(position, stop)
+        return self.data[position - self.base:stop - self.base]
+
+    def find(self, sub, start, end):
+        """ As bytes.find(), for a single byte sub, between absolute offsets start and end """
+        while start < end:
+            if not self.base <= start < self.base + len(self.data):
+                self._fill(start, start + 1)
+            stop = min(end, self.base + len(self.data))
+            position = self.data.find(sub, start - self.base, stop - self.base)
+            if position != -1:
+                return self.base + position
+            start = stop
+        return -1
+
+    def _fill(self, position, stop):
+        if self.base <= position <= self.base + len(self.data):
+            keep_from = max(self.base, position - self.history)
+        else:
+            keep_from = position
+        keep = self.data[keep_from - self.base:] if keep_from >= self.base else b''
+        read_end = min(self.end, max(stop, position + READ_BLOCK_SIZE))
+        self.f.seek(keep_from + len(keep))
+        self.data = keep + self.f.read(max(0, read_end - keep_from - len(keep)))
+        self.base = keep_from
+
+
+class _SampleList:
+    """ The samples of one track as they are found, a new chunk starting wherever a sample does not follow on """
+
+    def __init__(self):
+        self.sizes = array('Q')
+        self.offsets = array('Q')
+        self.sync = bytearray()
+        self.chunk_offsets = array('Q')
+        self.chunk_first_samples = array('Q')
+        self._chunk_end = None
+
+    def add(self, offset, size, sync):
+        if offset != self._chunk_end:
+            self.chunk_offsets.append(offset)
+            self.chunk_first_samples.append(len(self.sizes))
+        self.sizes.append(size)
+        self.offsets.append(offset)
+        self.sync.append(sync)
+        self._chunk_end = offset + size
+
+    def get_columns(self, duration, composition_offsets=None):
+        """ Returns the columns of a track.Track sample index, every sample lasting duration """
+        count = len(self.sizes)
+        return {
+            'sizes': self.sizes,
+            'offsets': self.offsets,
+            'durations': array('Q', [duration]) * count,
+            'dts': array('Q', range(0, count * duration, duration)) if duration else array('Q', [0]) * count,
+            'composition_offsets': composition_offsets or array('q', [0]) * count,
+            'sync': self.sync,
+            'dependencies': bytearray(count),
+            'chunk_offsets': self.chunk_offsets,
+            'chunk_first_samples': self.chunk_first_samples
+        }
+
+
+class _VideoScanner:
+    """ Finds the NAL units of the video track and groups them into samples """
+
+    def __init__(self, syntax, window, max_nal_size):
+        self.syntax = syntax
+        self.window = window
+        self.max_nal_size = max_nal_size
+        self.samples = _SampleList()
+        self.picture_order_counts = []
+        self.restarts = bytearray()
+        self.orphans = []
+        self._unit = None
+
+    def read_nal(self, position, end):
+        """
+        Returns the Nal of the NAL unit at position if it checks out: a confirmed one, or one whose header is
+        valid followed by a confirmed one or by end. Returns None otherwise.
+        """
+        nal = self._inspect(position, end)
+        if nal is None or nal.confirmed:
+            return nal
+        following = position + nal.nal_size
+        if following == end:
+            return nal
+        following_nal = self._inspect(following, end)
+        return nal if following_nal is not None and following_nal.confirmed else None
+
+    def _inspect(self, position, end):
+        length_size = self.syntax.length_size
+        if position + length_size + self.syntax.header_size > end:
+            return None
+        nal_size = int.from_bytes(self.window.get(position, length_size), 'big')
+        if nal_size < self.syntax.header_size or nal_size > self.max_nal_size or \
+                position + length_size + nal_size > end:
+            return None
+        read_size = nal_size if nal_size <= MAX_WHOLE_NAL_SIZE else NAL_HEAD_SIZE
+        return self.syntax.inspect(self.window.get(position + length_size, read_size), nal_size)
+
+    def get_search_byte(self):
+        """ The first byte of any length field, if it can only have one value, else None """
+        shift = 8 * (self.syntax.length_size - 1)
+        return bytes([self.max_nal_size >> shift]) if self.max_nal_size >> shift == 0 else None
+
+    def add(self, position, nal):
+        """ Adds a NAL unit returned by read_nal() """
+        if self._unit is not None and self._unit['vcl'] and (nal.first_slice or nal.starts_unit):
+            self.close_unit()
+        if self._unit is None:
+            self._unit = {'start': position, 'vcl': False, 'sync': False, 'poc': None, 'restarts': False}
+        unit = self._unit
+        if nal.parameter_set is not None:
+            self.syntax.add_parameter_set(*nal.parameter_set)
+        elif nal.nal_type == self.syntax.end_of_sequence_type:
+            self.syntax.end_sequence()
+        if nal.vcl and not unit['vcl']:
+            unit['vcl'] = True
+            unit['sync'] = nal.sync
+            if nal.picture is not None:
+                unit['poc'], unit['restarts'] = self.syntax.get_picture_order_count(nal.picture)
+        unit['end'] = position + nal.nal_size
+
+    def close_unit(self):
+        """ Ends the access unit in progress, at the end of a run of video """
+        unit = self._unit
+        self._unit = None
+        if unit is None:
+            return
+        if not unit['vcl']:
+            # NAL units with no picture to belong to
+            self.orphans.append((unit['start'], unit['end'] - unit['start']))
+            return
+        self.samples.add(unit['start'], unit['end'] - unit['start'], unit['sync'])
+        self.picture_order_counts.append(unit['poc'])
+        self.restarts.append(unit['restarts'])
+
+    def get_composition_offsets(self, duration):
+        """
+        Returns (composition_offsets, delay): the composition offsets of the samples, made non-negative by adding
+        delay, from the presentation order of the pictures between two restarts of the picture order count.
+        Returns (None, 0) unless the picture order count of every picture is known.
+        """
+        counts = self.picture_order_counts
+        if not counts or None in counts:
+            return None, 0
+        presentation = [0] * len(counts)
+        starts = [i for i in range(len(counts)) if self.restarts[i]]
+        for first, last in zip([0] + starts, starts + [len(counts)]):
+            for rank, i in enumerate(sorted(range(first, last), key=counts.__getitem__)):
+                presentation[i] = first + rank
+        delay = max(i - p for i, p in enumerate(presentation))
+        return array('q', ((p - i + delay) * duration for i, p in enumerate(presentation))), delay * duration
+
+
+class _AudioFramer:
+    """ Splits runs of bytes into the frames of the audio track, using what the reference samples have in common """
+
+    def __init__(self, track):
+        sizes = track.sizes
+        if not sizes:
+            raise ValueError('track {} has no samples to learn from'.format(track.track_id))
+        self.frame_size = sizes[0] if min(sizes) == max(sizes) else None
+        self.start_bytes = []
+        self.checks_end = False
+        if self.frame_size:
+            return
+        samples = [bytes(sample) for sample in itertools.islice(track.iter_samples(), REFERENCE_SAMPLE_COUNT)]
+        heads = Counter(sample[0] for sample in samples if sample)
+        start_bytes = [byte for byte, count in heads.most_common(MAX_FRAME_START_BYTES)]
+        if sum(heads[byte] for byte in start_bytes) < MIN_FRAME_START_COVERAGE * sum(heads.values()):
+            raise ValueError('the frames of track {} have no recognisable start'.format(track.track_id))
+        self.start_bytes = [bytes([byte]) for byte in start_bytes]
+        self.checks_end = all(_ends_aac_frame(sample, len(sample)) for sample in samples)
+        self.min_size = max(1, int(min(sizes) * AUDIO_SIZE_RANGE[0]))
+        self.max_size = int(max(sizes) * AUDIO_SIZE_RANGE[1])
+        # a split is scored by its likelihood: the sizes of its frames under a normal distribution fitted to the
+        # reference, the bytes that start each frame under the distributions of the reference (relative to all of
+        # the bytes of the reference), and every candidate it passes over being a false one, at the rate they
+        # occur in the reference
+        self.mean_size = statistics.fmean(sizes)
+        self.size_deviation = max(statistics.pstdev(sizes), 1.0)
+        false_candidates = sum(len(self.find_candidates(sample, 1)) for sample in samples)
+        false_rate = max(false_candidates, 1) / max(sum(map(len, samples)), 1)
+        self.frame_cost = math.log(self.size_deviation * math.sqrt(2 * math.pi) * false_rate)
+        background = Counter(itertools.chain.from_iterable(samples))
+        background_total = sum(background.values()) + 256
+        self.head_scores = []
+        for k in range(1, FRAME_HEAD_SIZE):
+            counts = Counter(sample[k] for sample in samples if len(sample) > k)
+            total = sum(counts.values()) + 128
+            self.head_scores.append([math.log((counts[byte] + 0.5) / total * background_total /
+                                              (background[byte] + 1)) for byte in range(256)])
+
+    def could_start_frame(self, data):
+        """ True if a frame could start with the bytes data """
+        return bool(self.frame_size) or data[:1] in self.start_bytes
+
+    def find_candidates(self, data, start):
+        """ Returns the positions from start on where a frame could start, in no particular order """
+        candidates = []
+        for start_byte in self.start_bytes:
+            position = data.find(start_byte, start)
+            while position != -1:
+                if not self.checks_end or _ends_aac_frame(data, position):
+                    candidates.append(position)
+                position = data.find(start_byte, position + 1)
+        return candidates
+
+    def split(self, data, complete=True):
+        """
+        Returns the sizes of the frames that data splits into, from its start to its end if complete, else as far
+        as it will go. Returns None if it does not split.
+        """
+        if self.frame_size:
+            count = len(data) // self.frame_size
+            if complete and count * self.frame_size != len(data):
+                return None
+            return [self.frame_size] * count
+        if not data or data[:1] not in self.start_bytes or \
+                complete and self.checks_end and not _ends_aac_frame(data, len(data)):
+            return None
+        positions = [0] + sorted(self.find_candidates(data, self.min_size))
+        if complete:
+            positions.append(len(data))
+        head_costs = [self.frame_cost - sum(scores[byte] for scores, byte in zip(self.head_scores, data[i + 1:]))
+                      for i in positions]
+        # the cheapest split up to each position
+        costs = [0.0] + [math.inf] * (len(positions) - 1)
+        previous = [None] * len(positions)
+        for j in range(1, len(positions)):
+            position = positions[j]
+            for i in range(bisect.bisect_left(positions, position - self.max_size, 0, j),
+                           bisect.bisect_right(positions, position - self.min_size, 0, j)):
+                cost = costs[i] + ((position - positions[i] - self.mean_size) / self.size_deviation) ** 2 / 2 + \
+                    head_costs[i]
+                if cost < costs[j]:
+                    costs[j] = cost
+                    previous[j] = i
+        if complete:
+            last = len(positions) - 1
+            if costs[last] == math.inf:
+                return None
+        else:
+            last = max(j for j in range(len(positions)) if costs[j] < math.inf)
+        sizes = []
+        while last:
+            sizes.append(positions[last] - positions[previous[last]])
+            last = previous[last]
+        sizes.reverse()
+        return sizes
+
+    def split_tail(self, data):
+        """
+        Returns the sizes of the whole frames at the start of data, which the end of the recording cut short. Unless
+        the frames have a constant size, the last frame found is left out, as it may end at a false start.
+        """
+        sizes = self.split(data, complete=False) or []
+        return sizes if self.frame_size else sizes[:-1]
+
+
+def _ends_aac_frame(data, position):
+    """ True if the bytes before position end with an ID_END element (0b111) followed by 0 to 7 zero bits """
+    if position < 2:
+        return False
+    value = data[position - 2] << 8 | data[position - 1]
+    trailing_zeros = (value & -value).bit_length() - 1
+    return value != 0 and trailing_zeros <= 7 and value >> trailing_zeros & 7 == 7
+
+
+class RebuiltFile:
+    """
+    Stands in for the Mp4File of a damaged recording in remux.write_progressive(): the boxes of the reference, with
+    the samples found in the damaged file. Tracks that were not rebuilt have no samples, so are left out.
+    """
+
+    def __init__(self, filename, reference, reference_tracks):
+        self.filename = filename
+        self.source = filename
+        self.type = 'file'
+        self.child_boxes = reference.child_boxes
+        self.tracks = [Track(self, track.trak) for track in reference_tracks]
+        self.edit_lists = {}
+        self.skipped_regions = []
+        self.media_data = None
+
+    def get_tracks(self):
+        return self.tracks
+
+
+def find_media_data(filename):
+    """
+    Returns (start, end) of the payload of the first 'mdat' of filename. An 'mdat' declared with a size of 0, or no
+    larger than its header, or running past the end of the file, is taken to end at the end of the file.
+    """
+    file_size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        position = 0
+        while position + 8 <= file_size:
+            f.seek(position)
+            header = f.read(16)
+            size, box_type = struct.unpack_from('>I4s', header)
+            header_size = 8
+            if size == 1 and len(header) == 16:
+                size = struct.unpack_from('>Q', header, 8)[0]
+                header_size = 16
+            if box_type == b'mdat':
+                end = position + size if header_size < size <= file_size - position else file_size
+                return position + header_size, end
+            if size < header_size:
+                break
+            position += size
+    raise ValueError('{} has no mdat'.format(filename))
+
+
+def scan_media_data(filename, reference):
+    """
+    Finds the samples of the 'mdat' of the damaged file filename, taking the tracks from the Mp4File reference.
+    Returns a RebuiltFile.
+    """
+    reference_tracks = reference.get_tracks()
+    rebuilt = RebuiltFile(filename, reference, reference_tracks)
+    start, end = find_media_data(filename)
+    rebuilt.media_data = (start, end)
+    video_track = audio_track = syntax = framer = None
+    for track in reference_tracks:
+        if video_track is None and track.handler_type == 'vide' and track.sample_count:
+            config = find_box(track.trak, 'avcC') or find_box(track.trak, 'hvcC')
+            if config is not None:
+                try:
+                    syntax = _AvcSyntax(config) if config.type == 'avcC' else _HevcSyntax(config)
+                except (ValueError, KeyError) as e:
+                    raise ValueError('cannot decode the parameter sets of track {} of {}: {}'.format(
+                        track.track_id, reference.filename, e))
+                video_track = track
+        elif audio_track is None and track.handler_type == 'soun' and track.sample_count:
+            try:
+                framer = _AudioFramer(track)
+                audio_track = track
+            except ValueError:
+                pass
+    if video_track is None and audio_track is None:
+        raise ValueError('{} has no AVC, HEVC or audio track to rebuild from'.format(reference.filename))
+
+    max_chunk_size = MIN_MAX_AUDIO_CHUNK_SIZE
+    if audio_track is not None:
+        max_chunk_size = max(max_chunk_size, AUDIO_CHUNK_MARGIN * _get_max_chunk_size(audio_track))
+    with open(filename, 'rb') as f:
+        window = _Window(f, end, max_chunk_size)
+        video = None
+        if video_track is not None:
+            video = _VideoScanner(syntax, window, max(MIN_MAX_NAL_SIZE, NAL_SIZE_MARGIN * max(video_track.sizes)))
+        scanner = _MediaDataScanner(window, start, end, video, framer, max_chunk_size)
+        scanner.scan()
+
+    movie_timescale = find_box(reference, 'mvhd').box_info['timescale']
+    for track, rebuilt_track in zip(reference_tracks, rebuilt.tracks):
+        # the video edit starts after the delay given to its composition offsets; the audio edit skips the same
+        # priming samples as in the reference
+        if track is video_track:
+            samples = video.samples
+            duration = _get_sample_duration(track)
+            composition_offsets, media_time = video.get_composition_offsets(duration)
+            skipped_duration = 0
+        elif track is audio_track:
+            samples = scanner.audio_samples
+            duration = _get_sample_duration(track)
+            composition_offsets = None
+            media_time = skipped_duration = next((media_time for segment_duration, media_time, media_rate
+                                                  in track.get_edit_list() if media_time != -1), 0)
+        else:
+            rebuilt_track.set_sample_index(_SampleList().get_columns(0))
+            continue
+        rebuilt_track.set_sample_index(samples.get_columns(duration, composition_offsets))
+        media_duration = len(samples.sizes) * duration
+        segment_duration = -(-max(0, media_duration - skipped_duration) * movie_timescale // track.timescale)
+        rebuilt.edit_lists[track.track_id] = [(segment_duration, media_time)]
+    rebuilt.skipped_regions = scanner.get_skipped_regions(video.orphans if video is not None else [])
+    return rebuilt
+
+
+def _get_sample_duration(track):
+    """ The most common sample duration of a track """
+    return Counter(track.durations).most_common(1)[0][0]
+
+
+def _get_max_chunk_size(track):
+    """ The size in bytes of the largest chunk of a track """
+    sizes = track.sizes
+    offsets = track.offsets
+    firsts = track.chunk_first_samples
+    return max(offsets[last - 1] + sizes[last - 1] - offsets[first]
+               for first, last in zip(firsts, itertools.chain(firsts[1:], [len(sizes)])) if last > first)
+
+
+class _MediaDataScanner:
+    """ Walks the media data, handing runs of video to a _VideoScanner and the gaps between them to an _AudioFramer """
+
+    def __init__(self, window, start, end, video, framer, max_chunk_size):
+        self.window = window
+        self.start = start
+        self.end = end
+        self.video = video
+        self.framer = framer
+        self.max_chunk_size = max_chunk_size
+        self.audio_samples = _SampleList()
+        self.skipped = []
+        self.video_ended = False
+
+    def scan(self):
+        position = self.start
+        while position < self.end:
+            if self.video is None or self.video_ended:
+                position = self._read_audio_only(position)
+                continue
+            nal = self.video.read_nal(position, self.end)
+            if nal is not None:
+                self.video.add(position, nal)
+                position += nal.nal_size
+                continue
+            self.video.close_unit()
+            position = self._read_gap(position)
+        if self.video is not None:
+            self.video.close_unit()
+
+    def _read_gap(self, start):
+        """ Reads the bytes from start up to the next run of video as audio, or skips them. Returns the new position """
+        for position in self._find_video(start + 1):
+            if self.framer is not None and position - start <= self.max_chunk_size:
+                sizes = self.framer.split(self.window.get(start, position - start))
+                if sizes is not None and self._starts_video_run(position, after_audio=True):
+                    self._add_audio(start, sizes)
+                    return position
+            if self._starts_video_run(position):
+                # after damage, or bytes of a track that is not rebuilt
+                self.skipped.append((start, position - start))
+                return position
+        # there is no more video, so the rest is audio if anything
+        self.video_ended = True
+        if self.framer is None:
+            self.skipped.append((start, self.end - start))
+            return self.end
+        return start
+
+    def _find_video(self, position):
+        """ Generator yielding the positions from position on where a NAL unit starts an access unit """
+        search_byte = self.video.get_search_byte()
+        while position < self.end:
+            if search_byte is not None:
+                position = self.window.find(search_byte, position, self.end)
+                if position == -1:
+                    return
+            nal = self.video.read_nal(position, self.end)
+            if nal is not None and (nal.first_slice or nal.starts_unit):
+                yield position
+            position += 1
+
+    def _starts_video_run(self, position, after_audio=False):
+        """
+        True if RESYNC_NAL_COUNT NAL units that check out follow on from position, or fewer up to the end. After an
+        audio chunk, fewer will do if they are followed by the start of another audio chunk.
+        """
+        for i in range(RESYNC_NAL_COUNT):
+            nal = self.video.read_nal(position, self.end)
+            if nal is None:
+                return after_audio and i > 0 and self.framer.could_start_frame(self.window.get(position, 1))
+            position += nal.nal_size
+            if position == self.end:
+                break
+        return True
+
+    def _read_audio_only(self, start):
+        block = self.window.get(start, READ_BLOCK_SIZE // 2)
+        if start + len(block) == self.end:
+            sizes = self.framer.split_tail(block)
+        else:
+            sizes = self.framer.split(block, complete=False) or []
+            sizes = sizes[:max(0, len(sizes) - AUDIO_ONLY_MARGIN_FRAMES)]
+        if sizes:
+            return self._add_audio(start, sizes)
+        # skip to where the next frame could start
+        skipped_size = min(self.framer.find_candidates(block, 1) or [len(block)])
+        self.skipped.append((start, skipped_size))
+        return start + skipped_size
+
+    def _add_audio(self, position, sizes):
+        for size in sizes:
+            self.audio_samples.add(position, size, True)
+            position += size
+        return position
+
+    def get_skipped_regions(self, orphans):
+        """ Returns the skipped byte ranges as a list of dicts with offset and size, adjacent ranges merged """
+        regions = []
+        for offset, size in sorted(itertools.chain(self.skipped, orphans)):
+            if not size:
+                continue
+            if regions and regions[-1]['offset'] + regions[-1]['size'] == offset:
+                regions[-1]['size'] += size
+            else:
+                regions.append({'offset': offset, 'size': size})
+        return regions
+
+
+def reindex(filename, reference_filename, out_filename):
+    """
+    Writes the samples of the damaged recording filename to out_filename as a playable progressive file, with the
+    sample tables rebuilt as described in the module docstring and everything else taken from reference_filename.
+    Returns a dict describing the rebuilt tracks and the bytes skipped.
+    """
+    rebuilt = scan_media_data(filename, Mp4File(reference_filename))
+    track_ids = write_progressive(rebuilt, out_filename, edit_lists=rebuilt.edit_lists)
+    start, end = rebuilt.media_data
+    return {
+        'mdat': {'offset': start, 'size': end - start},
+        'tracks': [{'track_ID': track.track_id, 'handler_type': track.handler_type,
+                    'sample_count': track.sample_count, 'sync_sample_count': track.sync.count(1)}
+                   for track in rebuilt.tracks if track.track_id in track_ids],
+        'left_out_track_ids': [track.track_id for track in rebuilt.tracks if track.track_id not in track_ids],
+        'skipped_bytes': sum(region['size'] for region in rebuilt.skipped_regions),
+        'skipped_regions': rebuilt.skipped_regions
+    }
@@ -0,0 +1,244 @@
+"""
+remote.py
+
+Reads files on web servers without downloading them. RangeFile is a byte source (see source.py) that fetches the
+bytes it is asked for with HTTP Range requests, so it can be handed to Mp4File in place of a filename, and only the
+boxes the parser reads are fetched: for a file with its 'moov' at the end, the start of the file and then the 'moov'.
+
+The file is fetched in aligned blocks of block_size bytes, of which the cache_blocks used last are kept (LRU). The
+blocks a read needs that are not cached are fetched with one request per run of adjacent missing blocks. Reads that
+carry on where the last one ended get read-ahead: the blocks fetched for them double each time, up to
+max_read_ahead blocks, as the parser reads a box front to back. Requests go over keep-alive connections from a
+ConnectionPool, shared by default by every RangeFile, so one connection serves any number of requests.
+
+"""
+import collections
+import http.client
+import re
+import threading
+import urllib.parse
+import mp4.source
+
+DEFAULT_BLOCK_SIZE = 256 * 1024
+DEFAULT_CACHE_BLOCKS = 64
+DEFAULT_MAX_READ_AHEAD = 32
+DEFAULT_TIMEOUT = 30
+
+# redirects followed before giving up
+MAX_REDIRECTS = 5
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class ConnectionPool:
+    """
+    Keeps the idle HTTP connections of each (scheme, host and port), at most max_idle of each, so that requests can
+    reuse them. Safe to share between threads; a connection is only used by one request at a time.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_idle=4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    def request(self, url, headers):
+        """
+        Sends a GET request for url with the dict headers, following redirects. Returns (final url, status, response
+        headers, body). A connection that the server has closed while idle is replaced and the request sent again.
+        """
+        for redirect in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise ValueError('{} is not an http or https URL'.format(url))
+            key = (parts.scheme, parts.netloc)
+            path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            connection = self._get_connection(key)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # an idle connection the server had closed
+                connection.close()
+                connection = self._connect(key)
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+            body = response.read()
+            if response.will_close:
+                connection.close()
+            else:
+                self._put_connection(key, connection)
+            if response.status in REDIRECT_STATUSES and response.getheader('Location'):
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            return url, response.status, response.headers, body
+        raise OSError('too many redirects from {}'.format(url))
+
+    def _get_connection(self, key):
+        with self.lock:
+            if self.idle[key]:
+                return self.idle[key].pop()
+        return self._connect(key)
+
+    def _put_connection(self, key, connection):
+        with self.lock:
+            if len(self.idle[key]) < self.max_idle:
+                self.idle[key].append(connection)
+                return
+        connection.close()
+
+    def _connect(self, key):
+        scheme, netloc = key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(netloc, timeout=self.timeout)
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+
+# the pool of every RangeFile not given one
+_default_pool = ConnectionPool()
+
+
+class RangeFile(mp4.source.ByteSource):
+    """
+    A byte source (see source.py) holding the resource at url, as described in the module docstring. Raises OSError
+    if the server does not answer a Range request with the range (status 206). Sample reads (track.read_ranges())
+    bridge gaps of up to a block.
+    """
+    def __init__(self, url, block_size=DEFAULT_BLOCK_SIZE, cache_blocks=DEFAULT_CACHE_BLOCKS,
+                 max_read_ahead=DEFAULT_MAX_READ_AHEAD, pool=None, headers=None):
+        super().__init__()
+        self.name = url
+        self.url = url
+        self.block_size = block_size
+        self.coalesce_gap = block_size
+        self.cache_blocks = max(1, cache_blocks)
+        self.max_read_ahead = max_read_ahead
+        self.pool = pool or _default_pool
+        self.headers = dict(headers or {})
+        self.blocks = collections.OrderedDict()
+        # where the last read ended, and the blocks read ahead for the next read if it starts there
+        self.last_end = 0
+        self.read_ahead = 0
+        # guards the cache and the read-ahead state, for reads from several threads (e.g. hashing.py)
+        self.lock = threading.Lock()
+        # the size is learnt from the first request, which fetches the first block
+        self.size = None
+        self._fetch_blocks(0, 1)
+
+    def _fetch(self, offset, size):
+        with self.lock:
+            return self._fetch_cached(offset, size)
+
+    def _fetch_cached(self, offset, size):
+        end = offset + size
+        # read-ahead only for reads that carry on where the last one ended
+        self.read_ahead = min(max(1, 2 * self.read_ahead), self.max_read_ahead) if offset == self.last_end else 0
+        self.last_end = end
+        first_block = offset // self.block_size
+        last_block = (end - 1) // self.block_size
+        if last_block - first_block + 1 > self.cache_blocks:
+            # more than the cache holds: not cached
+            return self._request(offset, end - 1)
+        self._fetch_missing(first_block, last_block)
+        data = bytearray(size)
+        written = 0
+        for block_index in range(first_block, last_block + 1):
+            block = self.blocks[block_index]
+            block_start = block_index * self.block_size
+            start = max(offset, block_start) - block_start
+            stop = min(end, block_start + len(block)) - block_start
+            data[written:written + stop - start] = block[start:stop]
+            written += stop - start
+        return data
+
+    def _fetch_missing(self, first_block, last_block):
+        """
+        Fetches the blocks from first_block to last_block that are not cached, and the read-ahead blocks after them,
+        as many of them as fit in the cache along with the blocks needed
+        """
+        for block_index in range(first_block, last_block + 1):
+            if block_index in self.blocks:
+                # used now, so not to be evicted by the blocks fetched for this read
+                self.blocks.move_to_end(block_index)
+        last_fetched = min(last_block + self.read_ahead, first_block + self.cache_blocks - 1,
+                           (self.size - 1) // self.block_size)
+        block_index = first_block
+        while block_index <= last_fetched:
+            if block_index in self.blocks:
+                if block_index > last_block:
+                    # read-ahead stops at a cached block
+                    break
+                block_index += 1
+                continue
+            run_end = block_index
+            while run_end < last_fetched and run_end + 1 not in self.blocks:
+                run_end += 1
+            self._fetch_blocks(block_index, run_end - block_index + 1)
+            block_index = run_end + 1
+
+    def _fetch_blocks(self, first_block, block_count):
+        """ Fetches block_count blocks from first_block into the cache """
+        start = first_block * self.block_size
+        end = start + block_count * self.block_size - 1
+        if self.size is not None:
+            end = min(end, self.size - 1)
+        body = self._request(start, end)
+        for i in range(0, len(body), self.block_size):
+            self.blocks[first_block + i // self.block_size] = body[i:i + self.block_size]
+        while len(self.blocks) > self.cache_blocks:
+            self.blocks.popitem(last=False)
+
+    def _request(self, start, end):
+        """
+        Returns bytes start to end (inclusive) of the file, or as many of them as the file holds, learning the size
+        of the file from the first request. A server that answers with fewer bytes than asked for (e.g. one that
+        caps the size of a range) is asked for the rest.
+        """
+        parts = []
+        position = start
+        while True:
+            body, last = self._request_range(position, end)
+            parts.append(body)
+            position = last + 1
+            if position > end or position >= self.size:
+                break
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def _request_range(self, start, end):
+        """ Sends a Range request for bytes start to end. Returns the body and the offset of its last byte. """
+        headers = dict(self.headers, Range='bytes={}-{}'.format(start, end))
+        self.url, status, response_headers, body = self.pool.request(self.url, headers)
+        self._count(len(body))
+        if status == 416 and start == 0 and self.size is None:
+            # an empty file
+            self.size = 0
+            return b'', -1
+        if status != 206:
+            raise OSError('{} did not answer a Range request for bytes {}-{} with the range (status {})'.format(
+                self.url, start, end, status))
+        match = _CONTENT_RANGE.fullmatch(response_headers.get('Content-Range', '').strip())
+        if not match or int(match.group(1)) != start or len(body) != int(match.group(2)) - start + 1:
+            raise OSError('{} answered a Range request for bytes {}-{} with Content-Range {}'.format(
+                self.url, start, end, response_headers.get('Content-Range')))
+        if self.size is None:
+            if match.group(3) == '*':
+                raise OSError('{} did not give its size'.format(self.url))
+            self.size = int(match.group(3))
+        last = int(match.group(2))
+        if last > end:
+            # more than was asked for
+            body = body[:end - start + 1]
+            last = end
+        return body, last
+
+
+def is_url(name):
+    """ True if name is an http or https URL rather than a filename """
+    return isinstance(name, str) and name.startswith(('http://', 'https://'))
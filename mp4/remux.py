@@ -0,0 +1,388 @@
+"""
+remux.py
+
+Converts between the two ways an MP4 file can describe its samples:
+
+- progressive, with a 'moov' whose sample tables ('stbl') cover every sample of the 'mdat',
+- fragmented, with a 'moov' that only declares the tracks ('mvex'/'trex'), followed by 'moof'/'mdat' pairs.
+
+Both writers work from the per-sample arrays of track.Track, which cover the samples of a track whichever way they
+are described, so any file can be written either way. The new sample tables are built from those arrays without
+reading the media data, and the samples are copied from the source with writer.copy_range(). Memory use grows with
+the number of samples (a few tens of bytes each) but not with the size of the media data.
+
+"""
+import bisect
+import itertools
+import operator
+import struct
+from mp4.core import find_box
+from mp4.iso import Mp4File
+from mp4.track import DEPENDENCY_FLAGS_SHIFT, NON_SYNC_FLAG
+from mp4.writer import make_box, make_full_box, pack_array, make_chunk_offset_box, rebuild_box, set_duration, \
+    copy_range
+
+# length, in seconds, of each fragment written by write_fragmented(); fragments start on a sync sample of the
+# reference track, so most are a little longer
+DEFAULT_FRAGMENT_DURATION = 2.0
+
+# sample flags written to 'trun' and 'tfhd': a sync sample depends on no other sample, any other sample depends on
+# others and is flagged sample_is_non_sync_sample
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+# 'tfhd' flags
+DEFAULT_SAMPLE_FLAGS_PRESENT = 0x000020
+DEFAULT_BASE_IS_MOOF = 0x020000
+
+# 'trun' flags
+DATA_OFFSET_PRESENT = 0x000001
+SAMPLE_DURATION_PRESENT = 0x000100
+SAMPLE_SIZE_PRESENT = 0x000200
+SAMPLE_FLAGS_PRESENT = 0x000400
+SAMPLE_COMPOSITION_TIME_OFFSETS_PRESENT = 0x000800
+
+
+def to_progressive(in_filename, out_filename):
+    """ Writes the samples of in_filename to out_filename as a progressive file with the 'moov' at the front """
+    return write_progressive(Mp4File(in_filename), out_filename)
+
+
+def to_fragmented(in_filename, out_filename, fragment_duration=DEFAULT_FRAGMENT_DURATION):
+    """ Writes the samples of in_filename to out_filename as a fragmented file """
+    return write_fragmented(Mp4File(in_filename), out_filename, fragment_duration)
+
+
+def write_progressive(mp4file, out_filename, sample_ranges=None, edit_lists=None):
+    """
+    Writes a progressive file, 'moov' first, holding the samples of the tracks of mp4file.
+    sample_ranges is a dict of track_ID: (first, last) selecting samples first to last - 1 of a track, by default
+    all of them; a track with no samples selected is left out. edit_lists is a dict of track_ID: list of
+    (segment_duration, media_time) to be written as the edit list of a track, segment_duration in movie timescale
+    units and media_time relative to the first sample selected. Other tracks keep their 'edts' as it is, unless
+    their first sample selected does not decode at time 0 (e.g. a fragment with a 'tfdt'): the new sample tables
+    start at 0, so the edit list is moved to match (see _rebase_edits()). Returns the list of track_IDs written.
+    """
+    moov = _get_moov(mp4file)
+    ftyp = find_box(mp4file, 'ftyp')
+    ftyp_bytes = bytes(ftyp.get_bytes()) if ftyp else b''
+    sample_ranges = sample_ranges or {}
+    edit_lists = edit_lists or {}
+    removed = {}
+    selected = []
+    for track in mp4file.get_tracks():
+        first, last = sample_ranges.get(track.track_id, (0, track.sample_count))
+        if first < last:
+            selected.append((track, first, last))
+        else:
+            removed[track.trak] = b''
+    mvex = find_box(moov, 'mvex')
+    if mvex is not None:
+        removed[mvex] = b''
+
+    # a chunk of the new file is the part of a chunk of the source holding selected samples; chunks are written in
+    # the order they have in the source, which keeps the interleaving of the tracks
+    chunks = sorted(itertools.chain.from_iterable(_get_chunks(track, first, last, i)
+                                                  for i, (track, first, last) in enumerate(selected)),
+                    key=operator.itemgetter(0))
+    mdat_size = sum(size for offset, size, i, sample_count in chunks)
+    if mdat_size + 8 > 0xffffffff:
+        mdat_header = struct.pack('>I4sQ', 1, b'mdat', mdat_size + 16)
+    else:
+        mdat_header = struct.pack('>I4s', mdat_size + 8, b'mdat')
+
+    # chunk offsets depend on the size of the moov, which depends on whether they need a 'co64', so repeat until
+    # the size is stable
+    moov_size = moov.size
+    while True:
+        chunk_offsets = [[] for _ in selected]
+        chunk_sample_counts = [[] for _ in selected]
+        position = len(ftyp_bytes) + moov_size + len(mdat_header)
+        for offset, size, i, sample_count in chunks:
+            chunk_offsets[i].append(position)
+            chunk_sample_counts[i].append(sample_count)
+            position += size
+        replacements = dict(removed)
+        movie_timescale = find_box(moov, 'mvhd').box_info['timescale']
+        movie_duration = 0
+        for i, (track, first, last) in enumerate(selected):
+            trak = track.trak
+            replacements[find_box(trak, 'stbl')] = make_sample_table(track, first, last, chunk_offsets[i],
+                                                                     chunk_sample_counts[i])
+            media_duration = sum(track.durations[first:last])
+            mdhd = find_box(trak, 'mdhd')
+            replacements[mdhd] = set_duration(mdhd, media_duration)
+            tkhd = find_box(trak, 'tkhd')
+            edts = find_box(trak, 'edts')
+            edits = edit_lists.get(track.track_id)
+            if edits is None and track.dts[first]:
+                edits = _rebase_edits(track, first, last, movie_timescale)
+            if edits is not None:
+                track_duration = sum(segment_duration for segment_duration, media_time in edits)
+                edts_bytes = make_box('edts', make_edit_list_box(edits))
+                if edts is not None:
+                    replacements[edts] = edts_bytes
+                    replacements[tkhd] = set_duration(tkhd, track_duration)
+                else:
+                    # 'edts' goes straight after 'tkhd'
+                    replacements[tkhd] = set_duration(tkhd, track_duration) + edts_bytes
+            else:
+                track_duration = -(-media_duration * movie_timescale // track.timescale)
+                replacements[tkhd] = set_duration(tkhd, track_duration)
+            movie_duration = max(movie_duration, track_duration)
+        mvhd = find_box(moov, 'mvhd')
+        replacements[mvhd] = set_duration(mvhd, movie_duration)
+        moov_bytes = rebuild_box(moov, replacements)
+        if len(moov_bytes) == moov_size:
+            break
+        moov_size = len(moov_bytes)
+
+    with open(mp4file.filename, 'rb') as src, open(out_filename, 'wb') as dst:
+        dst.write(ftyp_bytes)
+        dst.write(moov_bytes)
+        dst.write(mdat_header)
+        for offset, size in _coalesce((offset, size) for offset, size, i, sample_count in chunks):
+            copy_range(src, dst, offset, size)
+    return [track.track_id for track, first, last in selected]
+
+
+def write_fragmented(mp4file, out_filename, fragment_duration=DEFAULT_FRAGMENT_DURATION):
+    """
+    Writes a fragmented file holding the samples of the tracks of mp4file, with a new fragment at the first sync
+    sample of the video track (or, without one, of the first track) after every fragment_duration seconds.
+    Each fragment has a 'traf' for every track with samples in its time span, and the samples of each track are
+    contiguous in the 'mdat'. Returns the number of fragments written.
+    """
+    moov = _get_moov(mp4file)
+    ftyp = find_box(mp4file, 'ftyp')
+    tracks = mp4file.get_tracks()
+    replacements = {find_box(track.trak, 'stbl'): make_sample_table(track, 0, 0, [], []) for track in tracks}
+    mvex_payload = b''
+    mvhd = find_box(moov, 'mvhd')
+    if mvhd.box_info['duration']:
+        mehd_version = 1 if mvhd.box_info['duration'] > 0xffffffff else 0
+        mehd_format = '>Q' if mehd_version == 1 else '>I'
+        mvex_payload += make_full_box('mehd', mehd_version, 0, struct.pack(mehd_format, mvhd.box_info['duration']))
+    for track in tracks:
+        mvex_payload += make_full_box('trex', 0, 0, struct.pack('>5I', track.track_id, 1, 0, 0, 0))
+    mvex = find_box(moov, 'mvex')
+    if mvex is not None:
+        replacements[mvex] = b''
+    moov_bytes = rebuild_box(moov, replacements, {moov: make_box('mvex', mvex_payload)})
+
+    # sample index at which each fragment starts, for every track
+    tracks = [track for track in tracks if track.sample_count]
+    reference = next((track for track in tracks if track.handler_type == 'vide'), tracks[0] if tracks else None)
+    start_times = _get_fragment_start_times(reference, fragment_duration) if reference else []
+    boundaries = []
+    for track in tracks:
+        # a fragment starting at t in the reference timescale starts at ceil(t * timescale / reference timescale)
+        starts = (-(-t * track.timescale // reference.timescale) for t in start_times)
+        boundaries.append([0] + [bisect.bisect_left(track.dts, start) for start in starts] + [track.sample_count])
+
+    fragment_count = 0
+    with open(mp4file.filename, 'rb') as src, open(out_filename, 'wb') as dst:
+        if ftyp is not None:
+            dst.write(bytes(ftyp.get_bytes()))
+        dst.write(moov_bytes)
+        for k in range(len(start_times) + 1):
+            fragment = [(track, bounds[k], bounds[k + 1]) for track, bounds in zip(tracks, boundaries)
+                        if bounds[k] < bounds[k + 1]]
+            if not fragment:
+                continue
+            fragment_count += 1
+            mdat_size = sum(sum(track.sizes[first:last]) for track, first, last in fragment)
+            mdat_header_size = 16 if mdat_size + 8 > 0xffffffff else 8
+            # the size of the moof does not depend on the data offsets, so it is built once to find where its mdat
+            # data starts and again with the real offsets
+            moof_size = len(_make_moof(fragment_count, fragment, 0))
+            dst.write(_make_moof(fragment_count, fragment, moof_size + mdat_header_size))
+            if mdat_header_size == 16:
+                dst.write(struct.pack('>I4sQ', 1, b'mdat', mdat_size + 16))
+            else:
+                dst.write(struct.pack('>I4s', mdat_size + 8, b'mdat'))
+            ranges = ((offset, size) for track, first, last in fragment
+                      for offset, size, i, sample_count in _get_chunks(track, first, last, 0))
+            for offset, size in _coalesce(ranges):
+                copy_range(src, dst, offset, size)
+    return fragment_count
+
+
+def make_sample_table(track, first, last, chunk_offsets, chunk_sample_counts):
+    """
+    Returns an 'stbl' box describing samples first to last - 1 of track, stored in chunks at chunk_offsets holding
+    chunk_sample_counts samples each. The 'stsd' is copied from the track and every sample refers to its first entry.
+    """
+    boxes = [bytes(find_box(track.trak, 'stsd').get_bytes())]
+    stts = _runs(track.durations[first:last])
+    boxes.append(make_full_box('stts', 0, 0, struct.pack('>I', len(stts)) +
+                               pack_array('I', itertools.chain.from_iterable(stts))))
+    composition_offsets = track.composition_offsets[first:last]
+    if any(composition_offsets):
+        ctts = _runs(composition_offsets)
+        # negative offsets need a version 1 'ctts'
+        if min(composition_offsets) < 0:
+            boxes.append(make_full_box('ctts', 1, 0, struct.pack('>I', len(ctts)) +
+                                       pack_array('i', itertools.chain.from_iterable(ctts))))
+        else:
+            boxes.append(make_full_box('ctts', 0, 0, struct.pack('>I', len(ctts)) +
+                                       pack_array('I', itertools.chain.from_iterable(ctts))))
+    sync = track.sync[first:last]
+    if 0 in sync:
+        sync_samples = list(itertools.compress(itertools.count(1), sync))
+        boxes.append(make_full_box('stss', 0, 0, struct.pack('>I', len(sync_samples)) + pack_array('I', sync_samples)))
+    stsc = []
+    chunk = 1
+    for chunk_count, samples_per_chunk in _runs(chunk_sample_counts):
+        stsc.extend((chunk, samples_per_chunk, 1))
+        chunk += chunk_count
+    boxes.append(make_full_box('stsc', 0, 0, struct.pack('>I', len(stsc) // 3) + pack_array('I', stsc)))
+    sizes = track.sizes[first:last]
+    if sizes and min(sizes) == max(sizes):
+        boxes.append(make_full_box('stsz', 0, 0, struct.pack('>II', sizes[0], len(sizes))))
+    else:
+        boxes.append(make_full_box('stsz', 0, 0, struct.pack('>II', 0, len(sizes)) + pack_array('I', sizes)))
+    boxes.append(make_chunk_offset_box(chunk_offsets))
+    dependencies = track.dependencies[first:last]
+    if dependencies.count(0) != len(dependencies):
+        boxes.append(make_full_box('sdtp', 0, 0, bytes(dependencies)))
+    return make_box('stbl', b''.join(boxes))
+
+
+def make_edit_list_box(edits):
+    """ Returns an 'elst' box for a list of (segment_duration, media_time), each played at normal rate """
+    if any(segment_duration > 0xffffffff or abs(media_time) > 0x7fffffff for segment_duration, media_time in edits):
+        entries = b''.join(struct.pack('>QqhH', segment_duration, media_time, 1, 0)
+                           for segment_duration, media_time in edits)
+        return make_full_box('elst', 1, 0, struct.pack('>I', len(edits)) + entries)
+    entries = b''.join(struct.pack('>IihH', segment_duration, media_time, 1, 0)
+                       for segment_duration, media_time in edits)
+    return make_full_box('elst', 0, 0, struct.pack('>I', len(edits)) + entries)
+
+
+def _rebase_edits(track, first, last, movie_timescale):
+    """
+    Returns the edit list of track as a list of (segment_duration, media_time) for a media timeline on which sample
+    first decodes at 0 rather than at its dts, so that the samples are presented when they were before. Media
+    before the first sample is not there, so the part of an edit that would present it becomes an empty edit, its
+    length rounded to the movie timescale. A segment_duration of 0 (the rest of the media) is given in full.
+    Edits are written at normal rate.
+    """
+    base = track.dts[first]
+    media_end = track.dts[last - 1] + track.durations[last - 1]
+    edits = []
+    for segment_duration, media_time, media_rate in track.get_edit_list():
+        if media_time == -1:
+            edits.append((segment_duration, -1))
+            continue
+        if segment_duration == 0:
+            segment_duration = max(0, -(-(media_end - media_time) * movie_timescale // track.timescale))
+        if media_time < base:
+            gap = min(segment_duration, round((base - media_time) * movie_timescale / track.timescale))
+            if gap:
+                edits.append((gap, -1))
+            segment_duration -= gap
+            media_time = base
+        if segment_duration:
+            edits.append((segment_duration, media_time - base))
+    return edits
+
+
+def _get_moov(mp4file):
+    moov = find_box(mp4file, 'moov')
+    if moov is None:
+        raise ValueError('{} has no moov box'.format(mp4file.filename))
+    return moov
+
+
+def _get_chunks(track, first, last, tag):
+    """
+    Generator yielding (offset, size, tag, sample_count) for the part of each chunk of track that holds samples in
+    first to last - 1. The samples of a chunk are contiguous in the file, so each part is a single byte range.
+    """
+    first_samples = track.chunk_first_samples
+    offsets = track.offsets
+    sizes = track.sizes
+    chunk = max(0, bisect.bisect_right(first_samples, first) - 1)
+    while chunk < len(first_samples) and first_samples[chunk] < last:
+        start = max(first, first_samples[chunk])
+        end = min(last, first_samples[chunk + 1] if chunk + 1 < len(first_samples) else len(sizes))
+        if start < end:
+            yield offsets[start], sum(sizes[start:end]), tag, end - start
+        chunk += 1
+
+
+def _get_fragment_start_times(track, fragment_duration):
+    """ Decode times (in the track's timescale) of the sync samples that start the second and later fragments """
+    dts = track.dts
+    step = fragment_duration * track.timescale
+    start_times = []
+    next_start = dts[0] + step
+    for sample in track.get_sync_samples():
+        if dts[sample] >= next_start:
+            start_times.append(dts[sample])
+            next_start = dts[sample] + step
+    return start_times
+
+
+def _make_moof(sequence_number, fragment, data_offset):
+    """ Returns a 'moof' box for the (track, first, last) of a fragment, data_offset being where its data starts """
+    trafs = []
+    for track, first, last in fragment:
+        trafs.append(_make_traf(track, first, last, data_offset))
+        data_offset += sum(track.sizes[first:last])
+    return make_box('moof', make_full_box('mfhd', 0, 0, struct.pack('>I', sequence_number)) + b''.join(trafs))
+
+
+def _make_traf(track, first, last, data_offset):
+    sync = track.sync[first:last]
+    tfhd_flags = DEFAULT_BASE_IS_MOOF
+    tfhd_payload = struct.pack('>I', track.track_id)
+    trun_flags = DATA_OFFSET_PRESENT | SAMPLE_DURATION_PRESENT | SAMPLE_SIZE_PRESENT
+    trun_version = 0
+    columns = [track.durations[first:last], track.sizes[first:last]]
+    dependencies = track.dependencies[first:last]
+    if dependencies.count(0) != len(dependencies):
+        # keep the dependency flags of the source, from its 'sdtp' or its own sample flags
+        flags = [dependency << DEPENDENCY_FLAGS_SHIFT | (0 if is_sync else NON_SYNC_FLAG)
+                 for dependency, is_sync in zip(dependencies, sync)]
+    else:
+        flags = [SYNC_SAMPLE_FLAGS if is_sync else NON_SYNC_SAMPLE_FLAGS for is_sync in sync]
+    if flags.count(flags[0]) != len(flags):
+        trun_flags |= SAMPLE_FLAGS_PRESENT
+        columns.append(flags)
+    else:
+        # every sample has the same flags, so they can share the default flags
+        tfhd_flags |= DEFAULT_SAMPLE_FLAGS_PRESENT
+        tfhd_payload += struct.pack('>I', flags[0])
+    composition_offsets = track.composition_offsets[first:last]
+    if any(composition_offsets):
+        trun_flags |= SAMPLE_COMPOSITION_TIME_OFFSETS_PRESENT
+        if min(composition_offsets) < 0:
+            trun_version = 1
+        # written as 32-bit two's complement, which version 1 reads as signed
+        columns.append(map(operator.and_, composition_offsets, itertools.repeat(0xffffffff)))
+    rows = pack_array('I', itertools.chain.from_iterable(zip(*columns)))
+    tfhd = make_full_box('tfhd', 0, tfhd_flags, tfhd_payload)
+    tfdt = make_full_box('tfdt', 1, 0, struct.pack('>Q', track.dts[first]))
+    trun = make_full_box('trun', trun_version, trun_flags, struct.pack('>Ii', last - first, data_offset) + rows)
+    return make_box('traf', tfhd + tfdt + trun)
+
+
+def _runs(values):
+    """ Run-length encodes values as a list of (count, value) """
+    return [(len(list(group)), value) for value, group in itertools.groupby(values)]
+
+
+def _coalesce(ranges):
+    """ Generator merging (offset, size) byte ranges that follow on from each other """
+    start = end = None
+    for offset, size in ranges:
+        if offset == end:
+            end += size
+            continue
+        if start is not None:
+            yield start, end - start
+        start, end = offset, offset + size
+    if start is not None:
+        yield start, end - start
@@ -0,0 +1,80 @@
+"""
+resync.py
+
+Finds the way back into a file after a damaged stretch. The top-level boxes of a file are found by following their
+sizes from one to the next, so a single corrupt header would lose everything after it. find_next_box() searches
+forward for the next plausible top-level box header: the size and type of one of TOP_LEVEL_BOX_TYPES, a size that
+fits in the file, and the box followed by another box header or the end of the file.
+The search runs mmap.find() for each type over windows of WINDOW_SIZE bytes, so that it goes at close to the speed
+of reading the file even if the next box is gigabytes away, e.g. when the header of a large 'mdat' is damaged.
+
+"""
+import struct
+
+# the box types searched for; any other type is accepted in the header that confirms a find
+TOP_LEVEL_BOX_TYPES = (b'moov', b'moof', b'mdat', b'ftyp', b'styp', b'sidx', b'ssix', b'mfra', b'free', b'skip',
+                       b'wide', b'meta', b'pdin', b'prft', b'emsg', b'uuid')
+
+WINDOW_SIZE = 16 * 1024 * 1024
+
+_HEADER = struct.Struct('>I4s')
+_LARGESIZE = struct.Struct('>Q')
+
+
+def get_box_end(buffer, offset, file_size):
+    """
+    Returns the end offset of the box whose header appears to start at offset in buffer (a bytes-like object or
+    mmap of the whole file), or None if the bytes there do not look like a box header: a type of four printable
+    characters and a size at least that of the header. A box may end beyond file_size if the file is truncated.
+    """
+    if offset < 0 or offset + 8 > file_size:
+        return None
+    size, box_type = _HEADER.unpack_from(buffer, offset)
+    # printable ASCII, or the copyright sign that starts the types of iTunes metadata items
+    if not all(32 <= c < 127 or c == 169 for c in box_type):
+        return None
+    if size == 1:
+        if offset + 16 > file_size:
+            return None
+        size = _LARGESIZE.unpack_from(buffer, offset + 8)[0]
+        if size < 16:
+            return None
+    elif size < 8:
+        return None
+    return offset + size
+
+
+def is_plausible_box(buffer, offset, file_size):
+    """
+    True if a top-level box starts at offset: a header of one of TOP_LEVEL_BOX_TYPES whose box ends at the end of
+    the file, or where another box header starts. Only an 'mdat' may end beyond the end of the file, as it does in a
+    file that was still being written.
+    """
+    if buffer[offset + 4:offset + 8] not in TOP_LEVEL_BOX_TYPES:
+        return False
+    end = get_box_end(buffer, offset, file_size)
+    if end is None:
+        return False
+    if end > file_size:
+        return buffer[offset + 4:offset + 8] == b'mdat'
+    return end == file_size or get_box_end(buffer, end, file_size) is not None
+
+
+def find_next_box(buffer, start, file_size):
+    """ Returns the offset of the first plausible top-level box at or after start, or None if there is none """
+    window_start = start
+    while window_start < file_size:
+        # the type follows the 4-byte size, and may straddle the end of the window
+        window_end = min(window_start + WINDOW_SIZE, file_size)
+        candidates = []
+        for box_type in TOP_LEVEL_BOX_TYPES:
+            position = buffer.find(box_type, window_start + 4, window_end + 4)
+            while position != -1:
+                if is_plausible_box(buffer, position - 4, file_size):
+                    candidates.append(position - 4)
+                    break
+                position = buffer.find(box_type, position + 1, window_end + 4)
+        if candidates:
+            return min(candidates)
+        window_start = window_end
+    return None
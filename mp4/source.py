@@ -0,0 +1,284 @@
+"""
+source.py
+
+Byte sources: the places the bytes of an MP4 file can be read from, behind one interface, so that the parser does
+not care whether a file is local, mapped, in memory, on a web server (remote.RangeFile) or pieced together from
+byte ranges held in a cache. A ByteSource is a read-only, seekable binary file (it can be given to Mp4File in place
+of a filename) with a size, and read_at(offset, size) for positioned reads, which may be made from several threads
+at once. A subclass only has to implement _fetch(offset, size), safely for several threads.
+
+Slow backends should see few, large reads rather than many small ones, so a ByteSource coalesces reads in two ways:
+
+- reads through the file interface that are smaller than min_read fetch min_read bytes, and the reads after them
+  are served from those bytes for as long as they fall inside them, as the parser reads a box header and then the
+  box, or steps from one small top-level box to the next
+- plan_reads() merges a list of ranges (e.g. of samples, see track.read_ranges()) into runs that are read with one
+  call each, bridging gaps of up to coalesce_gap bytes, the size of a read being worth less than another request
+
+Each source counts the reads asked of it (reads, bytes_read) and the requests that went to its backend (requests,
+bytes_fetched).
+
+"""
+import bisect
+import contextlib
+import io
+import mmap
+import operator
+import os
+import threading
+
+# reads through the file interface of a FileSource smaller than this fetch this many bytes
+DEFAULT_MIN_READ = 64 * 1024
+
+
+class ByteSource(io.RawIOBase):
+    """ The base class of the byte sources. Subclasses set size and name, and implement _fetch(). """
+    min_read = 0
+    coalesce_gap = 0
+
+    def __init__(self):
+        super().__init__()
+        self.name = None
+        self.size = 0
+        self.position = 0
+        # the bytes last fetched for a read smaller than min_read, starting at window_start
+        self.window = b''
+        self.window_start = 0
+        self.reads = 0
+        self.bytes_read = 0
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError('invalid whence ({})'.format(whence))
+        if position < 0:
+            raise ValueError('negative seek position {}'.format(position))
+        self.position = position
+        return position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        size = min(len(view), self.size - self.position)
+        if size <= 0:
+            return 0
+        start = self.position - self.window_start
+        if 0 <= start and start + size <= len(self.window):
+            view[:size] = self.window[start:start + size]
+        elif size < self.min_read:
+            self.window = memoryview(self.read_at(self.position, self.min_read))
+            self.window_start = self.position
+            view[:size] = self.window[:size]
+        else:
+            view[:size] = self.read_at(self.position, size)
+        self.position += size
+        return size
+
+    def read_at(self, offset, size):
+        """ Returns the size bytes at offset, or fewer if they run past the end """
+        size = min(size, self.size - offset)
+        if size <= 0:
+            return b''
+        self.reads += 1
+        self.bytes_read += size
+        return self._fetch(offset, size)
+
+    def _fetch(self, offset, size):
+        """ Returns the size bytes at offset, which are all within the source, as a bytes-like object """
+        raise NotImplementedError
+
+    def _count(self, size):
+        """ Counts a request of size bytes to the backend """
+        self.requests += 1
+        self.bytes_fetched += size
+
+    def get_counters(self):
+        return {'reads': self.reads, 'bytes_read': self.bytes_read, 'requests': self.requests,
+                'bytes_fetched': self.bytes_fetched}
+
+
+class FileSource(ByteSource):
+    """ A local file, read with os.pread() where there is one, so that it can be read from several threads """
+    coalesce_gap = 16 * 1024
+
+    def __init__(self, filename, min_read=DEFAULT_MIN_READ):
+        super().__init__()
+        self.name = filename
+        self.min_read = min_read
+        self.f = open(filename, 'rb', buffering=0)
+        self.size = os.fstat(self.f.fileno()).st_size
+        self.lock = threading.Lock()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def _fetch(self, offset, size):
+        self._count(size)
+        if hasattr(os, 'pread'):
+            data = os.pread(self.f.fileno(), size, offset)
+        else:
+            # no pread (Windows): the threads share the file position, so take turns
+            with self.lock:
+                self.f.seek(offset)
+                data = self.f.read(size)
+        if len(data) != size:
+            raise EOFError('{} ends before {}'.format(self.name, offset + size))
+        return data
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+class MmapSource(ByteSource):
+    """ A local file, mapped into memory """
+
+    def __init__(self, filename):
+        super().__init__()
+        self.name = filename
+        self.f = open(filename, 'rb')
+        self.size = os.fstat(self.f.fileno()).st_size
+        # an empty file cannot be mapped
+        self.buffer = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def _fetch(self, offset, size):
+        self._count(size)
+        return self.buffer[offset:offset + size]
+
+    def close(self):
+        if self.size:
+            self.buffer.close()
+        self.f.close()
+        super().close()
+
+
+class BytesSource(ByteSource):
+    """ A file held in memory as a bytes-like object """
+
+    def __init__(self, data, name=None):
+        super().__init__()
+        self.name = name
+        self.data = memoryview(data).cast('B')
+        self.size = len(self.data)
+
+    def _fetch(self, offset, size):
+        self._count(size)
+        return self.data[offset:offset + size]
+
+
+class FileObjectSource(ByteSource):
+    """
+    Any other binary file object that can seek, e.g. one given to Mp4File. Its position is shared, so reads from
+    several threads take turns. The file object is left open.
+    """
+
+    def __init__(self, f):
+        super().__init__()
+        self.name = getattr(f, 'name', None)
+        self.f = f
+        self.size = f.seek(0, io.SEEK_END)
+        self.lock = threading.Lock()
+
+    def _fetch(self, offset, size):
+        self._count(size)
+        with self.lock:
+            self.f.seek(offset)
+            data = self.f.read(size)
+        if len(data) != size:
+            raise EOFError('{} ends before {}'.format(self.name, offset + size))
+        return data
+
+
+class RangeListSource(ByteSource):
+    """
+    A file of which only some byte ranges are at hand, e.g. those held by a cache: pieces is an iterable of
+    (offset, bytes-like data). Reads of bytes outside the pieces go to the ByteSource fallback, or raise OSError if
+    there is none. size defaults to that of fallback, or else to the end of the last piece. Small reads are
+    coalesced as in a FileSource when there is a fallback, so that it is not sent the small reads of parsing.
+    """
+    def __init__(self, pieces, size=None, fallback=None, name=None, min_read=DEFAULT_MIN_READ):
+        super().__init__()
+        self.min_read = min_read if fallback is not None else 0
+        self.name = name if name is not None else getattr(fallback, 'name', None)
+        self.pieces = sorted(((offset, memoryview(data).cast('B')) for offset, data in pieces if len(data)),
+                             key=operator.itemgetter(0))
+        self.starts = [offset for offset, data in self.pieces]
+        self.fallback = fallback
+        if size is None:
+            size = fallback.size if fallback is not None else \
+                max((offset + len(data) for offset, data in self.pieces), default=0)
+        self.size = size
+
+    def _fetch(self, offset, size):
+        self._count(size)
+        data = bytearray(size)
+        position = offset
+        end = offset + size
+        i = max(0, bisect.bisect_right(self.starts, offset) - 1)
+        while position < end:
+            piece_start, piece = self.pieces[i] if i < len(self.pieces) else (end, b'')
+            if piece_start + len(piece) <= position:
+                i += 1
+                continue
+            if piece_start > position:
+                # a gap before the next piece
+                gap_end = min(piece_start, end)
+                if self.fallback is None:
+                    raise OSError('bytes {}-{} of {} are not in the byte ranges'.format(position, gap_end - 1,
+                                                                                       self.name))
+                data[position - offset:gap_end - offset] = self.fallback.read_at(position, gap_end - position)
+                position = gap_end
+                continue
+            stop = min(end, piece_start + len(piece))
+            data[position - offset:stop - offset] = piece[position - piece_start:stop - piece_start]
+            position = stop
+        return data
+
+
+def open_source(source):
+    """
+    Returns a context manager giving a ByteSource for source (e.g. the source of an Mp4File): a FileSource for a
+    filename, closed on exit, source itself if it is a ByteSource, or else a FileObjectSource for the binary file
+    object source. Sources that are not opened here are left open.
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        return FileSource(source)
+    return contextlib.nullcontext(source if isinstance(source, ByteSource) else FileObjectSource(source))
+
+
+def plan_reads(ranges, max_gap, max_read):
+    """
+    ranges is an iterable of (offset, size, tag). Generator yielding (run_start, run_end, ranges in the run) for
+    runs of consecutive ranges that can be read together: each starting no more than max_gap bytes after the end of
+    the one before, and the run no longer than max_read bytes (unless a single range is).
+    """
+    pending = []
+    run_start = run_end = 0
+    for offset, size, tag in ranges:
+        if pending and not (run_end <= offset <= run_end + max_gap and offset + size - run_start <= max_read):
+            yield run_start, run_end, pending
+            pending = []
+        if not pending:
+            run_start = run_end = offset
+        pending.append((offset, size, tag))
+        run_end = offset + size
+    if pending:
+        yield run_start, run_end, pending
@@ -0,0 +1,286 @@
+"""
+timeline.py
+
+The presentation timeline of a track: how its edit list ('elst') places its media on the movie timeline, and so when
+each of its samples is presented. A Timeline maps movie time to media time through the edits, media time to the
+sample presented at it through the presentation times of the samples (dts plus composition offset), and every
+sample back to the movie time at which it is first presented. The mappings work on whole arrays of times or
+samples at once, as in analytics.py: with numpy if it is installed, otherwise with map() and bisect.
+
+Movie times are in movie timescale units (from the 'mvhd') and media times in media timescale units (from the
+'mdhd'). An edit with a media_time of -1 is empty: it presents nothing for its segment_duration. A segment_duration
+of 0, as in fragmented files, stands for the rest of the media. Edits are played at their media rate, 1 being normal
+speed and 0 holding the media at media_time for the length of the edit. A track without an 'elst' presents all of
+its media from movie time 0.
+
+get_start_offsets() sums the timelines of a file up: when each track starts, the padding and the media held back
+that make it start then, and the offset between the audio and the video.
+
+"""
+import bisect
+import itertools
+import operator
+from array import array
+from mp4.core import find_box
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# media rates are 16.16 fixed point
+MEDIA_RATE_ONE = 1 << 16
+
+
+def get_edits(track):
+    """
+    Returns the edit list of track as three arrays('q'): segment_duration (movie timescale units), media_time (media
+    timescale units, -1 for an empty edit) and media rate (16.16 fixed point) of each edit
+    """
+    elst = find_box(track.trak, 'elst')
+    if elst is None:
+        return array('q', [0]), array('q', [0]), array('q', [MEDIA_RATE_ONE])
+    columns = elst.box_info['entry_list'].columns
+    rates = map(operator.add, map(operator.lshift, columns['media_rate_integer'], itertools.repeat(16)),
+                map(operator.and_, columns['media_rate_fraction'], itertools.repeat(0xffff)))
+    return array('q', columns['segment_duration']), array('q', columns['media_time']), array('q', rates)
+
+
+class Timeline:
+    """
+    The presentation timeline of track, in a movie of movie_timescale, as described in the module docstring. The
+    track must have samples and a media timescale.
+    """
+
+    def __init__(self, track, movie_timescale):
+        self.track_id = track.track_id
+        self.handler_type = track.handler_type
+        self.movie_timescale = movie_timescale
+        self.media_timescale = track.timescale
+        self.sample_count = track.sample_count
+        self.durations = track.durations
+        self.pts = track.pts
+        # the samples in presentation order; each is presented until the next one, the last for its duration
+        self.presentation_order = _argsort(self.pts)
+        self.sorted_pts = _take(self.pts, self.presentation_order)
+        last = self.presentation_order[-1]
+        self.media_end = self.pts[last] + track.durations[last]
+        self.segment_durations, self.media_times, self.media_rates = get_edits(track)
+        for i, (media_time, media_rate) in enumerate(zip(self.media_times, self.media_rates)):
+            if self.segment_durations[i] == 0 and media_time != -1 and media_rate > 0:
+                # rounded up, so that the edit takes in all of the media
+                self.segment_durations[i] = max(0, -self._to_movie(media_time - self.media_end, media_rate))
+        # the movie time at which each edit starts, and the end of the last
+        self.edit_starts = array('q', itertools.accumulate(self.segment_durations, initial=0))
+        self.duration = self.edit_starts[-1]
+        self._presentation_times = None
+
+    def _to_media(self, movie_duration, media_rate):
+        """ The media played in movie_duration at media_rate, rounded down """
+        if media_rate == MEDIA_RATE_ONE:
+            return movie_duration * self.media_timescale // self.movie_timescale
+        return int(movie_duration * self.media_timescale * media_rate / (self.movie_timescale * MEDIA_RATE_ONE))
+
+    def _to_movie(self, media_duration, media_rate):
+        """ The movie time taken to play media_duration at media_rate (non-zero), rounded down """
+        if media_rate == MEDIA_RATE_ONE:
+            return media_duration * self.movie_timescale // self.media_timescale
+        return int(media_duration * self.movie_timescale * MEDIA_RATE_ONE / (self.media_timescale * media_rate))
+
+    def movie_to_media(self, movie_times):
+        """
+        Returns an array('q') of the media time presented at each of movie_times (an array or list), -1 where an
+        empty edit is presented or the timeline has ended
+        """
+        return self._map_movie_times(movie_times)[0]
+
+    def movie_to_sample(self, movie_times):
+        """ Returns an array('q') of the index of the sample presented at each of movie_times, -1 where none is """
+        media_times, presented = self._map_movie_times(movie_times)
+        samples = self.media_to_sample(media_times)
+        if numpy is not None:
+            np_samples = numpy.frombuffer(samples, dtype=numpy.int64).copy()
+            np_samples[~numpy.frombuffer(presented, dtype=numpy.bool_)] = -1
+            return array('q', np_samples.tobytes())
+        return array('q', [sample if is_presented else -1 for sample, is_presented in zip(samples, presented)])
+
+    def _map_movie_times(self, movie_times):
+        """
+        Returns the media times of movie_times as an array('q'), and a bytearray with a 1 for each one that falls in
+        a non-empty edit (so that a media time of -1 is told from none)
+        """
+        if numpy is not None:
+            times = numpy.asarray(movie_times, dtype=numpy.int64)
+            edits = numpy.searchsorted(numpy.frombuffer(self.edit_starts, dtype=numpy.int64)[1:], times, 'right')
+            media_times = numpy.full(len(times), -1, dtype=numpy.int64)
+            presented = numpy.zeros(len(times), dtype=numpy.bool_)
+            for i, (media_time, media_rate) in enumerate(zip(self.media_times, self.media_rates)):
+                in_edit = (edits == i) & (times >= 0)
+                if media_time == -1 or not in_edit.any():
+                    continue
+                elapsed = times[in_edit] - self.edit_starts[i]
+                if media_rate == MEDIA_RATE_ONE:
+                    elapsed = elapsed * self.media_timescale // self.movie_timescale
+                else:
+                    elapsed = (elapsed * (self.media_timescale * media_rate /
+                                          (self.movie_timescale * MEDIA_RATE_ONE))).astype(numpy.int64)
+                media_times[in_edit] = media_time + elapsed
+                presented |= in_edit
+            return array('q', media_times.tobytes()), bytearray(presented.tobytes())
+        edit_ends = self.edit_starts[1:].tolist()
+        media_times = array('q')
+        presented = bytearray()
+        for movie_time, i in zip(movie_times, map(bisect.bisect_right, itertools.repeat(edit_ends), movie_times)):
+            is_presented = movie_time >= 0 and i < len(edit_ends) and self.media_times[i] != -1
+            media_times.append(self.media_times[i] + self._to_media(movie_time - self.edit_starts[i],
+                                                                    self.media_rates[i]) if is_presented else -1)
+            presented.append(is_presented)
+        return media_times, presented
+
+    def media_to_sample(self, media_times):
+        """
+        Returns an array('q') of the (zero-based, decode order) index of the sample presented at each of media_times,
+        -1 where there is none (before the first sample or after the last)
+        """
+        if numpy is not None:
+            times = numpy.asarray(media_times, dtype=numpy.int64)
+            positions = numpy.searchsorted(numpy.frombuffer(self.sorted_pts, dtype=numpy.int64), times, 'right') - 1
+            samples = numpy.frombuffer(self.presentation_order, dtype=numpy.int64)[numpy.maximum(positions, 0)]
+            samples[(positions < 0) | (times >= self.media_end)] = -1
+            return array('q', samples.tobytes())
+        sorted_pts = self.sorted_pts.tolist()
+        positions = map(bisect.bisect_right, itertools.repeat(sorted_pts), media_times)
+        return array('q', [self.presentation_order[position - 1] if position and media_time < self.media_end
+                           else -1 for position, media_time in zip(positions, media_times)])
+
+    def get_presentation_times(self):
+        """
+        Returns an array('q') of the movie time at which each sample (in decode order) is first presented, -1 for a
+        sample that no edit presents. A sample is presented by an edit if the media it spans (from its presentation
+        time to the next one) overlaps the media of the edit; one that starts before the edit is presented from the
+        start of the edit.
+        """
+        if self._presentation_times is None:
+            self._presentation_times = self._get_presentation_times()
+        return self._presentation_times
+
+    def _get_presentation_times(self):
+        # the end of each sample in presentation order is the start of the next
+        sorted_ends = self.sorted_pts[1:]
+        sorted_ends.append(self.media_end)
+        edits = [(edit_start, media_time, media_rate, media_time + self._to_media(segment_duration, media_rate))
+                 for edit_start, segment_duration, media_time, media_rate in
+                 zip(self.edit_starts, self.segment_durations, self.media_times, self.media_rates)
+                 if media_time != -1]
+        if numpy is not None:
+            pts = numpy.frombuffer(self.sorted_pts, dtype=numpy.int64)
+            ends = numpy.frombuffer(sorted_ends, dtype=numpy.int64)
+            sorted_times = numpy.full(len(pts), -1, dtype=numpy.int64)
+            for edit_start, media_time, media_rate, media_end in edits:
+                if media_rate == 0:
+                    # a dwell presents the one sample at media_time
+                    presented = (pts <= media_time) & (ends > media_time)
+                else:
+                    presented = (pts < media_end) & (ends > media_time)
+                presented &= sorted_times == -1
+                elapsed = numpy.maximum(pts[presented] - media_time, 0) if media_rate else 0
+                if media_rate == MEDIA_RATE_ONE:
+                    elapsed = elapsed * self.movie_timescale // self.media_timescale
+                elif media_rate:
+                    elapsed = (elapsed * (self.movie_timescale * MEDIA_RATE_ONE /
+                                          (self.media_timescale * media_rate))).astype(numpy.int64)
+                sorted_times[presented] = edit_start + elapsed
+            times = numpy.empty(len(pts), dtype=numpy.int64)
+            times[numpy.frombuffer(self.presentation_order, dtype=numpy.int64)] = sorted_times
+            return array('q', times.tobytes())
+        sorted_times = [-1] * self.sample_count
+        for edit_start, media_time, media_rate, media_end in edits:
+            # the samples in presentation order that overlap the edit are a run, found by bisection
+            if media_rate == 0:
+                first = max(0, bisect.bisect_right(self.sorted_pts, media_time) - 1)
+                last = first + 1 if self.sorted_pts[first] <= media_time < sorted_ends[first] else first
+            else:
+                first = bisect.bisect_right(sorted_ends, media_time)
+                last = bisect.bisect_left(self.sorted_pts, media_end)
+            for position in range(first, last):
+                if sorted_times[position] == -1:
+                    elapsed = max(0, self.sorted_pts[position] - media_time)
+                    sorted_times[position] = edit_start + (self._to_movie(elapsed, media_rate) if media_rate else 0)
+        times = array('q', bytes(8 * self.sample_count))
+        for sample, time in zip(self.presentation_order, sorted_times):
+            times[sample] = time
+        return times
+
+    def get_start(self):
+        """
+        Returns a dict describing how the track starts: start_time, the movie time (in seconds) at which its first
+        sample is presented; padding, the length of the empty edits before the first non-empty one; skipped_media,
+        the media before the media_time of that edit, which is never shown (e.g. the priming samples of an audio
+        track); first_sample, the index of the first sample presented; unpresented_samples, the number of samples
+        that no edit presents; and duration, the length of the timeline
+        """
+        times = self.get_presentation_times()
+        first_time = min(filter((-1).__ne__, times), default=None)
+        padding = 0
+        for segment_duration, media_time in zip(self.segment_durations, self.media_times):
+            if media_time != -1:
+                break
+            padding += segment_duration
+        first_media_time = next((media_time for media_time in self.media_times if media_time != -1), None)
+        return {
+            'track_id': self.track_id,
+            'handler_type': self.handler_type,
+            'start_time': None if first_time is None else first_time / self.movie_timescale,
+            'padding': padding / self.movie_timescale,
+            'skipped_media': None if first_media_time is None else
+            max(0, first_media_time - self.sorted_pts[0]) / self.media_timescale,
+            'first_sample': None if first_time is None else times.index(first_time),
+            'unpresented_samples': times.count(-1),
+            'duration': self.duration / self.movie_timescale
+        }
+
+
+def _argsort(values):
+    """ Returns an array('q') of the indices of values in sorted order, keeping equal values in their order """
+    if numpy is not None:
+        return array('q', numpy.argsort(numpy.frombuffer(values, dtype=numpy.int64), kind='stable').tobytes())
+    return array('q', sorted(range(len(values)), key=values.__getitem__))
+
+
+def _take(values, indices):
+    """ Returns an array('q') of values (an array('q')) at each of indices """
+    if numpy is not None:
+        return array('q', numpy.take(numpy.frombuffer(values, dtype=numpy.int64),
+                                     numpy.frombuffer(indices, dtype=numpy.int64)).tobytes())
+    return array('q', map(values.__getitem__, indices))
+
+
+def get_timelines(mp4file, tracks=None):
+    """
+    Returns a Timeline for each of the given tracks of mp4file (default: every track) that has samples and a media
+    timescale. Pass tracks already got from mp4file.get_tracks() to save building their sample index again.
+    """
+    mvhd = find_box(mp4file, 'mvhd')
+    if mvhd is None:
+        # no 'moov', so no tracks
+        return []
+    movie_timescale = mvhd.box_info['timescale']
+    if tracks is None:
+        tracks = mp4file.get_tracks()
+    return [Timeline(track, movie_timescale) for track in tracks if track.sample_count and track.timescale]
+
+
+def get_start_offsets(mp4file, tracks=None):
+    """
+    Returns a dict with the start of each of the given tracks (default: every track; see Timeline.get_start()) and
+    av_offset, the time (in seconds) from the start of the first video track to the start of the first audio track
+    (negative if the audio starts first), None unless there are both
+    """
+    starts = [timeline.get_start() for timeline in get_timelines(mp4file, tracks)]
+    first_starts = {}
+    for start in starts:
+        first_starts.setdefault(start['handler_type'], start['start_time'])
+    audio_start = first_starts.get('soun')
+    video_start = first_starts.get('vide')
+    av_offset = audio_start - video_start if audio_start is not None and video_start is not None else None
+    return {'tracks': starts, 'av_offset': av_offset}
@@ -0,0 +1,365 @@
+"""
+track.py
+
+The boxes describe where each sample of a track lives, but that description is spread over 'stsz', 'stsc' and
+'stco' (or, for fragmented files, over the 'tfhd' and 'trun' boxes of every 'moof'). The Track class pulls it all
+together into flat arrays, one entry per sample, and uses them to read the sample payloads.
+
+"""
+import contextlib
+import heapq
+import itertools
+import operator
+import os
+from array import array
+from mp4.core import find_box, find_boxes
+from mp4.source import plan_reads
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Reads of adjacent samples are merged until they reach this size
+DEFAULT_MAX_READ = 4 * 1024 * 1024
+
+
+# sample_is_non_sync_sample in the sample flags of 'trun', 'tfhd' and 'trex'
+NON_SYNC_FLAG = 0x00010000
+# the sample flags hold the four fields of an 'sdtp' entry in bits 20 to 27
+DEPENDENCY_FLAGS_SHIFT = 20
+
+
+class Track:
+
+    def __init__(self, mp4file, trak):
+        self.mp4file = mp4file
+        self.trak = trak
+        self.track_id = find_box(trak, 'tkhd').box_info['track_ID']
+        hdlr = find_box(trak, 'hdlr')
+        self.handler_type = hdlr.box_info['handler_type'] if hdlr else None
+        mdhd = find_box(trak, 'mdhd')
+        self.timescale = mdhd.box_info['timescale'] if mdhd else None
+        self._index = None
+
+    def _get_column(self, name):
+        if self._index is None:
+            self._build_sample_index()
+        return self._index[name]
+
+    @property
+    def sample_count(self):
+        return len(self.sizes)
+
+    @property
+    def sizes(self):
+        """ array of sample sizes in bytes """
+        return self._get_column('sizes')
+
+    @property
+    def offsets(self):
+        """ array of absolute file offsets, one per sample """
+        return self._get_column('offsets')
+
+    @property
+    def durations(self):
+        """ array of sample durations, in media timescale units """
+        return self._get_column('durations')
+
+    @property
+    def dts(self):
+        """ array of decode times, in media timescale units """
+        return self._get_column('dts')
+
+    @property
+    def composition_offsets(self):
+        """ array of composition time offsets (pts - dts), in media timescale units """
+        return self._get_column('composition_offsets')
+
+    @property
+    def pts(self):
+        """ array('q') of presentation times (dts + composition offset), in media timescale units """
+        dts = self.dts
+        if numpy is not None and len(dts):
+            values = numpy.frombuffer(dts, dtype=numpy.uint64).astype(numpy.int64)
+            values += numpy.frombuffer(self.composition_offsets, dtype=numpy.int64)
+            return array('q', values.tobytes())
+        return array('q', map(operator.add, dts, self.composition_offsets))
+
+    @property
+    def sync(self):
+        """ bytearray with a 1 for every sync sample and a 0 for every other sample """
+        return self._get_column('sync')
+
+    @property
+    def dependencies(self):
+        """
+        bytearray with the dependency flags of every sample laid out as in 'sdtp' (is_leading, sample_depends_on,
+        sample_is_depended_on and sample_has_redundancy, two bits each); 0 where they are not known
+        """
+        return self._get_column('dependencies')
+
+    @property
+    def chunk_offsets(self):
+        """ array of chunk offsets, from 'stco'/'co64' or, in fragments, one chunk per 'trun' """
+        return self._get_column('chunk_offsets')
+
+    @property
+    def chunk_first_samples(self):
+        """ array holding the (zero-based) index of the first sample of each chunk """
+        return self._get_column('chunk_first_samples')
+
+    def get_sync_samples(self):
+        """ Returns a list of the (zero-based) indices of the sync samples """
+        sync = self.sync
+        indices = []
+        i = sync.find(1)
+        while i != -1:
+            indices.append(i)
+            i = sync.find(1, i + 1)
+        return indices
+
+    def get_edit_list(self):
+        """
+        Returns the edit list as a list of (segment_duration, media_time, media_rate) with segment_duration in
+        movie timescale units, media_time in media timescale units (-1 for an empty edit) and media_rate a float.
+        A track without an 'elst' is given a single edit presenting all of the media from time 0.
+        """
+        elst = find_box(self.trak, 'elst')
+        if elst is None:
+            return [(0, 0, 1.0)]
+        return [(entry['segment_duration'], entry['media_time'],
+                 entry['media_rate_integer'] + entry['media_rate_fraction'] / 65536)
+                for entry in elst.box_info['entry_list']]
+
+    def get_trafs(self):
+        """ Generator yielding (moof, traf) for every fragment of this track, in file order """
+        for moof in self.mp4file.child_boxes:
+            if moof.type != 'moof':
+                continue
+            for traf in moof.child_boxes:
+                if traf.type == 'traf' and find_box(traf, 'tfhd').box_info['track_id'] == self.track_id:
+                    yield moof, traf
+
+    def get_trex(self):
+        for trex in find_boxes(self.mp4file, 'trex'):
+            if trex.box_info['track_ID'] == self.track_id:
+                return trex
+        return None
+
+    def set_sample_index(self, columns):
+        """
+        Gives the track samples found some other way than through its boxes, e.g. by scanning the media data.
+        columns is a dict holding every column of _build_sample_index(), by the same names and types.
+        """
+        self._index = columns
+
+    def _build_sample_index(self):
+        self._index = {
+            'sizes': array('Q'),
+            'offsets': array('Q'),
+            'durations': array('Q'),
+            'dts': array('Q'),
+            'composition_offsets': array('q'),
+            'sync': bytearray(),
+            'dependencies': bytearray(),
+            'chunk_offsets': array('Q'),
+            'chunk_first_samples': array('Q')
+        }
+        stbl = find_box(self.trak, 'stbl')
+        if stbl is not None:
+            self._add_stbl_samples(stbl)
+        self._add_fragment_samples()
+
+    def _add_stbl_samples(self, stbl):
+        stsz = find_box(stbl, 'stsz') or find_box(stbl, 'stz2')
+        if stsz is None or stsz.box_info['sample_count'] == 0:
+            return
+        if stsz.box_info.get('sample_size', 0) != 0:
+            sizes = array('Q', [stsz.box_info['sample_size']]) * stsz.box_info['sample_count']
+        else:
+            sizes = array('Q', [entry['entry_size'] for entry in stsz.box_info['entry_list']])
+        stco = find_box(stbl, 'stco') or find_box(stbl, 'co64')
+        chunk_offsets = [entry['chunk_offset'] for entry in stco.box_info['entry_list']]
+        stsc_entries = find_box(stbl, 'stsc').box_info['entry_list']
+        # cumulative sizes let every sample offset be computed as chunk_offset + (bytes before it in its chunk)
+        cum_sizes = array('Q', itertools.accumulate(sizes, initial=0))
+        bases = array('q')
+        first_sample = 0
+        for i, entry in enumerate(stsc_entries):
+            last_chunk = stsc_entries[i + 1]['first_chunk'] - 1 if i + 1 < len(stsc_entries) else len(chunk_offsets)
+            spc = entry['samples_per_chunk']
+            for chunk in range(entry['first_chunk'] - 1, last_chunk):
+                if first_sample >= len(sizes):
+                    break
+                bases.extend(array('q', [chunk_offsets[chunk] - cum_sizes[first_sample]]) * spc)
+                self._index['chunk_offsets'].append(chunk_offsets[chunk])
+                self._index['chunk_first_samples'].append(first_sample)
+                first_sample += spc
+        del bases[len(sizes):]
+        sample_count = len(bases)
+        self._index['sizes'].extend(sizes[:sample_count])
+        self._index['offsets'].extend(map(operator.add, bases, cum_sizes[:sample_count]))
+
+        durations = array('Q')
+        stts = find_box(stbl, 'stts')
+        if stts is not None:
+            durations.extend(_expand_runs(stts.box_info['entry_list'], 'sample_delta'))
+        # pad (or trim) so that every column has one entry per sample
+        durations.extend(array('Q', [durations[-1] if durations else 0]) * (sample_count - len(durations)))
+        del durations[sample_count:]
+        self._index['durations'].extend(durations)
+        self._index['dts'].extend(itertools.accumulate(durations[:-1], initial=0))
+
+        composition_offsets = array('q')
+        ctts = find_box(stbl, 'ctts')
+        if ctts is not None:
+            composition_offsets.extend(_expand_runs(ctts.box_info['entry_list'], 'sample_offset'))
+        composition_offsets.extend(array('q', [0]) * (sample_count - len(composition_offsets)))
+        del composition_offsets[sample_count:]
+        self._index['composition_offsets'].extend(composition_offsets)
+
+        stss = find_box(stbl, 'stss')
+        if stss is None:
+            # no stss means every sample is a sync sample
+            self._index['sync'].extend(b'\x01' * sample_count)
+        else:
+            sync = bytearray(sample_count)
+            for entry in stss.box_info['entry_list']:
+                if 0 < entry['sample_number'] <= sample_count:
+                    sync[entry['sample_number'] - 1] = 1
+            self._index['sync'].extend(sync)
+
+        sdtp = find_box(stbl, 'sdtp')
+        dependencies = bytearray(sdtp.table[:sample_count]) if sdtp is not None else bytearray()
+        dependencies.extend(bytes(sample_count - len(dependencies)))
+        self._index['dependencies'].extend(dependencies)
+
+    def _add_fragment_samples(self):
+        trex = self.get_trex()
+        trex_info = trex.box_info if trex else {}
+        last_moof = None
+        data_end = 0
+        next_dts = self._index['dts'][-1] + self._index['durations'][-1] if self._index['dts'] else 0
+        for moof, traf in self.get_trafs():
+            tfhd = find_box(traf, 'tfhd').box_info
+            if 'base_data_offset' in tfhd:
+                base = tfhd['base_data_offset']
+            elif tfhd['default_base_is_moof'] or moof is not last_moof:
+                base = moof.start_of_box
+            else:
+                # the data of a second traf in a moof follows on from the data of the first
+                base = data_end
+            last_moof = moof
+            tfdt = find_box(traf, 'tfdt')
+            if tfdt is not None:
+                next_dts = tfdt.box_info['baseMediaDecode']
+            default_size = tfhd.get('default_sample_size', trex_info.get('default_sample_size', 0))
+            default_duration = tfhd.get('default_sample_duration', trex_info.get('default_sample_duration', 0))
+            default_flags = int(tfhd.get('default_sample_flags', trex_info.get('default_sample_flags', '0x0')), 16)
+            data_end = base
+            # an 'sdtp' in a 'traf' covers the samples of all its 'trun' boxes in turn
+            sdtp = find_box(traf, 'sdtp')
+            traf_samples = 0
+            for trun in find_boxes(traf, 'trun'):
+                samples = trun.box_info['samples']
+                sample_count = trun.box_info['sample_count']
+                if not sample_count:
+                    continue
+                if 'data_offset' in trun.box_info:
+                    data_end = base + trun.box_info['data_offset']
+                if 'sample_size' in samples[0]:
+                    sizes = array('Q', [sample['sample_size'] for sample in samples])
+                else:
+                    sizes = array('Q', [default_size]) * sample_count
+                if 'sample_duration' in samples[0]:
+                    durations = array('Q', [sample['sample_duration'] for sample in samples])
+                else:
+                    durations = array('Q', [default_duration]) * sample_count
+                if 'sample_composition_time_offset' in samples[0]:
+                    composition_offsets = array('q', [sample['sample_composition_time_offset'] for sample in samples])
+                else:
+                    composition_offsets = array('q', [0]) * sample_count
+                if 'sample_flags' in samples[0]:
+                    flags = [int(sample['sample_flags'], 16) for sample in samples]
+                else:
+                    flags = [default_flags] * sample_count
+                if 'first_sample_flags' in trun.box_info:
+                    flags[0] = int(trun.box_info['first_sample_flags'], 16)
+                sync = bytearray(flag & NON_SYNC_FLAG == 0 for flag in flags)
+                if sdtp is not None:
+                    dependencies = sdtp.table[traf_samples:traf_samples + sample_count]
+                    dependencies += bytes(sample_count - len(dependencies))
+                else:
+                    dependencies = bytes(flag >> DEPENDENCY_FLAGS_SHIFT & 0xff for flag in flags)
+                traf_samples += sample_count
+                self._index['chunk_offsets'].append(data_end)
+                self._index['chunk_first_samples'].append(len(self._index['sizes']))
+                self._index['sizes'].extend(sizes)
+                self._index['offsets'].extend(itertools.accumulate(sizes[:-1], initial=data_end))
+                self._index['durations'].extend(durations)
+                self._index['dts'].extend(itertools.accumulate(durations[:-1], initial=next_dts))
+                self._index['composition_offsets'].extend(composition_offsets)
+                self._index['sync'].extend(sync)
+                self._index['dependencies'].extend(dependencies)
+                data_end += sum(sizes)
+                next_dts += sum(durations)
+
+    def iter_samples(self, max_read=DEFAULT_MAX_READ):
+        """
+        Generator yielding the payload of every sample, in decode order, as a memoryview. Runs of samples that are
+        adjacent in the file are fetched with a single read of up to max_read bytes.
+        """
+        ranges = zip(self.offsets, self.sizes, itertools.repeat(None))
+        for tag, view in read_ranges(self.mp4file.source, ranges, max_read):
+            yield view
+
+
+def _expand_runs(entries, name):
+    """ Iterator over the value of name in each of entries ('stts' or 'ctts'), repeated sample_count times """
+    return itertools.chain.from_iterable(map(itertools.repeat, map(operator.itemgetter(name), entries),
+                                             map(operator.itemgetter('sample_count'), entries)))
+
+
+def iter_samples(mp4file, tracks=None, max_read=DEFAULT_MAX_READ):
+    """
+    Generator yielding (track, sample_index, memoryview) for the samples of all the given tracks (default: every
+    track), interleaved in file order so that the file is read front to back.
+    """
+    if tracks is None:
+        tracks = mp4file.get_tracks()
+    per_track = [zip(track.offsets, track.sizes, zip(itertools.repeat(track), itertools.count()))
+                 for track in tracks]
+    ranges = heapq.merge(*per_track, key=operator.itemgetter(0))
+    for (track, index), view in read_ranges(mp4file.source, ranges, max_read):
+        yield track, index, view
+
+
+def read_ranges(filename, ranges, max_read=DEFAULT_MAX_READ, max_gap=None):
+    """
+    Reads from the file filename, or from filename itself if it is a binary file object that can seek (which is left
+    open). ranges is an iterable of (offset, size, tag). Yields (tag, memoryview) for each range, in the order given.
+    Consecutive ranges are coalesced by source.plan_reads() into one read into a fresh buffer, so the views handed
+    out stay valid after the generator has moved on. Gaps of up to max_gap bytes between them are read through,
+    by default those of up to the coalesce_gap of a byte source, and none in a file.
+    """
+    is_filename = isinstance(filename, (str, bytes, os.PathLike))
+    with open(filename, 'rb', buffering=0) if is_filename else contextlib.nullcontext(filename) as f:
+        if max_gap is None:
+            max_gap = getattr(f, 'coalesce_gap', 0)
+        for run_start, run_end, pending in plan_reads(ranges, max_gap, max_read):
+            yield from _read_run(f, run_start, run_end, pending)
+
+
+def _read_run(f, run_start, run_end, pending):
+    buffer = bytearray(run_end - run_start)
+    f.seek(run_start)
+    view = memoryview(buffer)
+    bytes_read = 0
+    while bytes_read < len(buffer):
+        n = f.readinto(view[bytes_read:])
+        if not n:
+            raise EOFError('sample data at {} is beyond the end of the file'.format(run_start + bytes_read))
+        bytes_read += n
+    for offset, size, tag in pending:
+        yield tag, view[offset - run_start:offset - run_start + size]
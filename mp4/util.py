@@ -1,10 +1,15 @@
 """
 util.py
 
-Utility functions to save me typing struct.unpack all the time.
+Utility functions to save me typing struct.unpack all the time, and BoxReader, which the boxes are decoded with.
+The boxes no longer use the read_* functions, which decode one field per call; they are kept for code outside the
+package and for parse_benchmark.py, which times them against BoxReader.
 
 """
+import functools
 import struct
+import sys
+from array import array
 
 
 def read_u8(fp):
@@ -55,3 +60,149 @@ def read_i8_8(fp):
     return ipart + (fpart / 256)
 
 
+@functools.lru_cache(maxsize=None)
+def get_struct(fmt):
+    """ Returns a compiled struct.Struct for fmt, so that each format is only parsed once """
+    return struct.Struct(fmt)
+
+
+def _make_field_reader(fmt):
+    """ Returns a BoxReader method reading one value of the single-field struct format fmt """
+    unpack_from = get_struct(fmt).unpack_from
+    size = get_struct(fmt).size
+
+    def read_field(self):
+        pos = self.pos
+        if pos + size > self.end:
+            self.overrun(size)
+        self.pos = pos + size
+        return unpack_from(self.data, pos)[0]
+    return read_field
+
+
+class BoxReader:
+    """
+    A cursor over the bytes of a top-level box, read from the file in one go, that stands in for the file object
+    while the box and the boxes inside it are decoded. read(), seek() and tell() work in file offsets, as on the file,
+    and the typed reads (u8() ... i64(), u16_16() etc.) unpack each field in place with a precompiled struct.Struct.
+    u16_array() ... u64_array() and records() decode whole tables at once. A typed read beyond the bytes that were
+    read, i.e. beyond the end of the box or the end of the file if the box is truncated, raises EOFError.
+    """
+    def __init__(self, data, offset=0, file_size=None):
+        """ data holds the bytes of the file from offset onwards; file_size is the size of the whole file """
+        self.data = data
+        self.offset = offset
+        self.end = len(data)
+        self.file_size = offset + len(data) if file_size is None else file_size
+        self.pos = 0
+
+    def tell(self):
+        return self.offset + self.pos
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self.pos = offset - self.offset
+        elif whence == 1:
+            self.pos += offset
+        else:
+            self.pos = self.file_size + offset - self.offset
+        return self.offset + self.pos
+
+    def read(self, size=-1):
+        """ As for a file, returns fewer than size bytes (or none) at the end of the data """
+        start = max(self.pos, 0)
+        end = self.end if size is None or size < 0 else min(start + size, self.end)
+        if end <= start:
+            return b''
+        self.pos = end
+        if start == 0 and end == self.end and isinstance(self.data, bytes):
+            return self.data
+        return bytes(self.data[start:end])
+
+    def read_view(self, size=-1):
+        """ As read(), but if the data is a memoryview, returns a slice of it rather than a copy """
+        if not isinstance(self.data, memoryview):
+            return self.read(size)
+        start = max(self.pos, 0)
+        end = self.end if size is None or size < 0 else min(start + size, self.end)
+        if end <= start:
+            return b''
+        self.pos = end
+        return self.data[start:end]
+
+    def overrun(self, size):
+        raise EOFError('reading {} bytes at {} goes beyond the end of the box data at {}'.format(
+                       size, self.tell(), self.offset + self.end))
+
+    def check(self, size):
+        """ Raises EOFError unless size more bytes can be read """
+        if self.pos < 0 or self.pos + size > self.end:
+            self.overrun(size)
+
+    u8 = _make_field_reader('>B')
+    u16 = _make_field_reader('>H')
+    u32 = _make_field_reader('>I')
+    u64 = _make_field_reader('>Q')
+    i8 = _make_field_reader('>b')
+    i16 = _make_field_reader('>h')
+    i32 = _make_field_reader('>i')
+    i64 = _make_field_reader('>q')
+
+    # fixed point numbers: the whole field divided by the value of its fractional part's bits
+    def u8_8(self):
+        return self.u16() / 256
+
+    def i8_8(self):
+        return self.i16() / 256
+
+    def u16_16(self):
+        return self.u32() / 65536
+
+    def unpack(self, fmt):
+        """ As struct.unpack(fmt, fp.read(struct.calcsize(fmt))) """
+        st = get_struct(fmt)
+        self.check(st.size)
+        values = st.unpack_from(self.data, self.pos)
+        self.pos += st.size
+        return values
+
+    def records(self, fmt, count):
+        """ Returns a list of count tuples, each unpacked from the next record of struct format fmt """
+        st = get_struct(fmt)
+        size = st.size * count
+        self.check(size)
+        if not size:
+            return [()] * count
+        records = list(st.iter_unpack(memoryview(self.data)[self.pos:self.pos + size]))
+        self.pos += size
+        return records
+
+    def _array(self, typecode, count):
+        values = array(typecode)
+        size = values.itemsize * count
+        self.check(size)
+        values.frombytes(memoryview(self.data)[self.pos:self.pos + size])
+        self.pos += size
+        if sys.byteorder == 'little':
+            values.byteswap()
+        return values
+
+    def u8_array(self, count):
+        """ Returns an array('B') of the next count u8 values """
+        return self._array('B', count)
+
+    def u16_array(self, count):
+        """ Returns an array('H') of the next count big-endian u16 values """
+        return self._array('H', count)
+
+    def u32_array(self, count):
+        """ Returns an array('I') of the next count big-endian u32 values """
+        return self._array('I', count)
+
+    def u64_array(self, count):
+        """ Returns an array('Q') of the next count big-endian u64 values """
+        return self._array('Q', count)
+
+    def i32_array(self, count):
+        """ Returns an array('i') of the next count big-endian i32 values """
+        return self._array('i', count)
@@ -0,0 +1,474 @@
+"""
+watch.py
+
+A service that watches directories into which MP4 files are dropped and analyses each file once it has landed.
+Changes are picked up with inotify on Linux (through ctypes, so nothing needs installing), or else by scanning the
+directories every poll interval. A file has landed once its size and modification time have not changed for the
+settle time, so that files still being copied in are left alone. Landed files are parsed with Mp4File in a pool of
+worker processes, with no more than max_in_flight of them handed to the pool at a time; the rest wait in the queue
+of the watcher, which is where a backlog shows. Results go to a sink: NdjsonSink writes one JSON line per file and
+CatalogSink adds the file to the SQLite catalog of catalog.py.
+
+The queue depth, the number of files in flight and processed, and the latency from a file landing to its result
+being written can be read from a small HTTP server, as JSON from /metrics (see serve_metrics()).
+
+"""
+import collections
+import concurrent.futures
+import contextlib
+import ctypes
+import ctypes.util
+import http.server
+import itertools
+import json
+import os
+import select
+import statistics
+import struct
+import sys
+import threading
+import time
+import traceback
+import mp4.catalog
+from mp4.iso import Mp4File
+
+# seconds for which the size and modification time of a file must stay the same before it is analysed
+DEFAULT_SETTLE_TIME = 2.0
+
+# seconds between scans of the directories when inotify is not available, and between checks of settling files
+DEFAULT_POLL_INTERVAL = 1.0
+
+# the latency statistics of the metrics are over this many of the latest files
+METRICS_WINDOW = 1000
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# bytes read from the inotify file descriptor at a time
+INOTIFY_READ_SIZE = 65536
+
+
+class PollingWatcher:
+    """ Finds changed files by scanning the directories, and the directories below them, every poll_interval """
+    name = 'polling'
+
+    def __init__(self, directories, extensions=mp4.catalog.MP4_EXTENSIONS, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.directories = directories
+        self.extensions = extensions
+        self.poll_interval = poll_interval
+        self.next_scan = time.monotonic()
+        self.files = {}
+
+    def scan(self):
+        """ Returns the path of every file in the directories """
+        return mp4.catalog.find_files(self.directories, self.extensions)
+
+    def poll(self, timeout, wake_fd):
+        """
+        Waits up to timeout seconds, or until wake_fd is readable. Returns the paths of the files that are new,
+        changed or gone since the last scan, if it is time for the next one.
+        """
+        select.select([wake_fd], [], [], max(0.0, min(timeout, self.next_scan - time.monotonic())))
+        if time.monotonic() < self.next_scan:
+            return []
+        self.next_scan = time.monotonic() + self.poll_interval
+        files = {}
+        for path in self.scan():
+            state = _get_state(path)
+            if state is not None:
+                files[path] = state
+        changed = [path for path, state in files.items() if self.files.get(path) != state]
+        changed.extend(path for path in self.files if path not in files)
+        self.files = files
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(PollingWatcher):
+    """
+    Finds changed files with inotify, watching each directory below the directories too. Raises OSError if inotify
+    is not available. A directory created later is watched as soon as it appears; the files already in it then, and
+    every file if the kernel queue of events overflowed, are returned as changed.
+    """
+    name = 'inotify'
+
+    def __init__(self, directories, extensions=mp4.catalog.MP4_EXTENSIONS):
+        super().__init__(directories, extensions, None)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        # watch descriptor: directory
+        self.watches = {}
+        for directory in directories:
+            self._add_tree(directory)
+
+    def _add_tree(self, directory):
+        """ Watches directory and the directories below it. Returns the files in them. """
+        found = []
+        for path, directory_names, filenames in os.walk(directory):
+            watch = self.libc.inotify_add_watch(self.fd, os.fsencode(path), INOTIFY_MASK)
+            if watch < 0:
+                raise OSError(ctypes.get_errno(), '{}: {}'.format(path, os.strerror(ctypes.get_errno())))
+            self.watches[watch] = path
+            found.extend(os.path.abspath(os.path.join(path, filename)) for filename in filenames
+                         if filename.lower().endswith(self.extensions))
+        return found
+
+    def poll(self, timeout, wake_fd):
+        """
+        Waits up to timeout seconds for events, or until wake_fd is readable. Returns the paths of the files the
+        events are about, and those of the directories deleted or moved away, ending with a separator.
+        """
+        changed = set()
+        readable, writable, exceptional = select.select([self.fd, wake_fd], [], [], timeout)
+        while self.fd in readable:
+            try:
+                data = os.read(self.fd, INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                break
+            position = 0
+            while position < len(data):
+                watch, mask, cookie, name_size = INOTIFY_EVENT.unpack_from(data, position)
+                position += INOTIFY_EVENT.size
+                name = os.fsdecode(data[position:position + name_size].rstrip(b'\0'))
+                position += name_size
+                if mask & IN_Q_OVERFLOW:
+                    changed.update(self.scan())
+                elif watch in self.watches and name:
+                    path = os.path.abspath(os.path.join(self.watches[watch], name))
+                    if mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            changed.update(self._add_tree(path))
+                        elif mask & (IN_DELETE | IN_MOVED_FROM):
+                            changed.add(os.path.join(path, ''))
+                    elif name.lower().endswith(self.extensions):
+                        changed.add(path)
+        return sorted(changed)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher(directories, extensions=mp4.catalog.MP4_EXTENSIONS, polling=False,
+                poll_interval=DEFAULT_POLL_INTERVAL):
+    """ Returns an InotifyWatcher, or a PollingWatcher if polling is True or inotify is not available """
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directories, extensions)
+        except OSError as e:
+            print('inotify not available ({}), polling instead'.format(e), file=sys.stderr)
+    return PollingWatcher(directories, extensions, poll_interval)
+
+
+def analyze_file(path):
+    """ Returns a summary of the file at path: its size, top-level boxes, tracks and damaged regions """
+    mp4file = Mp4File(path, recover=True)
+    tracks = []
+    for track in mp4file.get_tracks():
+        tracks.append({'track_id': track.track_id, 'handler_type': track.handler_type, 'timescale': track.timescale,
+                       'sample_count': track.sample_count,
+                       'duration': sum(track.durations) / track.timescale if track.timescale else None})
+    return {'size': os.path.getsize(path), 'boxes': [box.type for box in mp4file.child_boxes], 'tracks': tracks,
+            'damaged_regions': mp4file.damaged_regions}
+
+
+class NdjsonSink:
+    """ Writes a JSON line for each file to the text file out: its path, the summary of analyze_file() or error """
+
+    def __init__(self, out):
+        self.out = out
+
+    @staticmethod
+    def analyze(path):
+        return analyze_file(path)
+
+    def is_current(self, path, stat):
+        return False
+
+    def write(self, path, result, error):
+        line = {'path': path}
+        if error is None:
+            line.update(result)
+        else:
+            line['error'] = error
+        self.out.write(json.dumps(line) + '\n')
+
+    def flush(self):
+        self.out.flush()
+
+
+class CatalogSink:
+    """ Adds each file to the catalog in the file database (see catalog.py), skipping files catalogued as they are """
+
+    def __init__(self, database):
+        self.connection = mp4.catalog.open_catalog(database)
+
+    @staticmethod
+    def analyze(path):
+        return mp4.catalog.index_file(path)
+
+    def is_current(self, path, stat):
+        row = self.connection.execute('SELECT size, mtime_ns FROM files WHERE path = ?', (path,)).fetchone()
+        return row == (stat.st_size, stat.st_mtime_ns)
+
+    def write(self, path, result, error):
+        if error is None:
+            mp4.catalog.write_entry(self.connection, result)
+        else:
+            print('Error cataloguing {}\n{}'.format(path, error), file=sys.stderr)
+
+    def flush(self):
+        self.connection.commit()
+
+
+def _analyze(analyze, path):
+    """ Runs analyze(path) in a worker. Returns (result, None), or (None, the traceback) if it raised. """
+    # Mp4File reports decoding errors on stdout, which may be where the results go
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            return analyze(path), None
+        except Exception:
+            return None, traceback.format_exc()
+
+
+class _Landing:
+    """ A file seen to change: its (size, mtime_ns), when it was first seen to change and when it last changed """
+    def __init__(self, state, now):
+        self.state = state
+        self.first_seen = now
+        self.last_change = now
+
+
+class FolderWatcher:
+    """
+    Watches directories and hands each file that lands in them to sink (an NdjsonSink or CatalogSink), as described
+    in the module docstring. Files already in the directories are analysed too if existing is True. run() carries
+    on until stop() is called, from another thread or a signal handler.
+    """
+
+    def __init__(self, directories, sink, max_workers=None, max_in_flight=None, settle_time=DEFAULT_SETTLE_TIME,
+                 poll_interval=DEFAULT_POLL_INTERVAL, existing=False, polling=False,
+                 extensions=mp4.catalog.MP4_EXTENSIONS):
+        self.sink = sink
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or 2 * self.max_workers
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.watcher = get_watcher(directories, extensions, polling, poll_interval)
+        # path: _Landing of the files still settling, then of those that have landed and wait for a worker
+        self.landing = {}
+        self.waiting = collections.OrderedDict()
+        # future: (path, _Landing, time submitted)
+        self.in_flight = {}
+        # path: (size, mtime_ns) of the files done, so that a change that leaves them the same is ignored; a file is
+        # forgotten once it is gone
+        self.done = {}
+        self.processed = 0
+        self.failed = 0
+        self.latencies = collections.deque(maxlen=METRICS_WINDOW)
+        self.processing_times = collections.deque(maxlen=METRICS_WINDOW)
+        self.started = time.monotonic()
+        # guards the counters and statistics read by get_metrics() from the thread of the metrics server
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # written to by stop() and whenever a worker finishes, to end the wait for changes
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_read, False)
+        os.set_blocking(self.wake_write, False)
+        if existing:
+            self._add_changes(self.watcher.scan(), time.monotonic())
+        # for a PollingWatcher the first scan finds every file, which is either queued already or to be left alone
+        self.watcher.poll(0, self.wake_read)
+
+    def run(self):
+        try:
+            with concurrent.futures.ProcessPoolExecutor(self.max_workers) as executor:
+                while not self.stopped.is_set():
+                    changed = self.watcher.poll(self._get_timeout(), self.wake_read)
+                    self._drain_wake()
+                    self._add_changes(changed, time.monotonic())
+                    self._check_landing(time.monotonic())
+                    self._collect()
+                    self._submit(executor)
+                # finish the files already handed to the pool
+                concurrent.futures.wait(self.in_flight)
+                self._collect()
+        finally:
+            self.watcher.close()
+            self.sink.flush()
+            wake_write, self.wake_write = self.wake_write, None
+            os.close(wake_write)
+            os.close(self.wake_read)
+
+    def stop(self):
+        self.stopped.set()
+        self._wake()
+
+    def _wake(self):
+        try:
+            if self.wake_write is not None:
+                os.write(self.wake_write, b'\0')
+        except OSError:
+            # already woken (the pipe is full), or closed at the end of run()
+            pass
+
+    def _drain_wake(self):
+        try:
+            while os.read(self.wake_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _get_timeout(self):
+        """ Returns how long to wait for changes: until the next settling file could land, or poll_interval """
+        if self.waiting and len(self.in_flight) < self.max_in_flight:
+            return 0
+        timeout = self.poll_interval
+        if self.landing:
+            next_landing = min(landing.last_change for landing in self.landing.values()) + self.settle_time
+            timeout = min(timeout, max(0.0, next_landing - time.monotonic()))
+        return timeout
+
+    def _add_changes(self, paths, now):
+        for path in paths:
+            state = _get_state(path)
+            if state is None or path.endswith(os.sep):
+                self._forget(path)
+            elif path in self.landing:
+                if self.landing[path].state != state:
+                    self.landing[path].state = state
+                    self.landing[path].last_change = now
+            elif path not in self.waiting and self.done.get(path) != state:
+                self.landing[path] = _Landing(state, now)
+
+    def _forget(self, path):
+        """ Drops a file that is gone, or every file below a directory that is gone if path ends with a separator """
+        self.landing.pop(path, None)
+        self.done.pop(path, None)
+        if path.endswith(os.sep):
+            for gone in [gone for gone in itertools.chain(self.landing, self.done) if gone.startswith(path)]:
+                self.landing.pop(gone, None)
+                self.done.pop(gone, None)
+
+    def _check_landing(self, now):
+        """ Queues the files that have not changed for the settle time. Settling files are checked without events. """
+        for path, landing in list(self.landing.items()):
+            state = _get_state(path)
+            if state is None:
+                del self.landing[path]
+            elif state != landing.state:
+                landing.state = state
+                landing.last_change = now
+            elif now - landing.last_change >= self.settle_time:
+                del self.landing[path]
+                self.waiting[path] = landing
+
+    def _submit(self, executor):
+        """ Hands waiting files to the pool, as long as there are fewer than max_in_flight in it """
+        while self.waiting and len(self.in_flight) < self.max_in_flight:
+            path, landing = self.waiting.popitem(last=False)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if self.sink.is_current(path, stat):
+                self.done[path] = landing.state
+                continue
+            future = executor.submit(_analyze, self.sink.analyze, path)
+            self.in_flight[future] = (path, landing, time.monotonic())
+            future.add_done_callback(lambda future: self._wake())
+
+    def _collect(self):
+        """ Writes the results of the files in the pool that are done """
+        finished = [future for future in self.in_flight if future.done()]
+        for future in finished:
+            path, landing, submitted = self.in_flight.pop(future)
+            try:
+                result, error = future.result()
+            except Exception:
+                # e.g. the worker process died
+                result, error = None, traceback.format_exc()
+            self.sink.write(path, result, error)
+            # unless it went while in the pool, as then there is no event left to forget it by
+            if _get_state(path) is not None:
+                self.done[path] = landing.state
+            now = time.monotonic()
+            with self.lock:
+                self.processed += 1
+                self.failed += error is not None
+                self.latencies.append(now - landing.first_seen)
+                self.processing_times.append(now - submitted)
+        if finished:
+            self.sink.flush()
+
+    def get_metrics(self):
+        """
+        Returns the metrics served by serve_metrics(), as a dict: the number of files settling, waiting for a worker
+        (queue_depth), in flight and processed, and the statistics of the latency, from a file first being seen to
+        change to its result being written, and of the processing time in the pool, over the latest METRICS_WINDOW
+        files
+        """
+        with self.lock:
+            return {'watcher': self.watcher.name, 'uptime': time.monotonic() - self.started,
+                    'settling': len(self.landing), 'queue_depth': len(self.waiting), 'in_flight': len(self.in_flight),
+                    'max_in_flight': self.max_in_flight, 'processed': self.processed, 'failed': self.failed,
+                    'latency': _get_statistics(self.latencies),
+                    'processing_time': _get_statistics(self.processing_times)}
+
+
+def _get_state(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _get_statistics(values):
+    """ Returns count, mean, p50, p95 and max of values, in seconds """
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    return {'count': len(ordered), 'mean': statistics.fmean(ordered), 'p50': ordered[len(ordered) // 2],
+            'p95': ordered[min(len(ordered) - 1, len(ordered) * 95 // 100)], 'max': ordered[-1]}
+
+
+def serve_metrics(folder_watcher, host='127.0.0.1', port=0):
+    """
+    Serves the metrics of folder_watcher as JSON at http://host:port/metrics from a daemon thread. Returns the
+    server, whose server_address gives the port if port was 0; server.shutdown() stops it.
+    """
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = json.dumps(folder_watcher.get_metrics(), indent=4).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,146 @@
+"""
+writer.py
+
+Helpers for writing MP4 files: building boxes from their payloads, re-assembling a parsed box with some of its
+descendants replaced, and copying byte ranges (typically 'mdat' payload) from one file to another.
+Copies are done by the kernel with os.copy_file_range() or os.sendfile() where the platform supports it, so the
+media data never passes through Python buffers.
+
+"""
+import itertools
+import os
+import sys
+import struct
+from array import array
+
+# size of each read/write when a byte range has to be copied through Python
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def make_box(box_type, payload):
+    """ Returns the bytes of a box with the given type and payload, using a 64-bit size only if it is needed """
+    size = 8 + len(payload)
+    if size > 0xffffffff:
+        return struct.pack('>I4sQ', 1, box_type.encode('utf-8'), size + 8) + payload
+    return struct.pack('>I4s', size, box_type.encode('utf-8')) + payload
+
+
+def make_full_box(box_type, version, flags, payload):
+    return make_box(box_type, struct.pack('>I', version << 24 | flags) + payload)
+
+
+def pack_array(typecode, values):
+    """ Returns values packed as big-endian integers of the given array typecode, e.g. 'I' for 32 bits """
+    packed = array(typecode, values)
+    if sys.byteorder == 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def make_chunk_offset_box(offsets):
+    """ Returns an 'stco' box for the offsets, or a 'co64' box if any of them needs more than 32 bits """
+    if offsets and max(offsets) > 0xffffffff:
+        return make_full_box('co64', 0, 0, struct.pack('>I', len(offsets)) + pack_array('Q', offsets))
+    return make_full_box('stco', 0, 0, struct.pack('>I', len(offsets)) + pack_array('I', offsets))
+
+
+def rebuild_box(box, replacements, additions=None):
+    """
+    Returns the bytes of box with each descendant that is a key of replacements (a dict of box: bytes) replaced by
+    the corresponding bytes, b'' removing it altogether. additions is a dict of box: bytes to be appended after the
+    children of that box. Boxes on the path to a replacement or addition are re-assembled from their own non-box
+    fields followed by their children; everything else is copied unchanged from the parsed file.
+    """
+    additions = additions or {}
+    ancestors = set(additions)
+    for replaced in itertools.chain(replacements, additions):
+        parent = replaced.parent
+        while parent.type != 'file':
+            ancestors.add(parent)
+            parent = parent.parent
+    return _rebuild(box, replacements, additions, ancestors)
+
+
+def _rebuild(box, replacements, additions, ancestors):
+    if box in replacements:
+        return replacements[box]
+    if box not in ancestors:
+        return bytes(box.get_bytes())
+    box_bytes = box.get_bytes()
+    if box.child_boxes:
+        # the non-box fields that come before the first child, e.g. the entry_count of an 'stsd'
+        first_child = box.child_boxes[0].start_of_box - box.start_of_box
+        end_of_children = box.child_boxes[-1].start_of_box + box.child_boxes[-1].size - box.start_of_box
+    else:
+        first_child = end_of_children = box.size
+    payload = bytes(box_bytes[box.header.header_size:first_child])
+    payload += b''.join(_rebuild(child, replacements, additions, ancestors) for child in box.child_boxes)
+    payload += additions.get(box, b'')
+    payload += bytes(box_bytes[end_of_children:])
+    if box.type == 'uuid':
+        payload = box.header.uuid + payload
+    return make_box(box.type, payload)
+
+
+# number of fields preceding the duration in each box with a duration; the first two (creation and modification
+# time) are 64 bits wide in version 1 like the duration, the others are always 32 bits
+_FIELDS_BEFORE_DURATION = {'mvhd': 3, 'mdhd': 3, 'tkhd': 4}
+
+
+def set_duration(box, duration):
+    """
+    Returns the bytes of an 'mvhd', 'mdhd' or 'tkhd' box with its duration replaced, switching to the version 1
+    layout if the duration does not fit in 32 bits
+    """
+    box_bytes = bytes(box.get_bytes())
+    version = box.box_info['version']
+    flags = int(box.box_info['flags'], 16)
+    payload = box_bytes[box.header.header_size + 4:]
+    times_format = '>2Q' if version == 1 else '>2I'
+    times = struct.unpack_from(times_format, payload)
+    position = struct.calcsize(times_format)
+    other_fields = payload[position:position + 4 * (_FIELDS_BEFORE_DURATION[box.type] - 2)]
+    rest = payload[position + len(other_fields) + (8 if version == 1 else 4):]
+    if duration > 0xffffffff:
+        version = 1
+    if version == 1:
+        payload = struct.pack('>2Q', *times) + other_fields + struct.pack('>Q', duration) + rest
+    else:
+        payload = struct.pack('>2I', *times) + other_fields + struct.pack('>I', duration) + rest
+    return make_full_box(box.type, version, flags, payload)
+
+
+def copy_range(src, dst, offset, count):
+    """
+    Copies count bytes, starting at offset in the file object src, to the current position of the file object dst
+    and leaves dst positioned after them.
+    """
+    dst.flush()
+    out_offset = dst.tell()
+    copied = 0
+    try:
+        if hasattr(os, 'copy_file_range'):
+            while copied < count:
+                n = os.copy_file_range(src.fileno(), dst.fileno(), count - copied,
+                                       offset + copied, out_offset + copied)
+                if n == 0:
+                    raise EOFError('source ends before offset {}'.format(offset + copied))
+                copied += n
+        else:
+            os.lseek(dst.fileno(), out_offset, os.SEEK_SET)
+            while copied < count:
+                n = os.sendfile(dst.fileno(), src.fileno(), offset + copied, count - copied)
+                if n == 0:
+                    raise EOFError('source ends before offset {}'.format(offset + copied))
+                copied += n
+    except (AttributeError, OSError):
+        # no kernel-side copy between these files (e.g. Windows, or across some file systems): use a buffer
+        src.seek(offset + copied)
+        dst.seek(out_offset + copied)
+        while copied < count:
+            chunk = src.read(min(COPY_BUFFER_SIZE, count - copied))
+            if not chunk:
+                raise EOFError('source ends before offset {}'.format(offset + copied))
+            dst.write(chunk)
+            copied += len(chunk)
+    dst.seek(out_offset + count)
@@ -183,7 +183,8 @@ class MyApp(Tk):
         logging.debug("Loading file " + filename)
         self.statustext.set("Loading...")
         self.update_idletasks()
-        self.mp4file = mp4.iso.Mp4File(filename)
+        # carry on past damaged parts of the file, rather than showing nothing after the first of them
+        self.mp4file = mp4.iso.Mp4File(filename, recover=True)
         logging.debug("Finished loading file " + filename)
         self.dialog_dir, filename_base = os.path.split(filename)
         self.title("MP4 Analyser" + " - " + filename_base)
@@ -229,7 +230,11 @@ class MyApp(Tk):
                                         ttags = ('error', ) if this_box.trunc() > 0 else ()
                                         self.treenodes.append(self.tree.insert(l6_iid, 'end', l7_iid, text=l7_iid + " " + this_box.type, open=TRUE, tags=ttags))
         logging.debug("Finished populating " + filename)
-        self.statustext.set("")
+        if self.mp4file.damaged_regions:
+            self.statustext.set("Skipped {0} damaged region(s), the first at offset {1}".format(
+                len(self.mp4file.damaged_regions), self.mp4file.damaged_regions[0]['offset']))
+        else:
+            self.statustext.set("")
         if self.treenodes:
             self.findmenu.entryconfigure(self.find_menu, state=NORMAL)
             self.findmenu.entryconfigure(self.find_next_menu, state=NORMAL)
@@ -333,8 +338,9 @@ class MyApp(Tk):
             self.t.insert(END, hdr_str + "\n\n", 'error')
             my_string = ''
         if len(box_selected.box_info) > 0:
-            # insertion order is preserved in modern Python
-            my_string += "Has values:\n" + json.dumps(box_selected.box_info, indent=4) + "\n\n"
+            # insertion order is preserved in modern Python; default=list expands the sample lists that are only
+            # decoded when they are looked at, e.g. in 'senc'
+            my_string += "Has values:\n" + json.dumps(box_selected.box_info, indent=4, default=list) + "\n\n"
         if len(box_selected.child_boxes) > 0:
             my_string += "Has child boxes:\n" + json.dumps([box.type for box in box_selected.child_boxes])
         self.t.insert(END, my_string)
@@ -348,6 +354,8 @@ class MyApp(Tk):
         if len(my_byte_string) > trunc_size:
             my_byte_string = my_byte_string[:trunc_size]
             trunc = True
+        # a memoryview for a file opened with Mp4File.from_buffer()
+        my_byte_string = bytes(my_byte_string)
         hex_string = ' Offset  00 01 02 03 04 05 06 07 08 09 0A 0B 0C 0D 0E 0F 10 11 12 13 14 15 16 17 18 19 1A 1B 1C 1D 1E 1F\n'
         logging.debug("Hex text beginning")
         offset = 0
@@ -0,0 +1,362 @@
+"""
+mp4cli.py
+
+A command line companion to mp4analyser.py, for scripts and batch jobs where a GUI is no use.
+Each sub-command parses one or more MP4 files with the mp4 package and writes its results to stdout as JSON.
+
+Usage: python mp4cli.py <command> [options] file ...
+
+"""
+import argparse
+import json
+import signal
+import sys
+# mp4 is the package that actually parses the mp4 file
+import mp4.iso
+import mp4.analytics
+import mp4.layout
+import mp4.faststart
+import mp4.remux
+import mp4.cut
+import mp4.diff
+import mp4.hashing
+import mp4.manifest
+import mp4.reindex
+import mp4.export
+import mp4.catalog
+import mp4.watch
+import mp4.timeline
+import mp4.drift
+
+# the boxes decoded by the metadata command; everything else is skipped after reading its header
+METADATA_BOX_TYPES = {'ftyp', 'mvhd', 'tkhd', 'mdhd', 'hdlr', 'ilst'}
+
+
+def positive_float(value):
+    """ argparse type for a number of seconds that must be more than 0 """
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError('{} is not more than 0'.format(value))
+    return number
+
+
+def get_tracks(mp4file, track_id):
+    tracks = mp4file.get_tracks()
+    if track_id is not None:
+        tracks = [track for track in tracks if track.track_id == track_id]
+    return tracks
+
+
+def bitrate_command(args):
+    results = {}
+    for filename in args.files:
+        mp4file = mp4.iso.Mp4File(filename)
+        track_stats = []
+        for track in get_tracks(mp4file, args.track):
+            stats = mp4.analytics.analyze_track(track, args.interval, args.window)
+            if not args.intervals:
+                stats.pop('interval_bitrates', None)
+            track_stats.append(stats)
+        results[filename] = track_stats
+    print(json.dumps(results, indent=4))
+
+
+def reorder_command(args):
+    results = {}
+    for filename in args.files:
+        mp4file = mp4.iso.Mp4File(filename)
+        results[filename] = [mp4.analytics.reorder_statistics(track, args.gops) for track in
+                             get_tracks(mp4file, args.track) if args.track is not None or track.handler_type == 'vide']
+    print(json.dumps(results, indent=4))
+
+
+def describe_boxes(parent, box_types):
+    """ Returns the type and box_info of each box of box_types below parent, with the boxes inside it """
+    described = []
+    for box in parent.child_boxes:
+        if box.type in box_types:
+            description = {'type': box.type, 'box_info': box.box_info}
+            if box.child_boxes:
+                description['child_boxes'] = describe_boxes(box, [child.type for child in box.child_boxes])
+            described.append(description)
+        else:
+            described.extend(describe_boxes(box, box_types))
+    return described
+
+
+def metadata_command(args):
+    box_types = METADATA_BOX_TYPES.union(args.box or ())
+    results = {}
+    for filename in args.files:
+        results[filename] = describe_boxes(mp4.iso.Mp4File(filename, include=box_types), box_types)
+    print(json.dumps(results, indent=4, default=list))
+
+
+def scan_command(args):
+    results = {}
+    for filename in args.files:
+        mp4file = mp4.iso.Mp4File(filename, recover=True)
+        results[filename] = {
+            'boxes': [{'offset': box.start_of_box, 'type': box.type, 'size': box.size} for box in mp4file.child_boxes],
+            'damaged_regions': mp4file.damaged_regions
+        }
+    print(json.dumps(results, indent=4))
+
+
+def layout_command(args):
+    results = {}
+    for filename in args.files:
+        results[filename] = mp4.layout.analyze_layout(mp4.iso.Mp4File(filename), args.preroll)
+    print(json.dumps(results, indent=4))
+
+
+def faststart_command(args):
+    rewritten = mp4.faststart.faststart(args.input, args.output)
+    print(json.dumps({'input': args.input, 'output': args.output, 'moov_moved': rewritten}, indent=4))
+
+
+def remux_command(args):
+    result = {'input': args.input, 'output': args.output}
+    if args.progressive:
+        result['track_ids'] = mp4.remux.to_progressive(args.input, args.output)
+    else:
+        result['fragment_count'] = mp4.remux.to_fragmented(args.input, args.output, args.fragment_duration)
+    print(json.dumps(result, indent=4))
+
+
+def cut_command(args):
+    end = args.end if args.duration is None else args.start + args.duration
+    tracks = mp4.cut.cut(args.input, args.output, args.start, end)
+    print(json.dumps({'input': args.input, 'output': args.output, 'start': args.start, 'end': end,
+                      'tracks': tracks}, indent=4))
+
+
+def diff_command(args):
+    result = mp4.diff.diff_files(mp4.iso.Mp4File(args.file_a), mp4.iso.Mp4File(args.file_b), args.payload)
+    print(json.dumps(result, indent=4))
+    return 0 if result['identical'] else 1
+
+
+def hash_command(args):
+    results = {}
+    reference = None
+    if args.reference:
+        reference = mp4.iso.Mp4File(args.reference).hash_tree(args.algorithm, args.block_size, args.workers)
+    for filename in args.files:
+        tree = mp4.iso.Mp4File(filename).hash_tree(args.algorithm, args.block_size, args.workers)
+        result = tree.to_dict() if args.tree else {'digest': tree.hexdigest()}
+        if tree.missing_bytes and not args.tree:
+            # a truncated file
+            result['missing_bytes'] = tree.missing_bytes
+        if reference is not None:
+            result['mismatches'] = list(mp4.hashing.find_mismatches(reference, tree))
+        results[filename] = result
+    print(json.dumps(results, indent=4))
+
+
+def crc_command(args):
+    result = {'input': args.input, 'manifest': args.manifest}
+    result.update(mp4.manifest.write_manifest(mp4.iso.Mp4File(args.input), args.manifest))
+    if args.reference:
+        result['mismatches'] = mp4.manifest.compare_manifests(args.reference, args.manifest)
+    print(json.dumps(result, indent=4))
+
+
+def reindex_command(args):
+    result = {'input': args.input, 'reference': args.reference, 'output': args.output}
+    result.update(mp4.reindex.reindex(args.input, args.reference, args.output))
+    print(json.dumps(result, indent=4))
+
+
+def export_command(args):
+    result = {'input': args.input, 'output': args.output, 'format': args.format}
+    result['rows'] = mp4.export.export_samples(mp4.iso.Mp4File(args.input), args.output, args.format)
+    print(json.dumps(result, indent=4))
+
+
+def catalog_command(args):
+    result = {'database': args.database}
+    if args.files or args.prune:
+        result.update(mp4.catalog.update_catalog(args.database, args.files, args.workers, args.prune))
+    if args.query:
+        result['rows'] = mp4.catalog.query(args.database, args.query)
+    print(json.dumps(result, indent=4, default=bytes.hex))
+
+
+def watch_command(args):
+    if args.catalog:
+        sink = mp4.watch.CatalogSink(args.catalog)
+    else:
+        sink = mp4.watch.NdjsonSink(open(args.output, 'a') if args.output else sys.stdout)
+    watcher = mp4.watch.FolderWatcher(args.directories, sink, args.workers, args.max_in_flight, args.settle,
+                                      args.poll_interval, args.existing, args.polling)
+    if args.metrics_port is not None:
+        server = mp4.watch.serve_metrics(watcher, args.metrics_host, args.metrics_port)
+        print('metrics at http://{}:{}/metrics'.format(*server.server_address[:2]), file=sys.stderr)
+    # stop taking new files, but finish those being analysed
+    signal.signal(signal.SIGINT, lambda signum, frame: watcher.stop())
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    watcher.run()
+
+
+def timeline_command(args):
+    results = {}
+    for filename in args.files:
+        results[filename] = mp4.timeline.get_start_offsets(mp4.iso.Mp4File(filename))
+    print(json.dumps(results, indent=4))
+
+
+def drift_command(args):
+    results = {}
+    for filename in args.files:
+        results[filename] = mp4.drift.analyze_drift(mp4.iso.Mp4File(filename), args.threshold, args.interval)
+    print(json.dumps(results, indent=4))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse MP4 files from the command line')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    bitrate_parser = subparsers.add_parser('bitrate', help='bitrate and GOP statistics per track')
+    bitrate_parser.add_argument('files', nargs='+')
+    bitrate_parser.add_argument('--track', type=int, help='only report on the track with this track_ID')
+    bitrate_parser.add_argument('--interval', type=positive_float, default=1.0,
+                                help='length in seconds of each interval in the bitrate series (default 1)')
+    bitrate_parser.add_argument('--window', type=positive_float, default=1.0,
+                                help='length in seconds of the sliding window used for the peak bitrate (default 1)')
+    bitrate_parser.add_argument('--intervals', action='store_true', help='include the bitrate of every interval')
+    bitrate_parser.set_defaults(func=bitrate_command)
+
+    reorder_parser = subparsers.add_parser('reorder', help='frame reordering and sample dependencies of video tracks')
+    reorder_parser.add_argument('files', nargs='+')
+    reorder_parser.add_argument('--track', type=int, help='only report on the track with this track_ID')
+    reorder_parser.add_argument('--gops', action='store_true', help='include the figures for every GOP')
+    reorder_parser.set_defaults(func=reorder_command)
+
+    metadata_parser = subparsers.add_parser('metadata', help='decode only the boxes holding file and track metadata')
+    metadata_parser.add_argument('files', nargs='+')
+    metadata_parser.add_argument('--box', action='append',
+                                 help='another box type to decode (may be given more than once)')
+    metadata_parser.set_defaults(func=metadata_command)
+
+    scan_parser = subparsers.add_parser('scan', help='top-level boxes of each file, carrying on past damaged regions')
+    scan_parser.add_argument('files', nargs='+')
+    scan_parser.set_defaults(func=scan_command)
+
+    layout_parser = subparsers.add_parser('layout', help='moov placement and interleaving of the tracks')
+    layout_parser.add_argument('files', nargs='+')
+    layout_parser.add_argument('--preroll', type=float, default=0.0,
+                               help='seconds of each track a player needs before it starts (default 0)')
+    layout_parser.set_defaults(func=layout_command)
+
+    faststart_parser = subparsers.add_parser('faststart', help='write a copy of a file with the moov at the front')
+    faststart_parser.add_argument('input')
+    faststart_parser.add_argument('output')
+    faststart_parser.set_defaults(func=faststart_command)
+
+    remux_parser = subparsers.add_parser('remux', help='rewrite a file as progressive or as fragmented')
+    remux_parser.add_argument('input')
+    remux_parser.add_argument('output')
+    layout_group = remux_parser.add_mutually_exclusive_group(required=True)
+    layout_group.add_argument('--fragmented', action='store_true', help='write moof/mdat fragments')
+    layout_group.add_argument('--progressive', action='store_true', help='write a single moov and mdat')
+    remux_parser.add_argument('--fragment-duration', type=float, default=mp4.remux.DEFAULT_FRAGMENT_DURATION,
+                              help='seconds per fragment, each starting on a sync sample (default 2)')
+    remux_parser.set_defaults(func=remux_command)
+
+    cut_parser = subparsers.add_parser('cut', help='write an excerpt of a file, starting on a sync sample')
+    cut_parser.add_argument('input')
+    cut_parser.add_argument('output')
+    cut_parser.add_argument('--start', type=float, default=0.0, help='start of the excerpt in seconds (default 0)')
+    end_group = cut_parser.add_mutually_exclusive_group()
+    end_group.add_argument('--end', type=float, help='end of the excerpt in seconds (default: end of the file)')
+    end_group.add_argument('--duration', type=float, help='length of the excerpt in seconds')
+    cut_parser.set_defaults(func=cut_command)
+
+    diff_parser = subparsers.add_parser('diff', help='box by box differences between two files (exit status 1 if '
+                                                     'they differ)')
+    diff_parser.add_argument('file_a')
+    diff_parser.add_argument('file_b')
+    diff_parser.add_argument('--payload', action='store_true',
+                             help='compare the contents of mdat boxes as well as their sizes')
+    diff_parser.set_defaults(func=diff_command)
+
+    hash_parser = subparsers.add_parser('hash', help='Merkle tree hashes of the boxes of each file')
+    hash_parser.add_argument('files', nargs='+')
+    hash_parser.add_argument('--tree', action='store_true', help='print the hash of every box, not just the root')
+    hash_parser.add_argument('--reference', help='list the boxes and mdat blocks that differ from this file')
+    hash_parser.add_argument('--algorithm', default=mp4.hashing.DEFAULT_ALGORITHM,
+                             help='any hashlib algorithm (default {})'.format(mp4.hashing.DEFAULT_ALGORITHM))
+    hash_parser.add_argument('--block-size', type=int, default=mp4.hashing.DEFAULT_BLOCK_SIZE,
+                             help='bytes per hashed block of mdat (default {})'.format(mp4.hashing.DEFAULT_BLOCK_SIZE))
+    hash_parser.add_argument('--workers', type=int, help='number of hashing threads')
+    hash_parser.set_defaults(func=hash_command)
+
+    crc_parser = subparsers.add_parser('crc', help='write a manifest of the CRC-32 of every sample')
+    crc_parser.add_argument('input')
+    crc_parser.add_argument('manifest', help='file to write the binary manifest to')
+    crc_parser.add_argument('--reference', help='manifest of another copy to compare against')
+    crc_parser.set_defaults(func=crc_command)
+
+    reindex_parser = subparsers.add_parser('reindex', help='rebuild a recording that has no moov, with the tracks of a '
+                                                           'healthy file from the same encoder')
+    reindex_parser.add_argument('input')
+    reindex_parser.add_argument('reference', help='a complete file recorded with the same settings')
+    reindex_parser.add_argument('output')
+    reindex_parser.set_defaults(func=reindex_command)
+
+    export_parser = subparsers.add_parser('export', help='write the sample and chunk tables as binary columns')
+    export_parser.add_argument('input')
+    export_parser.add_argument('output')
+    export_parser.add_argument('--format', choices=mp4.export.EXPORT_FORMATS, default='columns',
+                               help='columns (self-describing, the default) or npz (needs numpy)')
+    export_parser.set_defaults(func=export_command)
+
+    catalog_parser = subparsers.add_parser('catalog', help='index the boxes of files and directories of files in an '
+                                                           'SQLite database, and query it')
+    catalog_parser.add_argument('database')
+    catalog_parser.add_argument('files', nargs='*', help='files, and directories to search for MP4 files, to index '
+                                                         'if new or changed')
+    catalog_parser.add_argument('--workers', type=int, help='number of parsing processes')
+    catalog_parser.add_argument('--prune', action='store_true', help='remove files that no longer exist')
+    catalog_parser.add_argument('--query', help='an SQL statement to run on the database once updated')
+    catalog_parser.set_defaults(func=catalog_command)
+
+    watch_parser = subparsers.add_parser('watch', help='analyse MP4 files as they land in directories, until stopped')
+    watch_parser.add_argument('directories', nargs='+')
+    watch_output = watch_parser.add_mutually_exclusive_group()
+    watch_output.add_argument('--output', help='append a JSON line per file to this file instead of stdout')
+    watch_output.add_argument('--catalog', help='add the files to this SQLite catalog (see the catalog command)')
+    watch_parser.add_argument('--existing', action='store_true', help='also analyse the files already there')
+    watch_parser.add_argument('--settle', type=float, default=mp4.watch.DEFAULT_SETTLE_TIME,
+                              help='seconds a file must stay unchanged before it is analysed (default 2)')
+    watch_parser.add_argument('--poll-interval', type=float, default=mp4.watch.DEFAULT_POLL_INTERVAL,
+                              help='seconds between scans of the directories when polling (default 1)')
+    watch_parser.add_argument('--polling', action='store_true', help='scan the directories instead of using inotify')
+    watch_parser.add_argument('--workers', type=int, help='number of parsing processes')
+    watch_parser.add_argument('--max-in-flight', type=int,
+                              help='most files handed to the parsing processes at a time (default twice the workers)')
+    watch_parser.add_argument('--metrics-port', type=int, help='serve metrics as JSON at /metrics on this port '
+                                                               '(0 for any free port)')
+    watch_parser.add_argument('--metrics-host', default='127.0.0.1')
+    watch_parser.set_defaults(func=watch_command)
+
+    timeline_parser = subparsers.add_parser('timeline', help='when each track starts presenting, after its edit '
+                                                             'list, and the offset between audio and video')
+    timeline_parser.add_argument('files', nargs='+')
+    timeline_parser.set_defaults(func=timeline_command)
+
+    drift_parser = subparsers.add_parser('drift', help='audio/video sync drift from the timestamps, and where it '
+                                                       'exceeds a threshold')
+    drift_parser.add_argument('files', nargs='+')
+    drift_parser.add_argument('--threshold', type=positive_float, default=mp4.drift.DEFAULT_DRIFT_THRESHOLD,
+                              help='drift in seconds, either way, beyond which it is flagged (default 0.04)')
+    drift_parser.add_argument('--interval', type=positive_float, help='also list the drift every this many seconds')
+    drift_parser.set_defaults(func=drift_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
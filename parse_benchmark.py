@@ -0,0 +1,60 @@
+"""
+parse_benchmark.py
+
+Times the parser, to check the effect of changes to it. For each file it reports the best of several full parses
+and, as a micro-benchmark, the time per field of decoding a table of u32 values one field at a time with the util.py
+read functions on the file, one field at a time with a BoxReader, and all at once with BoxReader.u32_array().
+
+Usage: python parse_benchmark.py [--repeat N] file ...
+
+"""
+import argparse
+import io
+import json
+import struct
+import sys
+import timeit
+import mp4.iso
+from mp4.util import BoxReader, read_u32
+
+# number of u32 fields decoded by the micro-benchmark
+FIELD_COUNT = 100000
+
+
+def time_parse(filename, repeat):
+    return min(timeit.repeat(lambda: mp4.iso.Mp4File(filename), number=1, repeat=repeat))
+
+
+def time_fields(repeat):
+    data = struct.pack('>{}I'.format(FIELD_COUNT), *range(FIELD_COUNT))
+
+    def read_file():
+        fp = io.BufferedReader(io.BytesIO(data))
+        for i in range(FIELD_COUNT):
+            read_u32(fp)
+
+    def read_fields():
+        fp = BoxReader(data)
+        for i in range(FIELD_COUNT):
+            fp.u32()
+
+    def read_array():
+        BoxReader(data).u32_array(FIELD_COUNT)
+
+    return {name: min(timeit.repeat(function, number=1, repeat=repeat)) / FIELD_COUNT * 1e9
+            for name, function in [('read_u32_ns', read_file), ('BoxReader.u32_ns', read_fields),
+                                   ('BoxReader.u32_array_ns', read_array)]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the parsing of MP4 files')
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each timing, the best being reported')
+    args = parser.parse_args(argv)
+    results = {'per_field': time_fields(args.repeat)}
+    results['parse_seconds'] = {filename: time_parse(filename, args.repeat) for filename in args.files}
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    sys.exit(main())